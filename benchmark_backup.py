@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""Banc d'essai du pipeline de sauvegarde: images synthétiques, serveur SFTP local et pilote libvirt test:///default
+
+Chaque étape (démarrage de la CLI, conversion, archive, compression, hachage, envoi, vérification sur le serveur,
+restauration, sauvegarde complète) est exécutée dans un processus enfant pour mesurer son débit et son pic de mémoire résidente.
+Les résultats sont ajoutés à un fichier JSON Lines, avec le commit courant, pour comparer les performances d'un
+commit à l'autre.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import paramiko
+from paramiko import (AUTH_SUCCESSFUL, OPEN_SUCCEEDED, SFTP_OK, SFTPAttributes, SFTPHandle, SFTPServer,
+                      SFTPServerInterface, ServerInterface)
+
+from auth_kvm_backup import (CompressionEngine, HashingWriter, KVMBackupEngine, Logger, ParallelUploader, RemoteVerifier,
+                             SparseFile, SSHSessionPool, SSHTransportOptions, StreamingArchiver, StreamingRestorer)
+
+VM_NAME = "benchvm"
+STAGES = ("startup", "convert", "archive", "compress", "hash", "upload", "verify", "restore", "backup")
+BLOCK_SIZE = 1024 * 1024
+# Modules que le démarrage de la CLI ne doit pas charger (GUI et connexions, importés à la demande)
+HEAVY_MODULES = ("tkinter", "paramiko", "libvirt", "crontab", "tarfile")
+
+class SyntheticImage:
+    """Image disque synthétique reproductible: taille, part de trous et compressibilité des blocs de données"""
+    
+    def __init__(self, size_mb, sparsity=0.5, compressibility=0.5, seed=0):
+        if not 0 <= sparsity <= 1 or not 0 <= compressibility <= 1:
+            raise ValueError("sparsity et compressibility doivent être compris entre 0 et 1")
+        self.size = int(size_mb * 1024 * 1024)
+        self.sparsity = sparsity
+        self.compressibility = compressibility
+        self.seed = seed
+    
+    def write_raw(self, path):
+        """Écrire l'image brute bloc par bloc (trous laissés non alloués); retourne les octets alloués"""
+        rng = random.Random(self.seed)
+        pattern = (b"kvm_backup benchmark " * (BLOCK_SIZE // 21 + 1))[:BLOCK_SIZE]
+        allocated = 0
+        with open(path, "wb") as f:
+            for offset in range(0, self.size, BLOCK_SIZE):
+                length = min(BLOCK_SIZE, self.size - offset)
+                if rng.random() < self.sparsity:
+                    continue
+                # Début du bloc répétitif (compressible), fin aléatoire (incompressible)
+                repeated = int(length * self.compressibility)
+                f.seek(offset)
+                f.write(pattern[:repeated] + rng.randbytes(length - repeated))
+                allocated += length
+            f.truncate(self.size)
+        return allocated
+    
+    def create(self, path, image_format="raw"):
+        """Créer l'image au format demandé (qcow2: conversion de l'image brute par qemu-img)"""
+        if image_format == "raw":
+            return self.write_raw(path)
+        if not shutil.which("qemu-img"):
+            raise Exception("Le format qcow2 nécessite qemu-img")
+        raw_path = f"{path}.raw"
+        try:
+            allocated = self.write_raw(raw_path)
+            subprocess.run(["qemu-img", "convert", "-f", "raw", "-O", "qcow2", raw_path, path], check=True)
+        finally:
+            if os.path.exists(raw_path):
+                os.remove(raw_path)
+        return allocated
+
+class LocalSFTPServer:
+    """Serveur SFTP paramiko sur 127.0.0.1 (processus dédié), authentification acceptée sans vérification"""
+    
+    class _Server(ServerInterface):
+        def check_auth_password(self, username, password):
+            return AUTH_SUCCESSFUL
+        
+        def get_allowed_auths(self, username):
+            return "password"
+        
+        def check_channel_request(self, kind, chanid):
+            return OPEN_SUCCEEDED
+        
+        def check_channel_exec_request(self, channel, command):
+            # Commandes de vérification (sha256sum, dd) exécutées localement, comme sur un serveur de backup
+            def execute():
+                result = subprocess.run(command.decode(), shell=True, capture_output=True)
+                channel.sendall(result.stdout)
+                channel.sendall_stderr(result.stderr)
+                channel.send_exit_status(result.returncode)
+                try:
+                    channel.close()
+                except EOFError:
+                    pass  # Le client a refermé la session dès le code de retour reçu
+            threading.Thread(target=execute, daemon=True).start()
+            return True
+    
+    class _Handle(SFTPHandle):
+        def stat(self):
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+    
+    class _SFTP(SFTPServerInterface):
+        """Opérations SFTP servies directement sur le système de fichiers local (chemins absolus)"""
+        
+        def canonicalize(self, path):
+            return os.path.abspath(path)
+        
+        def list_folder(self, path):
+            try:
+                entries = []
+                for name in os.listdir(path):
+                    attributes = SFTPAttributes.from_stat(os.stat(os.path.join(path, name)))
+                    attributes.filename = name
+                    entries.append(attributes)
+                return entries
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+        
+        def stat(self, path):
+            try:
+                return SFTPAttributes.from_stat(os.stat(path))
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+        
+        lstat = stat
+        
+        def open(self, path, flags, attr):
+            try:
+                fd = os.open(path, flags, 0o644)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            if flags & (os.O_WRONLY | os.O_RDWR):
+                mode = ("a" if flags & os.O_APPEND else "r+") + "b"
+            else:
+                mode = "rb"
+            handle = LocalSFTPServer._Handle(flags)
+            handle.filename = path
+            handle.readfile = handle.writefile = os.fdopen(fd, mode)
+            return handle
+        
+        def _call(self, function, *args):
+            try:
+                function(*args)
+            except OSError as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
+        
+        def remove(self, path):
+            return self._call(os.remove, path)
+        
+        def rename(self, oldpath, newpath):
+            return self._call(os.rename, oldpath, newpath)
+        
+        def posix_rename(self, oldpath, newpath):
+            return self._call(os.replace, oldpath, newpath)
+        
+        def mkdir(self, path, attr):
+            return self._call(os.mkdir, path)
+        
+        def rmdir(self, path):
+            return self._call(os.rmdir, path)
+        
+        def chattr(self, path, attr):
+            if attr.st_size is not None:
+                return self._call(os.truncate, path, attr.st_size)
+            return SFTP_OK
+    
+    def __init__(self, window_size=16 * 1024 * 1024):
+        self.window_size = window_size
+        self.port = None
+        self._process = None
+    
+    def start(self):
+        """Lancer le serveur dans un processus enfant (son CPU et sa mémoire restent hors des mesures)"""
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.get_context("fork").Process(target=self._serve, args=(sender,), daemon=True)
+        self._process.start()
+        self.port = receiver.recv()
+        return self
+    
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+    
+    def connect(self):
+        """Fabrique de connexions pour SSHSessionPool (mêmes options de transport que la production)"""
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect("127.0.0.1", port=self.port, username="bench", password="bench", look_for_keys=False,
+                       allow_agent=False, **SSHTransportOptions().connect_kwargs())
+        return client
+    
+    def _serve(self, sender):
+        # Fermetures de connexion en fin d'étape: rien à signaler
+        logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+        host_key = paramiko.RSAKey.generate(2048)
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        sock.listen(16)
+        sender.send(sock.getsockname()[1])
+        while True:
+            connection, _ = sock.accept()
+            transport = paramiko.Transport(connection, default_window_size=self.window_size)
+            transport.add_server_key(host_key)
+            transport.set_subsystem_handler("sftp", SFTPServer, self._SFTP)
+            transport.start_server(server=self._Server())
+
+class BenchmarkRunner:
+    """Exécution des étapes dans des processus enfants et mesure du débit et du pic de mémoire résidente"""
+    
+    def __init__(self, work_dir, args, logger):
+        self.work_dir = work_dir
+        self.args = args
+        self.logger = logger
+        self.image_path = os.path.join(work_dir, "disk.qcow2" if args.format == "qcow2" else "disk.img")
+        self.disk_member = f"{VM_NAME}_{os.path.basename(self.image_path)}"
+        self.remote_dir = os.path.join(work_dir, "server", VM_NAME)
+        self.archive_name = None
+        self.server = None
+        self.xml_config = None
+    
+    @staticmethod
+    def measure(function):
+        """Exécuter function() dans un processus enfant; retourne (secondes, octets traités, pic RSS en Mo)"""
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        
+        def child():
+            try:
+                start = time.perf_counter()
+                processed = function()
+                elapsed = time.perf_counter() - start
+                # ru_maxrss en Kio sous Linux; les enfants couvrent qemu-img
+                peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+                sender.send((elapsed, processed, peak / 1024, None))
+            except BaseException as e:
+                sender.send((None, None, None, f"{type(e).__name__}: {e}"))
+        
+        process = multiprocessing.get_context("fork").Process(target=child)
+        process.start()
+        try:
+            elapsed, processed, peak_mb, error = receiver.recv()
+        except EOFError:
+            elapsed, processed, peak_mb, error = None, None, None, "processus enfant interrompu"
+        process.join()
+        if error:
+            raise Exception(error)
+        return elapsed, processed, peak_mb
+    
+    def prepare(self):
+        """Générer l'image et la configuration XML de la VM de test"""
+        image = SyntheticImage(self.args.size, self.args.sparsity, self.args.compressibility, self.args.seed)
+        allocated = image.create(self.image_path, self.args.format)
+        self.logger.info(f"Image {self.args.format} de {self.args.size} Mo générée ({allocated / BLOCK_SIZE:.0f} Mo alloués)")
+        self.xml_config = (
+            f"<domain type='test'><name>{VM_NAME}</name><memory unit='KiB'>65536</memory>"
+            f"<os><type>hvm</type></os><devices><disk type='file' device='disk'>"
+            f"<driver name='qemu' type='{self.args.format}'/><source file='{self.image_path}'/>"
+            f"<target dev='vda' bus='virtio'/></disk></devices></domain>"
+        )
+        self.archive_name = f"{VM_NAME}_bench.{CompressionEngine.EXTENSIONS[self.args.codec]}"
+        os.makedirs(self.remote_dir, exist_ok=True)
+    
+    def pool(self):
+        return SSHSessionPool(self.server.connect, self.logger, self.args.streams)
+    
+    def unavailable(self, stage):
+        """Raison pour laquelle une étape ne peut pas tourner ici (None si elle le peut)"""
+        if stage in ("convert", "backup") and not shutil.which("qemu-img"):
+            return "qemu-img introuvable"
+        if stage == "backup":
+            try:
+                import libvirt
+                libvirt.open("test:///default").close()
+            except Exception as e:
+                return f"pilote libvirt test:///default indisponible ({e})"
+        return None
+    
+    def run_stage(self, stage):
+        """Mesurer une étape; les étapes dépendantes réutilisent les fichiers produits par les précédentes"""
+        local_archive = os.path.join(self.work_dir, self.archive_name)
+        remote_archive = os.path.join(self.remote_dir, self.archive_name)
+        
+        if stage == "startup":
+            directory = os.path.dirname(os.path.abspath(__file__))
+            check = f"import sys, auth_kvm_backup; sys.exit(', '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules) or None)"
+            loaded = subprocess.run([sys.executable, "-c", check], cwd=directory, capture_output=True, text=True)
+            if loaded.returncode:
+                raise Exception(f"modules chargés dès l'import de auth_kvm_backup: {loaded.stderr.strip()}")
+            
+            def startup():
+                # --help s'arrête après l'analyse des options, comme --list-vms avant son premier appel à libvirt
+                subprocess.run([sys.executable, os.path.join(directory, "auth_kvm_backup.py"), "--help"],
+                               stdout=subprocess.DEVNULL, check=True)
+                return 0
+            return self.measure(startup)
+        
+        if stage == "convert":
+            target = os.path.join(self.work_dir, "converted.qcow2")
+            
+            def convert():
+                subprocess.run(["qemu-img", "convert", "-O", "qcow2", self.image_path, target], check=True)
+                return self.allocated_bytes(self.image_path)
+            return self.measure(convert)
+        
+        if stage == "archive":
+            def archive():
+                sink = CountingSink()
+                with tarfile.open(fileobj=sink, mode="w|", bufsize=CompressionEngine.TAR_BUFFER_SIZE) as tar:
+                    SparseFile.add_to_tar(tar, self.image_path, self.disk_member)
+                return self.allocated_bytes(self.image_path)
+            return self.measure(archive)
+        
+        if stage == "compress":
+            def compress():
+                self.write_archive(local_archive)
+                return self.allocated_bytes(self.image_path)
+            return self.measure(compress)
+        
+        # Les étapes suivantes partent de l'archive: produite hors mesure si compress n'a pas été demandée
+        if stage in ("hash", "upload", "verify", "restore") and not os.path.exists(local_archive):
+            self.write_archive(local_archive)
+        
+        if stage == "hash":
+            def hash_archive():
+                HashingWriter.hash_file(local_archive)
+                return os.path.getsize(local_archive)
+            return self.measure(hash_archive)
+        
+        if stage == "upload":
+            def upload():
+                pool = self.pool()
+                try:
+                    ParallelUploader(pool, self.logger, self.args.streams).upload(local_archive, remote_archive)
+                finally:
+                    pool.close()
+                return os.path.getsize(local_archive)
+            return self.measure(upload)
+        
+        # La racine du serveur local est un répertoire local: archive copiée si l'envoi n'a pas été mesuré
+        if stage in ("verify", "restore") and not os.path.exists(remote_archive):
+            shutil.copyfile(local_archive, remote_archive)
+        
+        if stage == "verify":
+            checksum = HashingWriter.hash_file(local_archive)
+            
+            def verify():
+                pool = self.pool()
+                try:
+                    if not RemoteVerifier(pool, self.logger).verify(remote_archive, os.path.getsize(local_archive), checksum):
+                        raise Exception("le SHA256 calculé sur le serveur diffère de celui de l'archive")
+                finally:
+                    pool.close()
+                return os.path.getsize(local_archive)
+            return self.measure(verify)
+        
+        if stage == "restore":
+            images_dir = os.path.join(self.work_dir, "restored")
+            os.makedirs(images_dir, exist_ok=True)
+            
+            def restore():
+                pool = self.pool()
+                try:
+                    StreamingRestorer(pool, self.logger, images_dir).restore_archive(
+                        remote_archive, self.archive_name, VM_NAME, lambda xml_config: None)
+                finally:
+                    pool.close()
+                return os.path.getsize(remote_archive)
+            result = self.measure(restore)
+            restored = os.path.join(images_dir, self.disk_member)
+            if HashingWriter.hash_file(restored) != HashingWriter.hash_file(self.image_path):
+                raise Exception("le disque restauré diffère de l'image source")
+            return result
+        
+        if stage == "backup":
+            return self.measure(self.full_backup)
+        
+        raise ValueError(f"Étape inconnue: {stage}")
+    
+    def write_archive(self, path):
+        """Archive compressée de la VM de test, écrite par le pipeline de production"""
+        # Moteur propre à chaque appel: aucun thread de compression ne survit dans le processus qui forke
+        compression = CompressionEngine(self.args.codec, threads=self.args.threads)
+        try:
+            with open(path, "wb") as f:
+                StreamingArchiver(self.logger, compression).write_archive(
+                    f, VM_NAME, self.xml_config, [(self.disk_member, self.image_path)])
+        finally:
+            compression.close()
+    
+    def full_backup(self):
+        """Sauvegarde --auto complète d'une VM définie sur le pilote libvirt de test, vers le serveur local"""
+        import libvirt
+        
+        config_path = os.path.join(self.work_dir, "config.json")
+        with open(config_path, "w") as f:
+            json.dump({
+                "libvirt_uri": "test:///default",
+                "backup_host": "127.0.0.1",
+                "backup_user": "bench",
+                "backup_path": os.path.join(self.work_dir, "server"),
+                "compression_codec": self.args.codec,
+                "compression_threads": self.args.threads,
+                "upload_streams": self.args.streams,
+                "history_db": os.path.join(self.work_dir, "history.db"),
+                "catalog_cache": os.path.join(self.work_dir, "catalog.jsonl"),
+                "metrics_textfile": "",
+                "metrics_summary": os.path.join(self.work_dir, "last_job.json"),
+                "use_checkpoints": False
+            }, f)
+        
+        # L'état du pilote test:///default est partagé tant qu'une connexion reste ouverte
+        conn = libvirt.open("test:///default")
+        # Plusieurs VMs (--vms) partagent l'image: le pipeline recouvre la lecture de l'une et l'envoi de la précédente
+        vm_names = [VM_NAME] + [f"{VM_NAME}{index}" for index in range(2, self.args.vms + 1)]
+        domains = [conn.defineXML(self.xml_config.replace(f"<name>{VM_NAME}</name>", f"<name>{vm_name}</name>"))
+                   for vm_name in vm_names]
+        try:
+            engine = KVMBackupEngine(config_path, streaming=self.args.streaming)
+            engine.logger.logger.setLevel(self.logger.logger.level)
+            engine.ssh_pool = self.pool()
+            results = engine.perform_backup_headless(vm_names, "full")
+            if not all(results.get(vm_name) for vm_name in vm_names):
+                raise Exception("la sauvegarde des VMs de test a échoué (voir le journal)")
+        finally:
+            for domain in domains:
+                domain.undefine()
+            conn.close()
+        return self.allocated_bytes(self.image_path) * len(vm_names)
+    
+    @staticmethod
+    def allocated_bytes(path):
+        return os.stat(path).st_blocks * 512
+
+class CountingSink:
+    """Cible d'écriture qui ne garde que le nombre d'octets reçus"""
+    
+    def __init__(self):
+        self.bytes_written = 0
+    
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+def git_revision():
+    """Commit courant et présence de modifications non commitées"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=directory, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=directory,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+
+def load_results(path):
+    results = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    continue  # Ligne tronquée par une exécution interrompue
+    except FileNotFoundError:
+        pass
+    return results
+
+def find_reference(results, params, reference=None):
+    """Dernier résultat de mêmes paramètres, pour le commit demandé (préfixe) ou un commit différent"""
+    current = results[-1] if results else None
+    for result in reversed(results[:-1]):
+        if result.get("params") != params:
+            continue
+        if reference:
+            if (result.get("commit") or "").startswith(reference):
+                return result
+        elif current is None or result.get("commit") != current.get("commit") or current.get("dirty"):
+            return result
+    return None
+
+def print_results(result, reference=None):
+    print(f"{'Étape':<10} {'Secondes':>9} {'Mo/s':>9} {'Pic RSS (Mo)':>13}" + ("   Δ Mo/s   Δ RSS" if reference else ""))
+    for stage, measure in result["stages"].items():
+        if "skipped" in measure:
+            print(f"{stage:<10} ignorée: {measure['skipped']}")
+            continue
+        line = f"{stage:<10} {measure['seconds']:>9.2f} {measure['mb_s']:>9.1f} {measure['peak_rss_mb']:>13.1f}"
+        previous = (reference or {}).get("stages", {}).get(stage)
+        if previous and "mb_s" in previous:
+            if measure["bytes"]:
+                rate_delta = (measure["mb_s"] / previous["mb_s"] - 1) * 100 if previous["mb_s"] else 0.0
+            else:
+                # Étape sans volume (startup): gain en durée, positif quand elle raccourcit
+                rate_delta = (previous["seconds"] / max(measure["seconds"], 1e-6) - 1) * 100
+            line += f"   {rate_delta:+6.1f}%   {measure['peak_rss_mb'] - previous['peak_rss_mb']:+.1f} Mo"
+        print(line)
+    if reference:
+        print(f"Référence: {(reference.get('commit') or '?')[:12]} du {reference.get('date')}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai du pipeline de sauvegarde KVM")
+    parser.add_argument("--size", type=float, default=1024, metavar="MO", help="Taille apparente de l'image (défaut: 1024 Mo)")
+    parser.add_argument("--sparsity", type=float, default=0.5, help="Part de blocs non alloués, de 0 à 1 (défaut: 0.5)")
+    parser.add_argument("--compressibility", type=float, default=0.5,
+                        help="Part compressible de chaque bloc de données, de 0 à 1 (défaut: 0.5)")
+    parser.add_argument("--format", choices=("raw", "qcow2"), default="raw", help="Format de l'image générée (défaut: raw)")
+    parser.add_argument("--codec", choices=tuple(CompressionEngine.EXTENSIONS), default="gzip", help="Codec de compression")
+    parser.add_argument("--threads", type=int, help="Threads de compression (défaut: nombre de cœurs)")
+    parser.add_argument("--streams", type=int, default=4, help="Flux SFTP parallèles pour l'envoi (défaut: 4)")
+    parser.add_argument("--streaming", action="store_true", help="Étape backup en mode flux (--streaming)")
+    parser.add_argument("--vms", type=int, default=1, help="VMs sauvegardées par l'étape backup (défaut: 1)")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Étapes à mesurer (défaut: {','.join(STAGES)})")
+    parser.add_argument("--repeat", type=int, default=1, help="Répétitions par étape, la meilleure est retenue")
+    parser.add_argument("--seed", type=int, default=0, help="Graine du générateur d'images")
+    parser.add_argument("--work-dir", help="Répertoire de travail (défaut: répertoire temporaire supprimé à la fin)")
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_results.jsonl"),
+                        help="Fichier des résultats (JSON Lines, défaut: benchmark_results.jsonl)")
+    parser.add_argument("--compare", nargs="?", const="", metavar="COMMIT",
+                        help="Comparer au dernier résultat de mêmes paramètres (d'un autre commit, ou du COMMIT donné)")
+    parser.add_argument("--verbose", action="store_true", help="Afficher le journal des classes mesurées")
+    args = parser.parse_args()
+    
+    requested = {stage.strip() for stage in args.stages.split(",") if stage.strip()}
+    unknown = requested - set(STAGES)
+    if unknown:
+        parser.error(f"étapes inconnues: {', '.join(sorted(unknown))}")
+    stages = [stage for stage in STAGES if stage in requested]  # Ordre du pipeline
+    
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="kvm_backup_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    logger = Logger("kvm_backup_bench", os.path.join(work_dir, "benchmark.log"))
+    logger.logger.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    
+    runner = BenchmarkRunner(work_dir, args, logger)
+    commit, dirty = git_revision()
+    params = {name: getattr(args, name) for name in ("size", "sparsity", "compressibility", "format", "codec",
+                                                     "threads", "streams", "streaming", "seed")}
+    if args.vms > 1:
+        params["vms"] = args.vms  # Absent à 1: les résultats antérieurs à --vms restent comparables
+    result = {"commit": commit, "dirty": dirty, "date": datetime.now().isoformat(timespec="seconds"),
+              "host": socket.gethostname(), "cpus": os.cpu_count(), "params": params, "stages": {}}
+    
+    try:
+        runner.prepare()
+        if {"upload", "restore", "backup"} & set(stages):
+            runner.server = LocalSFTPServer().start()
+        for stage in stages:
+            reason = runner.unavailable(stage)
+            if reason:
+                result["stages"][stage] = {"skipped": reason}
+                continue
+            # Meilleure des répétitions: la moins perturbée par le reste de la machine
+            runs = [runner.run_stage(stage) for _ in range(max(1, args.repeat))]
+            elapsed, processed, _ = min(runs, key=lambda run: run[0])
+            result["stages"][stage] = {
+                "seconds": round(elapsed, 3),
+                "bytes": processed,
+                "mb_s": round(processed / BLOCK_SIZE / max(elapsed, 1e-6), 1),
+                "peak_rss_mb": round(max(run[2] for run in runs), 1)
+            }
+    except Exception as e:
+        print(f"Erreur: {e}")
+        sys.exit(1)
+    finally:
+        if runner.server is not None:
+            runner.server.stop()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    with open(args.output, "a") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    
+    reference = None
+    if args.compare is not None:
+        reference = find_reference(load_results(args.output), params, args.compare or None)
+        if reference is None:
+            print("Aucun résultat de référence avec les mêmes paramètres")
+    print_results(result, reference)
+
+if __name__ == "__main__":
+    main()
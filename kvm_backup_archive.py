@@ -0,0 +1,591 @@
+"""Archives: hachage au fil de l'écriture, compression parallèle (gzip, zstd), images creuses et tar en flux"""
+import subprocess
+import os
+import errno
+import json
+import shutil
+import hashlib
+import threading
+import queue
+import io
+import time
+import gzip
+import zlib
+from collections import deque
+from contextlib import contextmanager
+
+class HashingWriter:
+    """Tee d'écriture: calcule le SHA256 et compte les octets au passage vers la cible"""
+    
+    def __init__(self, target):
+        self.target = target
+        self.sha256 = hashlib.sha256()
+        self.bytes_written = 0
+        self.cpu_seconds = 0.0
+    
+    def write(self, data):
+        start = time.thread_time()
+        self.sha256.update(data)
+        self.cpu_seconds += time.thread_time() - start
+        self.bytes_written += len(data)
+        self.target.write(data)
+        return len(data)
+    
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+    
+    @staticmethod
+    def hash_file(file_path, buffer_size=1024 * 1024):
+        """Relire un fichier avec un tampon réutilisable (readinto) et retourner son SHA256"""
+        sha256_hash = hashlib.sha256()
+        buffer = bytearray(buffer_size)
+        view = memoryview(buffer)
+        with open(file_path, "rb", buffering=0) as f:
+            while True:
+                read = f.readinto(buffer)
+                if not read:
+                    break
+                sha256_hash.update(view[:read])
+        return sha256_hash.hexdigest()
+
+class BoundedBufferWriter:
+    """Écriture asynchrone via une file bornée (mémoire limitée à max_chunks * chunk_size)"""
+    
+    def __init__(self, target, chunk_size=4 * 1024 * 1024, max_chunks=4, workers=1):
+        self.target = target
+        self.chunk_size = chunk_size
+        self.bytes_written = 0
+        self._buffer = bytearray()
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._error = None
+        self._threads = [threading.Thread(target=self._drain, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+    
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._flush_buffer()
+        return len(data)
+    
+    def close(self):
+        """Vider le tampon et attendre la fin des écritures; relance l'erreur du consommateur"""
+        if self._buffer:
+            self._flush_buffer()
+        for _ in self._threads:
+            self._put(None)
+        for thread in self._threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+    
+    def abort(self):
+        """Arrêter les consommateurs sans attendre (en cas d'erreur côté producteur)"""
+        self._buffer.clear()
+        if self._error is None:
+            self._error = IOError("Écriture interrompue")
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass  # Les consommateurs vident la file et s'arrêteront sur l'erreur
+    
+    def _flush_buffer(self):
+        # Chaque bloc garde son offset dans le flux pour les consommateurs parallèles
+        self._put((self.bytes_written, bytes(self._buffer)))
+        self.bytes_written += len(self._buffer)
+        self._buffer.clear()
+    
+    def _put(self, item):
+        # Ne jamais rester bloqué si un consommateur a échoué
+        while True:
+            if self._error is not None:
+                raise self._error
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+    
+    def _drain(self):
+        self._consume(lambda offset, chunk: self.target.write(chunk))
+    
+    def _consume(self, write):
+        while True:
+            try:
+                item = self._queue.get(timeout=1)
+            except queue.Empty:
+                if self._error is not None:
+                    return
+                continue
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    write(*item)
+                except Exception as e:
+                    self._error = e
+
+class CompressionTuner:
+    """Niveau de compression choisi d'après le débit mesuré du compresseur et celui du lien d'envoi"""
+    
+    LEVELS = {"gzip": (1, 3, 6, 9), "zstd": (1, 3, 6, 9, 12, 19)}
+    
+    def __init__(self, codec, level, threads, link=None, pipelined=False, probe_every=16, window=8):
+        self.levels = self.LEVELS[codec]
+        self._index = min(range(len(self.levels)), key=lambda i: abs(self.levels[i] - level))
+        self.threads = threads
+        self.link = link  # Fournit observed_rate(): octets envoyés par seconde (BandwidthLimiter)
+        self.pipelined = pipelined  # Mode flux: compression et envoi se recouvrent
+        self.probe_every = probe_every
+        self.window = window
+        self._lock = threading.Lock()
+        self._stats = {}  # niveau -> [temps CPU par octet, ratio] (moyennes glissantes)
+        self._blocks = 0
+        self._recorded = 0
+        self._probe_up = True
+    
+    @property
+    def level(self):
+        return self.levels[self._index]
+    
+    def next_levels(self):
+        """Niveaux du prochain bloc: le meilleur connu, plus de temps en temps un voisin mesuré sur le même bloc"""
+        with self._lock:
+            self._blocks += 1
+            if self._link_rate() is None or self._blocks % self.probe_every or len(self.levels) < 2:
+                return [self.level]
+            self._probe_up = not self._probe_up
+            step = 1 if self._probe_up else -1
+            probe = self._index + step if 0 <= self._index + step < len(self.levels) else self._index - step
+            return [self.level, self.levels[probe]]
+    
+    def record(self, level, bytes_in, bytes_out, cpu_seconds):
+        if not bytes_in:
+            return
+        with self._lock:
+            sample = (cpu_seconds / bytes_in, bytes_out / bytes_in)
+            stats = self._stats.get(level)
+            self._stats[level] = list(sample) if stats is None else [0.8 * old + 0.2 * new for old, new in zip(stats, sample)]
+            self._recorded += 1
+            if self._recorded % self.window == 0:
+                self._choose()
+    
+    def _link_rate(self):
+        return self.link.observed_rate() if self.link is not None else None
+    
+    def _choose(self):
+        # Temps par octet d'entrée: compression répartie sur les threads, envoi du résultat compressé
+        link_rate = self._link_rate()
+        if not link_rate:
+            return
+        
+        def cost(level):
+            cpu_per_byte, ratio = self._stats[level]
+            compress, upload = cpu_per_byte / self.threads, ratio / link_rate
+            return max(compress, upload) if self.pipelined else compress + upload
+        
+        best = min(self._stats, key=cost)
+        self._index = self.levels.index(best)
+
+class CompressionEngine:
+    """Compression multi-cœur par blocs indépendants (gzip multi-membres ou trames zstd)"""
+    
+    EXTENSIONS = {"gzip": "tar.gz", "zstd": "tar.zst"}
+    DEFAULT_LEVELS = {"gzip": 6, "zstd": 3}
+    TAR_BUFFER_SIZE = 4 * 1024 * 1024
+    # Au-delà de ce ratio sur l'échantillon, le bloc est stocké tel quel (données chiffrées, médias)
+    INCOMPRESSIBLE_RATIO = 0.97
+    SAMPLE_SIZE = 4096
+    SAMPLES = 4
+    
+    def __init__(self, codec="gzip", level=None, threads=None, block_size=1024 * 1024, detect_incompressible=True,
+                 link=None, pipelined=False):
+        if codec not in self.EXTENSIONS:
+            raise ValueError(f"Codec de compression inconnu: {codec} (disponibles: {', '.join(self.EXTENSIONS)})")
+        if codec == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception("Le codec zstd nécessite le module Python 'zstandard' (pip3 install zstandard)")
+            self._zstd = zstandard
+            self._local = threading.local()
+        
+        self.codec = codec
+        # Niveau absent ou "auto": ajusté pendant la tâche à partir du niveau par défaut
+        adaptive = level in (None, "auto")
+        self.level = self.DEFAULT_LEVELS[codec] if adaptive else int(level)
+        self.threads = max(1, int(threads or os.cpu_count() or 1))
+        self.block_size = block_size
+        self.extension = self.EXTENSIONS[codec]
+        self.detect_incompressible = detect_incompressible
+        self.tuner = CompressionTuner(codec, self.level, self.threads, link, pipelined) if adaptive else None
+        
+        # Pool partagé par toutes les archives de la tâche
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="kvm_compress")
+        self._stats_lock = threading.Lock()
+        self._stats = {"bytes_in": 0, "bytes_out": 0, "seconds": 0.0, "cpu_seconds": 0.0, "archives": 0, "stored_bytes": 0}
+    
+    @classmethod
+    def from_config(cls, config, link=None, pipelined=False):
+        """Construire le moteur depuis les clés compression_* (link: mesure du débit d'envoi pour le niveau adaptatif)"""
+        return cls(
+            codec=config.get("compression_codec", "gzip"),
+            level=config.get("compression_level"),
+            threads=config.get("compression_threads"),
+            block_size=int(config.get("compression_block_size_mb", 1) * 1024 * 1024),
+            detect_incompressible=config.get("compression_detect_incompressible", True),
+            link=link,
+            pipelined=pipelined
+        )
+    
+    def open(self, target):
+        """Retourner un flux d'écriture compressé vers target"""
+        return ParallelCompressor(self, target)
+    
+    @contextmanager
+    def tar_writer(self, target, stats=None):
+        """Ouvrir une archive tar en flux, compressée en parallèle vers target (stats: octets et temps CPU)"""
+        import tarfile
+        compressor = self.open(target)
+        with tarfile.open(fileobj=compressor, mode="w|", bufsize=self.TAR_BUFFER_SIZE,
+                          copybufsize=self.TAR_BUFFER_SIZE) as tar:
+            yield tar
+        compressor.close()
+        if stats is not None:
+            stats.update(bytes_in=compressor.bytes_in, bytes_out=compressor.bytes_out, cpu_seconds=compressor.cpu_seconds)
+    
+    def compress_block(self, block):
+        """Compresser un bloc en membre gzip (ou trame zstd) autonome; stocké tel quel s'il est incompressible"""
+        start = time.thread_time()
+        if self.detect_incompressible and self.incompressible(block):
+            data = self.store_block(block)
+            with self._stats_lock:
+                self._stats["stored_bytes"] += len(block)
+            return data, time.thread_time() - start
+        
+        # Bloc de mesure: comparer deux niveaux sur les mêmes données, garder le plus petit résultat
+        data = None
+        for level in (self.tuner.next_levels() if self.tuner else [self.level]):
+            level_start = time.thread_time()
+            output = self._compress(block, level)
+            if self.tuner:
+                self.tuner.record(level, len(block), len(output), time.thread_time() - level_start)
+            if data is None or len(output) < len(data):
+                data = output
+        return data, time.thread_time() - start
+    
+    def _compress(self, block, level):
+        if self.codec == "gzip":
+            return gzip.compress(block, compresslevel=level, mtime=0)
+        compressors = getattr(self._local, "compressors", None)
+        if compressors is None:
+            compressors = self._local.compressors = {}
+        compressor = compressors.get(level)
+        if compressor is None:
+            compressor = compressors[level] = self._zstd.ZstdCompressor(level=level)
+        return compressor.compress(block)
+    
+    def incompressible(self, block):
+        """Estimer la compressibilité d'un bloc sur quelques échantillons compressés en zlib rapide"""
+        if len(block) <= self.SAMPLE_SIZE * self.SAMPLES:
+            sample = block
+        else:
+            step = (len(block) - self.SAMPLE_SIZE) // (self.SAMPLES - 1)
+            sample = b"".join(block[offset:offset + self.SAMPLE_SIZE] for offset in range(0, step * self.SAMPLES, step))
+        return len(sample) > 0 and len(zlib.compress(sample, 1)) >= len(sample) * self.INCOMPRESSIBLE_RATIO
+    
+    def store_block(self, block):
+        """Bloc non compressé dans le format du codec, lisible par les décompresseurs habituels"""
+        if self.codec == "gzip":
+            # Niveau 0: blocs deflate stockés, seul le CRC32 est calculé
+            return gzip.compress(block, compresslevel=0, mtime=0)
+        # Trame zstd à blocs bruts: en-tête avec la taille du contenu (fenêtre = trame), blocs de 128 Kio au plus
+        frame = [b"\x28\xb5\x2f\xfd", bytes([0xA0]), len(block).to_bytes(4, "little")]
+        offsets = range(0, len(block), 128 * 1024) or [0]
+        for offset in offsets:
+            chunk = block[offset:offset + 128 * 1024]
+            last = offset + 128 * 1024 >= len(block)
+            frame.append(((len(chunk) << 3) | last).to_bytes(3, "little"))
+            frame.append(chunk)
+        return b"".join(frame)
+    
+    def submit(self, block):
+        return self._executor.submit(self.compress_block, block)
+    
+    def record(self, bytes_in, bytes_out, seconds, cpu_seconds):
+        with self._stats_lock:
+            self._stats["bytes_in"] += bytes_in
+            self._stats["bytes_out"] += bytes_out
+            self._stats["seconds"] += seconds
+            self._stats["cpu_seconds"] += cpu_seconds
+            self._stats["archives"] += 1
+    
+    def summary(self):
+        """Résumé du débit de compression pour le journal de fin de tâche"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        if not stats["archives"]:
+            return f"Compression {self.codec}-{self.level}: aucune donnée"
+        mb_in = stats["bytes_in"] / (1024 * 1024)
+        ratio = stats["bytes_out"] / stats["bytes_in"] if stats["bytes_in"] else 0
+        wall_rate = mb_in / stats["seconds"] if stats["seconds"] else 0
+        core_rate = mb_in / stats["cpu_seconds"] if stats["cpu_seconds"] else 0
+        level = f"{self.tuner.level} (adaptatif)" if self.tuner else self.level
+        return (f"Compression {self.codec}-{level} ({self.threads} threads): {mb_in:.1f} MiB en entrée, "
+                f"ratio {ratio:.2f}, {wall_rate:.1f} MiB/s ({core_rate:.1f} MiB/s par cœur), "
+                f"{stats['stored_bytes'] / (1024 * 1024):.1f} MiB incompressibles stockés tels quels")
+    
+    def close(self):
+        self._executor.shutdown(wait=True)
+    
+    @staticmethod
+    def codec_for_archive(archive_name):
+        """Déterminer le codec d'une archive d'après son extension"""
+        for codec, extension in CompressionEngine.EXTENSIONS.items():
+            if archive_name.endswith("." + extension):
+                return codec
+        return None
+    
+    @staticmethod
+    def decompress_block(data):
+        """Décompresser un bloc produit par compress_block (codec reconnu à sa signature)"""
+        if data[:4] == b"\x28\xb5\x2f\xfd":
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+    
+    @staticmethod
+    def open_archive(fileobj, archive_name):
+        """Ouvrir une archive compressée en lecture séquentielle (tarfile en mode flux)"""
+        import tarfile
+        if CompressionEngine.codec_for_archive(archive_name) == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise Exception("La lecture des archives .tar.zst nécessite le module Python 'zstandard'")
+            reader = zstandard.ZstdDecompressor().stream_reader(fileobj, read_across_frames=True)
+            return tarfile.open(fileobj=reader, mode="r|")
+        # GzipFile enchaîne les membres gzip (le mode "r|gz" de tarfile s'arrête au premier)
+        return tarfile.open(fileobj=gzip.GzipFile(fileobj=fileobj, mode="rb"), mode="r|")
+
+class ParallelCompressor:
+    """Flux d'écriture découpé en blocs compressés en parallèle puis réécrits dans l'ordre"""
+    
+    def __init__(self, engine, target):
+        self.engine = engine
+        self.target = target
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._max_pending = engine.threads * 2
+        self.cpu_seconds = 0.0
+        self._start = time.monotonic()
+    
+    def write(self, data):
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.engine.block_size:
+            self._submit(bytes(self._buffer[:self.engine.block_size]))
+            del self._buffer[:self.engine.block_size]
+        return len(data)
+    
+    def close(self):
+        """Compresser le dernier bloc et écrire tous les blocs restants dans l'ordre"""
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._write_next()
+        self.engine.record(self.bytes_in, self.bytes_out, time.monotonic() - self._start, self.cpu_seconds)
+    
+    def _submit(self, block):
+        self._pending.append(self.engine.submit(block))
+        # Borner la mémoire: attendre le plus ancien bloc quand la file est pleine
+        while len(self._pending) > self._max_pending:
+            self._write_next()
+    
+    def _write_next(self):
+        data, cpu_seconds = self._pending.popleft().result()
+        self.cpu_seconds += cpu_seconds
+        self.bytes_out += len(data)
+        self.target.write(data)
+
+class SparseFile:
+    """Lecture des seules plages allouées d'une image (SEEK_DATA/SEEK_HOLE) et recréation des trous"""
+    
+    COPY_SIZE = 4 * 1024 * 1024
+    
+    @staticmethod
+    def extents(fileobj):
+        """Retourner ([(offset, longueur)] des plages de données, taille apparente) d'un fichier ouvert"""
+        fd = fileobj.fileno()
+        size = os.fstat(fd).st_size
+        extents = []
+        offset = 0
+        try:
+            while offset < size:
+                try:
+                    start = os.lseek(fd, offset, os.SEEK_DATA)
+                except OSError as e:
+                    if e.errno == errno.ENXIO:
+                        break  # Plus aucune donnée jusqu'à la fin du fichier
+                    raise
+                end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+                extents.append((start, end - start))
+                offset = end
+        except (OSError, AttributeError):
+            # Système de fichiers sans SEEK_DATA: tout le fichier est considéré comme alloué
+            extents = [(0, size)] if size else []
+        fileobj.seek(0)
+        return extents, size
+    
+    @classmethod
+    def add_to_tar(cls, tar, path, arcname):
+        """Ajouter une image à l'archive; membre creux PAX 1.0 (format GNU) si elle contient des trous"""
+        import tarfile
+        with open(path, "rb") as f:
+            extents, size = cls.extents(f)
+            tarinfo = tar.gettarinfo(arcname=arcname, fileobj=f)
+            allocated = sum(length for _, length in extents)
+            if allocated == size:
+                tar.addfile(tarinfo, f)
+                return allocated
+            
+            # La carte des plages précède les données du membre, complétée au bloc tar
+            sparse_map = extents + ([(size, 0)] if not extents or sum(extents[-1]) < size else [])
+            header = (f"{len(sparse_map)}\n" + "".join(f"{offset}\n{length}\n" for offset, length in sparse_map)).encode()
+            header += b"\0" * (-len(header) % tarfile.BLOCKSIZE)
+            tarinfo.name = f"GNUSparseFile.0/{os.path.basename(arcname)}"
+            tarinfo.size = len(header) + allocated
+            tarinfo.pax_headers = {
+                "GNU.sparse.major": "1",
+                "GNU.sparse.minor": "0",
+                "GNU.sparse.name": arcname,
+                "GNU.sparse.realsize": str(size)
+            }
+            tar.addfile(tarinfo, cls.ExtentReader(f, extents, header))
+            return allocated
+    
+    @classmethod
+    def copy(cls, source_path, target_path):
+        """Copier une image en recréant ses trous (shutil.copy2 les remplirait de zéros)"""
+        with open(source_path, "rb") as source, open(target_path, "wb") as target:
+            extents, size = cls.extents(source)
+            reader = cls.ExtentReader(source, extents)
+            for offset, length in extents:
+                target.seek(offset)
+                while length > 0:
+                    data = reader.read(min(length, cls.COPY_SIZE))
+                    target.write(data)
+                    length -= len(data)
+            target.truncate(size)
+        shutil.copystat(source_path, target_path)
+    
+    class ExtentReader:
+        """Flux séquentiel: en-tête éventuel suivi des seules plages de données"""
+        
+        def __init__(self, fileobj, extents, header=b""):
+            self._pieces = self._generate(fileobj, extents, header)
+            self._buffer = b""
+        
+        def _generate(self, fileobj, extents, header):
+            if header:
+                yield header
+            for offset, length in extents:
+                fileobj.seek(offset)
+                while length > 0:
+                    data = fileobj.read(min(length, SparseFile.COPY_SIZE))
+                    if not data:
+                        raise IOError(f"Fin de fichier inattendue dans {fileobj.name}")
+                    length -= len(data)
+                    yield data
+        
+        def read(self, size=-1):
+            while size < 0 or len(self._buffer) < size:
+                piece = next(self._pieces, None)
+                if piece is None:
+                    break
+                self._buffer = self._buffer + piece if self._buffer else piece
+            if size < 0:
+                size = len(self._buffer)
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+            return data
+
+class StreamingArchiver:
+    """Pipeline en flux: disques -> tar -> compression -> SHA256 -> fichier distant, sans copie locale"""
+    
+    def __init__(self, logger, compression, chunk_size=4 * 1024 * 1024, max_chunks=4):
+        self.logger = logger
+        self.compression = compression
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+    
+    def prepare_disk(self, vm_name, disk_path, temp_dir):
+        """Retourner (nom dans l'archive, fichier source) en évitant la copie locale quand c'est possible"""
+        arcname = f"{vm_name}_{os.path.basename(disk_path)}"
+        if not self._has_backing_file(disk_path):
+            return arcname, disk_path
+        
+        # Chaîne de snapshots: aplatir dans le répertoire temporaire
+        staged_file = os.path.join(temp_dir, arcname)
+        subprocess.run(["qemu-img", "convert", "-O", "qcow2", disk_path, staged_file], check=True)
+        self.logger.info(f"Disque {disk_path} aplati dans {staged_file} avant envoi")
+        return arcname, staged_file
+    
+    def _has_backing_file(self, disk_path):
+        result = subprocess.run(["qemu-img", "info", "--output=json", "--force-share", disk_path],
+                                capture_output=True, text=True, check=True)
+        return bool(json.loads(result.stdout).get("backing-filename"))
+    
+    def write_archive(self, fileobj, vm_name, xml_config, disk_members):
+        """Écrire l'archive compressée de la VM dans fileobj en un seul passage"""
+        import tarfile
+        with self.compression.tar_writer(fileobj) as tar:
+            xml_data = xml_config.encode()
+            xml_info = tarfile.TarInfo(f"{vm_name}.xml")
+            xml_info.size = len(xml_data)
+            xml_info.mtime = int(time.time())
+            xml_info.mode = 0o644
+            tar.addfile(xml_info, io.BytesIO(xml_data))
+            
+            # Seules les plages allouées des images sont lues et archivées
+            for arcname, source_path in disk_members:
+                SparseFile.add_to_tar(tar, source_path, arcname)
+    
+    def upload(self, uploader, remote_dir, archive_name, vm_name, xml_config, disk_members):
+        """Écrire l'archive directement sur le serveur; retourne (checksum, taille de l'archive)"""
+        remote_path = f"{remote_dir}/{archive_name}"
+        # Le flux n'est pas rejouable: pas de reprise, mais l'archive reste en .part jusqu'à la fin
+        part_path = remote_path + uploader.PART_SUFFIX
+        try:
+            remote_stream = uploader.open_stream(part_path, self.chunk_size)
+            hasher = HashingWriter(remote_stream)
+            try:
+                self.write_archive(hasher, vm_name, xml_config, disk_members)
+                remote_stream.close()
+            except BaseException:
+                remote_stream.abort()
+                raise
+            # Flux non rejouable: une archive corrompue sur le serveur ne peut pas être réparée, seulement écartée
+            if uploader.verifier is not None and \
+                    uploader.verifier.verify(part_path, hasher.bytes_written, hasher.hexdigest()) is False:
+                raise Exception(f"Vérification sur le serveur de {archive_name} échouée")
+            with uploader.pool.sftp() as sftp:
+                uploader.commit(sftp, part_path, remote_path)
+        except Exception:
+            # Ne pas laisser une archive tronquée sur le serveur
+            with uploader.pool.sftp() as sftp:
+                try:
+                    sftp.remove(part_path)
+                except IOError:
+                    pass
+            raise
+        
+        # Le sidecar est écrit à partir du condensat calculé au passage
+        checksum = hasher.hexdigest()
+        with uploader.pool.sftp() as sftp, sftp.open(f"{remote_path}.sha256", "w") as checksum_file:
+            checksum_file.write(f"{checksum}  {archive_name}\n")
+        return checksum, hasher.bytes_written
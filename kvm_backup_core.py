@@ -0,0 +1,1473 @@
+"""Moteur de KVM Backup Tool: validation, historique, pipeline de sauvegarde, mode headless et CLI
+
+Le reste est réparti par domaine et importé par les méthodes qui s'en servent: kvm_backup_archive (compression,
+tar), kvm_backup_transfer (SSH/SFTP), kvm_backup_snapshot (points de contrôle), kvm_backup_repository (dépôt
+dédupliqué), kvm_backup_restore, kvm_backup_retention (catalogue, rétention, --scrub), kvm_backup_daemon et
+kvm_backup_gui (interface Tk). Les dépendances lourdes (libvirt, paramiko, tarfile) sont elles aussi importées à la
+demande: chaque point d'entrée ne charge que ce dont il a besoin.
+"""
+import subprocess
+import os
+import fcntl
+from datetime import datetime
+import json
+import shutil
+import logging
+import re
+import xml.etree.ElementTree as ET
+import sys
+import argparse
+import threading
+import queue
+import time
+from contextlib import contextmanager
+
+class InputValidator:
+    """Classe pour valider les entrées utilisateur"""
+    
+    @staticmethod
+    def validate_hostname(hostname):
+        """Valide un nom d'hôte ou une IP"""
+        if not hostname:
+            return False
+        
+        # Vérifier si c'est une IP
+        if '.' in hostname and all(part.isdigit() for part in hostname.split('.')):
+            parts = hostname.split('.')
+            if len(parts) == 4:
+                try:
+                    return all(0 <= int(part) <= 255 for part in parts)
+                except ValueError:
+                    return False
+        
+        # Sinon vérifier le hostname
+        hostname_pattern = r'^[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?(\.[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?)*$'
+        return bool(re.match(hostname_pattern, hostname))
+    
+    @staticmethod
+    def validate_username(username):
+        """Valide un nom d'utilisateur"""
+        if not username:
+            return False
+        # Nom d'utilisateur Linux valide
+        pattern = r'^[a-z_][a-z0-9_-]*[$]?$'
+        return bool(re.match(pattern, username)) and len(username) <= 32
+    
+    @staticmethod
+    def validate_path(path):
+        """Valide un chemin Unix"""
+        if not path:
+            return False
+        # Chemin Unix valide
+        pattern = r'^(/[^/\x00]*)+/?$'
+        return bool(re.match(pattern, path))
+    
+    @staticmethod
+    def validate_cron_expression(cron_expr):
+        """Valide une expression cron"""
+        if not cron_expr:
+            return False
+        parts = cron_expr.split()
+        if len(parts) != 5:
+            return False
+        
+        # Valider chaque partie de l'expression cron
+        patterns = [
+            r'^(\*|([0-5]?[0-9])|(\*/[0-9]+))$',  # minutes (avec support */X)
+            r'^(\*|([01]?[0-9]|2[0-3])|(\*/[0-9]+))$',  # heures (avec support */X)
+            r'^(\*|([1-2]?[0-9]|3[01])|(\*/[0-9]+))$',  # jour du mois (avec support */X)
+            r'^(\*|([1-9]|1[0-2])|(\*/[0-9]+))$',  # mois (avec support */X)
+            r'^(\*|[0-6]|(\*/[0-9]+))$'  # jour de la semaine (avec support */X)
+        ]
+        
+        for i, part in enumerate(parts):
+            if not re.match(patterns[i], part):
+                return False
+        return True
+
+class Logger:
+    """Classe pour gérer le logging professionnel"""
+    
+    def __init__(self, name='kvm_backup', log_file='/var/log/kvm_backup.log'):
+        self.logger = logging.getLogger(name)
+        self.logger.setLevel(logging.INFO)
+        
+        # Créer le répertoire de logs s'il n'existe pas
+        log_dir = os.path.dirname(log_file)
+        if not os.path.exists(log_dir):
+            try:
+                os.makedirs(log_dir)
+            except PermissionError:
+                # Fallback vers le répertoire utilisateur
+                log_file = os.path.expanduser('~/kvm_backup.log')
+        
+        # Handler pour fichier avec rotation
+        try:
+            from logging.handlers import RotatingFileHandler
+            file_handler = RotatingFileHandler(
+                log_file, maxBytes=10*1024*1024, backupCount=5
+            )
+            file_handler.setLevel(logging.INFO)
+            file_formatter = logging.Formatter(
+                '%(asctime)s - %(levelname)s - %(message)s'
+            )
+            file_handler.setFormatter(file_formatter)
+            self.logger.addHandler(file_handler)
+        except PermissionError:
+            pass  # Si on ne peut pas écrire les logs, on continue sans
+        
+        # Handler pour console
+        console_handler = logging.StreamHandler()
+        console_handler.setLevel(logging.INFO)
+        console_formatter = logging.Formatter('%(levelname)s: %(message)s')
+        console_handler.setFormatter(console_formatter)
+        self.logger.addHandler(console_handler)
+    
+    def info(self, message):
+        self.logger.info(message)
+    
+    def error(self, message):
+        self.logger.error(message)
+    
+    def warning(self, message):
+        self.logger.warning(message)
+    
+    def debug(self, message):
+        self.logger.debug(message)
+
+class ResourceSlots:
+    """Limites de concurrence par ressource (lecture disque, compression, transfert)"""
+    
+    RESOURCES = ("disk_read", "compression", "upload")
+    
+    def __init__(self, disk_read=1, compression=1, upload=1):
+        limits = {"disk_read": disk_read, "compression": compression, "upload": upload}
+        self.limits = {name: max(1, int(value)) for name, value in limits.items()}
+        self._semaphores = {name: threading.BoundedSemaphore(value) for name, value in self.limits.items()}
+        self._local = threading.local()
+    
+    @classmethod
+    def from_config(cls, config, jobs):
+        """Construire les limites depuis la configuration (par défaut bornées par le nombre de tâches)"""
+        return cls(
+            disk_read=config.get("disk_read_slots", min(jobs, 2)),
+            compression=config.get("compression_slots", min(jobs, os.cpu_count() or 1)),
+            upload=config.get("upload_slots", min(jobs, 2))
+        )
+    
+    @contextmanager
+    def acquire(self, resource):
+        """Réserver un emplacement pour la ressource donnée pendant la durée du bloc"""
+        semaphore = self._semaphores[resource]
+        stages = getattr(self._local, "stages", None)
+        requested = time.monotonic()
+        semaphore.acquire()
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            semaphore.release()
+            if stages is not None:
+                wait, held = stages.get(resource, (0.0, 0.0))
+                stages[resource] = (wait + acquired - requested, held + time.monotonic() - acquired)
+    
+    def start_tracking(self, stages=None):
+        """Mesurer, pour le thread courant, l'attente et le temps passé sur chaque ressource (cumulés dans `stages`)"""
+        self._local.stages = {} if stages is None else stages
+    
+    def stop_tracking(self):
+        """Retourner {ressource: (attente, durée)} mesuré depuis start_tracking"""
+        stages = getattr(self._local, "stages", None) or {}
+        self._local.stages = None
+        return stages
+    
+    def __str__(self):
+        return ", ".join(f"{name}={self.limits[name]}" for name in self.RESOURCES)
+
+class StageMetrics:
+    """Mesures par étape et par VM/disque (temps réel, temps CPU, octets) exportées pour node_exporter et en JSON"""
+    
+    PREFIX = "kvm_backup"
+    
+    def __init__(self):
+        self.started = time.time()
+        self.samples = []
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def stage(self, vm_name, stage, disk=""):
+        """Chronométrer un bloc; l'appelant renseigne bytes_in/bytes_out (et cpu_seconds s'il le connaît mieux)"""
+        sample = {"vm": vm_name, "disk": disk, "stage": stage, "bytes_in": 0, "bytes_out": 0, "cpu_seconds": None}
+        start = time.monotonic()
+        cpu_start = time.thread_time()
+        try:
+            yield sample
+        finally:
+            sample["seconds"] = time.monotonic() - start
+            if sample["cpu_seconds"] is None:
+                sample["cpu_seconds"] = time.thread_time() - cpu_start
+            with self._lock:
+                self.samples.append(sample)
+    
+    def add(self, vm_name, stage, seconds, cpu_seconds, bytes_in, bytes_out, disk=""):
+        """Enregistrer une étape mesurée ailleurs (hachage au fil de l'écriture)"""
+        with self._lock:
+            self.samples.append({"vm": vm_name, "disk": disk, "stage": stage, "seconds": seconds,
+                                 "cpu_seconds": cpu_seconds, "bytes_in": bytes_in, "bytes_out": bytes_out})
+    
+    @staticmethod
+    def run(command, sample):
+        """Exécuter une commande externe; son temps CPU exact (utilisateur + système) est relevé par wait4"""
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = process.stderr.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        sample["cpu_seconds"] = usage.ru_utime + usage.ru_stime
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+    
+    def totals(self):
+        """Agréger les mesures par (vm, disque, étape)"""
+        totals = {}
+        with self._lock:
+            for sample in self.samples:
+                key = (sample["vm"], sample["disk"], sample["stage"])
+                total = totals.setdefault(key, {"seconds": 0.0, "cpu_seconds": 0.0, "bytes_in": 0, "bytes_out": 0})
+                for field in total:
+                    total[field] += sample[field] or 0
+        return totals
+    
+    def write_textfile(self, path, results):
+        """Écrire le fichier .prom du collecteur textfile de node_exporter (remplacement atomique)"""
+        metrics = {
+            "stage_seconds": ("gauge", "Temps réel passé dans l'étape"),
+            "stage_cpu_seconds": ("gauge", "Temps CPU consommé par l'étape"),
+            "stage_bytes_in": ("gauge", "Octets lus par l'étape"),
+            "stage_bytes_out": ("gauge", "Octets produits par l'étape"),
+            "stage_throughput_bytes_per_second": ("gauge", "Débit de l'étape (octets lus par seconde)"),
+        }
+        lines = []
+        totals = self.totals()
+        for name, (metric_type, help_text) in metrics.items():
+            lines.append(f"# HELP {self.PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {self.PREFIX}_{name} {metric_type}")
+            for (vm_name, disk, stage), total in sorted(totals.items()):
+                if name == "stage_throughput_bytes_per_second":
+                    value = total["bytes_in"] / total["seconds"] if total["seconds"] > 0 else 0.0
+                else:
+                    value = total[name[len("stage_"):]]
+                lines.append(f"{self.PREFIX}_{name}{{{self._labels(vm=vm_name, disk=disk, stage=stage)}}} {value}")
+        
+        finished = time.time()
+        lines += [
+            f"# HELP {self.PREFIX}_vm_success Dernière sauvegarde de la VM réussie (1) ou en échec (0)",
+            f"# TYPE {self.PREFIX}_vm_success gauge",
+        ] + [f"{self.PREFIX}_vm_success{{{self._labels(vm=vm_name)}}} {int(bool(ok))}" for vm_name, ok in sorted(results.items())] + [
+            f"# HELP {self.PREFIX}_job_duration_seconds Durée de la dernière tâche",
+            f"# TYPE {self.PREFIX}_job_duration_seconds gauge",
+            f"{self.PREFIX}_job_duration_seconds {finished - self.started}",
+            f"# HELP {self.PREFIX}_job_last_run_timestamp_seconds Fin de la dernière tâche (horodatage Unix)",
+            f"# TYPE {self.PREFIX}_job_last_run_timestamp_seconds gauge",
+            f"{self.PREFIX}_job_last_run_timestamp_seconds {finished}",
+        ]
+        self._write_atomic(path, "\n".join(lines) + "\n")
+    
+    def write_summary(self, path, results):
+        """Résumé JSON de la tâche: résultats par VM et mesures agrégées par étape"""
+        summary = {
+            "started": self.started, "finished": time.time(), "results": results,
+            "stages": [dict(vm=vm_name, disk=disk, stage=stage, **total) for (vm_name, disk, stage), total in sorted(self.totals().items())]
+        }
+        self._write_atomic(path, json.dumps(summary, indent=2, ensure_ascii=False))
+    
+    @staticmethod
+    def _labels(**labels):
+        escaped = {name: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for name, value in labels.items()}
+        return ",".join(f'{name}="{value}"' for name, value in escaped.items())
+    
+    @staticmethod
+    def _write_atomic(path, content):
+        path = os.path.expanduser(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+class BackupHistory:
+    """Historique local des sauvegardes (SQLite): tâches, VMs, disques, durées des étapes, volumes et checksums"""
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY, started REAL NOT NULL, finished REAL, mode TEXT, backup_type TEXT,
+            vm_count INTEGER, succeeded INTEGER, failed INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS vm_backups (
+            id INTEGER PRIMARY KEY, job_id INTEGER NOT NULL REFERENCES jobs(id), vm TEXT NOT NULL,
+            status TEXT NOT NULL, backup_type TEXT, archive TEXT, started REAL NOT NULL, duration REAL,
+            size INTEGER, checksum TEXT, parent TEXT, error TEXT
+        );
+        CREATE TABLE IF NOT EXISTS disks (
+            backup_id INTEGER NOT NULL REFERENCES vm_backups(id), path TEXT NOT NULL,
+            virtual_size INTEGER, allocated INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS stages (
+            backup_id INTEGER NOT NULL REFERENCES vm_backups(id), stage TEXT NOT NULL, wait REAL, seconds REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_vm_backups_last ON vm_backups(vm, status, started);
+        CREATE INDEX IF NOT EXISTS idx_vm_backups_started ON vm_backups(started, status);
+        CREATE INDEX IF NOT EXISTS idx_vm_backups_job ON vm_backups(job_id);
+        CREATE INDEX IF NOT EXISTS idx_disks_backup ON disks(backup_id);
+        CREATE TABLE IF NOT EXISTS scrub (
+            path TEXT PRIMARY KEY, vm TEXT NOT NULL, size INTEGER, mtime INTEGER, verified REAL, status TEXT,
+            seconds REAL, error TEXT, resume INTEGER DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_stages_backup ON stages(backup_id);
+        CREATE INDEX IF NOT EXISTS idx_scrub_verified ON scrub(verified, mtime);
+    """
+    
+    class Record:
+        """Données d'une VM collectées pendant sa sauvegarde"""
+        
+        def __init__(self, vm_name):
+            self.vm_name = vm_name
+            self.started = time.time()
+            self.duration = None
+            self.disks = []
+            self.entry = None
+            self.error = None
+            self.ok = False
+            self.stages = {}  # Durées hors ressources: gel de l'invité, fusion de l'instantané
+    
+    def __init__(self, logger, path="~/.kvm_backup_history.db"):
+        self.logger = logger
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        # Connexion partagée entre les threads de sauvegarde, accès sérialisés par le verrou
+        import sqlite3
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(self.SCHEMA)
+        try:
+            # Base créée avant la reprise du contrôle au milieu d'une archive
+            self._db.execute("ALTER TABLE scrub ADD COLUMN resume INTEGER DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # Colonne déjà présente
+    
+    @classmethod
+    def from_config(cls, logger, config):
+        return cls(logger, config.get("history_db", "~/.kvm_backup_history.db"))
+    
+    def close(self):
+        self._db.close()
+    
+    def start_job(self, mode, backup_type, vm_count):
+        with self._lock, self._db:
+            return self._db.execute("INSERT INTO jobs (started, mode, backup_type, vm_count) VALUES (?, ?, ?, ?)",
+                                    (time.time(), mode, backup_type, vm_count)).lastrowid
+    
+    def finish_job(self, job_id, results):
+        succeeded = sum(1 for ok in results.values() if ok)
+        try:
+            with self._lock, self._db:
+                self._db.execute("UPDATE jobs SET finished = ?, succeeded = ?, failed = ? WHERE id = ?",
+                                 (time.time(), succeeded, len(results) - succeeded, job_id))
+        except Exception as e:
+            self.logger.warning(f"Historique non mis à jour pour la tâche {job_id}: {str(e)}")
+    
+    def record_vm(self, job_id, record, stages):
+        entry = record.entry or {}
+        disks = []
+        for disk_path in record.disks:
+            try:
+                stat = os.stat(disk_path)
+                disks.append((disk_path, stat.st_size, stat.st_blocks * 512))
+            except OSError:
+                disks.append((disk_path, None, None))
+        try:
+            with self._lock, self._db:
+                backup_id = self._db.execute(
+                    "INSERT INTO vm_backups (job_id, vm, status, backup_type, archive, started, duration, size, checksum, parent, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, record.vm_name, "ok" if record.ok else "failed", entry.get("type"), entry.get("archive"),
+                     record.started, record.duration, entry.get("size"), entry.get("checksum"), entry.get("parent"), record.error)
+                ).lastrowid
+                self._db.executemany("INSERT INTO disks (backup_id, path, virtual_size, allocated) VALUES (?, ?, ?, ?)",
+                                     [(backup_id,) + disk for disk in disks])
+                self._db.executemany("INSERT INTO stages (backup_id, stage, wait, seconds) VALUES (?, ?, ?, ?)",
+                                     [(backup_id, stage, wait, seconds) for stage, (wait, seconds) in stages.items()])
+        except Exception as e:
+            self.logger.warning(f"Historique non mis à jour pour {record.vm_name}: {str(e)}")
+    
+    def last_good(self):
+        """Dernière sauvegarde réussie de chaque VM: [(vm, date, type, archive, taille)]"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT vm, MAX(started), backup_type, archive, size FROM vm_backups "
+                "WHERE status = 'ok' GROUP BY vm ORDER BY vm"
+            ).fetchall()
+    
+    def upload_rate(self, limit=10):
+        """Débit d'envoi moyen (octets/s) des dernières sauvegardes réussies, None sans historique"""
+        with self._lock:
+            size, seconds = self._db.execute(
+                "SELECT SUM(size), SUM(seconds) FROM (SELECT b.size, s.seconds FROM vm_backups b "
+                "JOIN stages s ON s.backup_id = b.id AND s.stage = 'upload' "
+                "WHERE b.status = 'ok' AND b.size > 0 AND s.seconds > 0 ORDER BY b.started DESC LIMIT ?)",
+                (limit,)
+            ).fetchone()
+        return size / seconds if size and seconds else None
+    
+    def slowest(self, days=30, limit=10):
+        """VMs les plus lentes sur la période: [(vm, durée moyenne, durée max, sauvegardes)]"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT vm, AVG(duration), MAX(duration), COUNT(*) FROM vm_backups "
+                "WHERE started >= ? AND status = 'ok' GROUP BY vm ORDER BY AVG(duration) DESC LIMIT ?",
+                (time.time() - days * 86400, limit)
+            ).fetchall()
+    
+    def live_stalls(self, days=30):
+        """Temps d'arrêt des sauvegardes à chaud par VM: [(vm, gel max, gel moyen, pivot max, fusion max)]"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT b.vm, MAX(CASE WHEN s.stage = 'freeze' THEN s.seconds END), "
+                "AVG(CASE WHEN s.stage = 'freeze' THEN s.seconds END), "
+                "MAX(CASE WHEN s.stage = 'pivot' THEN s.seconds END), MAX(CASE WHEN s.stage = 'commit' THEN s.seconds END) "
+                "FROM vm_backups b JOIN stages s ON s.backup_id = b.id AND s.stage IN ('freeze', 'pivot', 'commit') "
+                "WHERE b.started >= ? GROUP BY b.vm ORDER BY 2 DESC",
+                (time.time() - days * 86400,)
+            ).fetchall()
+    
+    def scrub_sync(self, archives):
+        """Aligner la table de contrôle sur les archives du serveur; une archive modifiée redevient à vérifier"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO scrub (path, vm, size, mtime) VALUES (?, ?, ?, ?) ON CONFLICT(path) DO UPDATE SET "
+                "verified = CASE WHEN size = excluded.size AND mtime = excluded.mtime THEN verified END, "
+                "status = CASE WHEN size = excluded.size AND mtime = excluded.mtime THEN status END, "
+                "resume = CASE WHEN size = excluded.size AND mtime = excluded.mtime THEN resume ELSE 0 END, "
+                "size = excluded.size, mtime = excluded.mtime",
+                archives
+            )
+            present = {path for path, _, _, _ in archives}
+            gone = [(path,) for path, in self._db.execute("SELECT path FROM scrub") if path not in present]
+            self._db.executemany("DELETE FROM scrub WHERE path = ?", gone)
+    
+    def scrub_queue(self):
+        """Archives dans l'ordre de contrôle: (chemin, taille, offset de reprise); contrôle interrompu, jamais vérifiées, puis
+        les moins récemment vérifiées"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT path, size, COALESCE(resume, 0) FROM scrub "
+                "ORDER BY COALESCE(resume, 0) = 0, verified IS NOT NULL, verified, mtime"
+            ).fetchall()
+    
+    def record_scrub(self, path, status, seconds, error=None):
+        try:
+            with self._lock, self._db:
+                self._db.execute("UPDATE scrub SET verified = ?, status = ?, seconds = ?, error = ?, resume = 0 WHERE path = ?",
+                                 (time.time(), status, seconds, error, path))
+        except Exception as e:
+            self.logger.warning(f"Historique de contrôle non mis à jour pour {path}: {str(e)}")
+    
+    def record_scrub_progress(self, path, offset):
+        """Position atteinte dans une archive dont le contrôle a été interrompu par le budget"""
+        try:
+            with self._lock, self._db:
+                self._db.execute("UPDATE scrub SET resume = ? WHERE path = ?", (offset, path))
+        except Exception as e:
+            self.logger.warning(f"Historique de contrôle non mis à jour pour {path}: {str(e)}")
+    
+    def scrub_summary(self):
+        """(archives, jamais vérifiées, plus ancienne vérification, [(chemin, statut, erreur)] en échec)"""
+        with self._lock:
+            total, never, oldest = self._db.execute(
+                "SELECT COUNT(*), SUM(verified IS NULL), MIN(verified) FROM scrub"
+            ).fetchone()
+            failed = self._db.execute(
+                "SELECT path, status, error FROM scrub WHERE status IN ('corrupt', 'error') ORDER BY path"
+            ).fetchall()
+        return total, never or 0, oldest, failed
+    
+    def growth(self, days=30):
+        """Croissance des sauvegardes complètes sur la période: [(vm, première taille, dernière taille, octets/jour)]"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT vm, started, size FROM vm_backups WHERE started >= ? AND status = 'ok' "
+                "AND backup_type IN ('full', 'repository') AND size IS NOT NULL ORDER BY vm, started",
+                (time.time() - days * 86400,)
+            ).fetchall()
+        first, last = {}, {}
+        for vm_name, started, size in rows:
+            first.setdefault(vm_name, (started, size))
+            last[vm_name] = (started, size)
+        growth = []
+        for vm_name, (start, first_size) in first.items():
+            end, last_size = last[vm_name]
+            rate = (last_size - first_size) / ((end - start) / 86400) if end > start else 0.0
+            growth.append((vm_name, first_size, last_size, rate))
+        return sorted(growth, key=lambda row: row[3], reverse=True)
+
+class ProgressMeter:
+    """Avancement d'une étape (octets traités, débit, temps restant) transmis au plus toutes les `interval` secondes"""
+    
+    QEMU_PROGRESS = re.compile(rb"\((\d+(?:\.\d+)?)/100%\)")
+    
+    def __init__(self, callback, vm_name, stage, total=None, interval=0.5):
+        self.callback = callback
+        self.vm_name = vm_name
+        self.stage = stage
+        self.total = total
+        self.interval = interval
+        self._start = time.monotonic()
+        self._last = 0.0
+        self._lock = threading.Lock()
+    
+    def update(self, done):
+        now = time.monotonic()
+        finished = self.total is not None and done >= self.total
+        with self._lock:
+            if not finished and now - self._last < self.interval:
+                return
+            self._last = now
+        rate = done / max(now - self._start, 1e-6)
+        eta = (self.total - done) / rate if self.total and rate > 0 else None
+        self.callback(self.vm_name, self.stage, done, self.total, rate, eta)
+    
+    def run_qemu_img(self, command):
+        """Exécuter `qemu-img convert -p` en suivant le pourcentage affiché (rapporté à self.total)"""
+        import tempfile
+        # Erreurs dans un fichier temporaire: un tube lu après stdout bloquerait qemu-img s'il en écrit beaucoup
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(command[:2] + ["-p"] + command[2:], stdout=subprocess.PIPE, stderr=errors)
+            buffer = b""
+            for data in iter(lambda: process.stdout.read1(4096), b""):
+                # La progression est réécrite sur place (retour chariot)
+                buffer = (buffer + data)[-256:]
+                matches = self.QEMU_PROGRESS.findall(buffer)
+                if matches and self.total:
+                    self.update(int(float(matches[-1]) * self.total / 100))
+            if process.wait() != 0:
+                # Seule la fin des messages est conservée pour l'erreur
+                errors.seek(max(0, errors.seek(0, os.SEEK_END) - 4096))
+                raise subprocess.CalledProcessError(process.returncode, command, stderr=errors.read())
+
+class BackupPipeline:
+    """Sauvegarde de plusieurs VMs en pipeline: lecture des disques, compression et envoi reliés par des files bornées
+    
+    Chaque étape a ses propres threads, autant que d'emplacements pour sa ressource: la lecture de la VM suivante
+    recouvre la compression et l'envoi des précédentes. Moteur commun à l'interface graphique et au mode headless;
+    `owner` fournit config, logger, ssh_pool, bandwidth, checkpoints et live; les envois vers le serveur sont faits
+    ici, journalisés et affichés par `notify` dans les deux modes.
+    """
+    
+    # Étapes (nom, ressource dont le nombre d'emplacements fixe le nombre de threads) de chaque mode
+    STAGES = {
+        "staged": (("read", "disk_read"), ("archive", "compression"), ("upload", "upload")),
+        # Flux et dépôt lisent, compressent et envoient en un seul passage: seule la préparation est recouverte
+        "streaming": (("read", "disk_read"), ("stream", "upload")),
+        "repository": (("read", "disk_read"), ("store", "upload"))
+    }
+    LABELS = {"read": "lecture", "archive": "compression", "upload": "envoi", "stream": "flux", "store": "dépôt"}
+    
+    class Job:
+        """État d'une VM transmis d'une étape à l'autre"""
+        
+        def __init__(self, vm_name, temp_root):
+            self.vm_name = vm_name
+            self.record = BackupHistory.Record(vm_name)
+            self.resources = {}  # {ressource: (attente, durée)} cumulé sur toutes les étapes
+            self.temp_dir = os.path.join(temp_root, vm_name)
+            self.start = time.monotonic()
+            self.queued = self.start
+            self.domain = None
+            self.live = None
+            self.checkpoint = None
+            self.chain_info = None
+            self.exported = None
+    
+    def __init__(self, owner, conn, backup_type, temp_root, slots, compression, metrics, mode="staged",
+                 repository=None, depth=1, notify=None, progress=None):
+        self.owner = owner
+        self.logger = owner.logger
+        self.config = owner.config
+        self.conn = conn
+        self.backup_type = backup_type
+        self.temp_root = temp_root
+        self.slots = slots
+        self.compression = compression
+        self.metrics = metrics
+        self.mode = mode
+        self.repository = repository
+        self.depth = max(1, int(depth))
+        self.notify = notify  # Console de l'interface graphique
+        self.progress = progress  # Cadre « Progression » de l'interface graphique
+        self.stages = self.STAGES[mode]
+        self.workers = [slots.limits[resource] for _, resource in self.stages]
+        self.results = {}
+        self.busy = {name: 0.0 for name, _ in self.stages}
+        self.elapsed = 0.0
+        self._history = None
+        self._job_id = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, owner, conn, backup_type, temp_root, slots, compression, metrics, mode="staged", repository=None,
+                    notify=None, progress=None):
+        return cls(owner, conn, backup_type, temp_root, slots, compression, metrics, mode, repository,
+                   depth=owner.config.get("pipeline_depth", 1), notify=notify, progress=progress)
+    
+    def run(self, vm_names, history=None, job_id=None):
+        """Sauvegarder les VMs dans l'ordre donné; une VM en échec n'interrompt pas les autres. Retourne {vm: succès}"""
+        self._history, self._job_id = history, job_id
+        start = time.monotonic()
+        # Files entre étapes bornées: les fichiers temporaires en attente restent limités à `depth` VMs par étape
+        inboxes = [queue.Queue()] + [queue.Queue(maxsize=self.depth) for _ in self.stages[1:]]
+        for vm_name in vm_names:
+            inboxes[0].put(vm_name)
+        
+        threads = []
+        for index, count in enumerate(self.workers):
+            outbox = inboxes[index + 1] if index + 1 < len(inboxes) else None
+            stage_threads = [threading.Thread(target=self._work, args=(index, inboxes[index], outbox), daemon=True,
+                                              name=f"kvm_{self.stages[index][0]}") for _ in range(count)]
+            for thread in stage_threads:
+                thread.start()
+            threads.append(stage_threads)
+        
+        # Une étape se termine quand la précédente a fini et que sa file est vide
+        for _ in range(self.workers[0]):
+            inboxes[0].put(None)
+        for index, stage_threads in enumerate(threads):
+            for thread in stage_threads:
+                thread.join()
+            if index + 1 < len(inboxes):
+                for _ in range(self.workers[index + 1]):
+                    inboxes[index + 1].put(None)
+        
+        self.elapsed = time.monotonic() - start
+        return {vm_name: self.results.get(vm_name, False) for vm_name in vm_names}
+    
+    def summary(self):
+        """Taux d'occupation de chaque étape sur la durée de la tâche"""
+        elapsed = max(self.elapsed, 1e-6)
+        parts = [f"{self.LABELS[name]} {self.busy[name] / (elapsed * workers) * 100:.0f}%"
+                 for (name, _), workers in zip(self.stages, self.workers)]
+        return f"Pipeline ({self.depth} VM(s) en attente par étape au plus): occupation sur {self.elapsed:.1f}s: {', '.join(parts)}"
+    
+    def _work(self, index, inbox, outbox):
+        name, resource = self.stages[index]
+        stage = getattr(self, f"_{name}")
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            job = self.Job(item, self.temp_root) if index == 0 else item
+            # Temps passé dans la file: attente de la ressource de l'étape
+            waited = time.monotonic() - job.queued
+            previous_wait, held = job.resources.get(resource, (0.0, 0.0))
+            job.resources[resource] = (previous_wait + waited, held)
+            
+            self.slots.start_tracking(job.resources)
+            started = time.monotonic()
+            try:
+                stage(job)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            finally:
+                self.slots.stop_tracking()
+                with self._lock:
+                    self.busy[name] += time.monotonic() - started
+            
+            if outbox is None:
+                self._finish(job, True)
+            else:
+                job.queued = time.monotonic()
+                outbox.put(job)
+    
+    def _read(self, job):
+        """Configuration de la VM, export par point de contrôle ou conversion des disques (mode par étapes)"""
+        vm_name = job.vm_name
+        os.makedirs(job.temp_dir, exist_ok=True)
+        job.domain = self.conn.lookupByName(vm_name)
+        if job.domain is None:
+            raise Exception(f"VM {vm_name} non trouvée")
+        
+        # Sauvegarde de la configuration XML
+        job.xml_config = job.domain.XMLDesc(0)
+        job.xml_file = os.path.join(job.temp_dir, f"{vm_name}.xml")
+        with open(job.xml_file, 'w') as f:
+            f.write(job.xml_config)
+        
+        # Obtenir les disques de la VM via l'analyse XML
+        job.disks = self.vm_disks(job.xml_config)
+        job.record.disks = job.disks
+        self.logger.info(f"Disques trouvés pour {vm_name}: {job.disks}")
+        job.timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        job.use_checkpoints = self.config.get("use_checkpoints", True) and self.owner.checkpoints.supported(job.domain)
+        if self.mode == "repository":
+            return  # Export et découpage faits par l'étape du dépôt
+        
+        # VM active: export par point de contrôle, seuls les blocs modifiés depuis le précédent sont lus
+        backup_type = self.backup_type
+        if job.use_checkpoints:
+            backup_type, parent_checkpoint = self.owner.checkpoints.resolve(job.domain, vm_name, backup_type)
+        elif backup_type == "incr":
+            self.logger.warning(f"Sauvegarde incrémentielle impossible pour {vm_name} (VM arrêtée ou points de contrôle désactivés): sauvegarde complète")
+            backup_type = "full"
+        job.backup_type = backup_type
+        job.archive_name = f"{vm_name}_{job.timestamp}.{backup_type}.{self.compression.extension}"
+        
+        if job.use_checkpoints:
+            with self.slots.acquire("disk_read"), self.metrics.stage(vm_name, "export") as sample:
+                job.checkpoint, job.exported = self.owner.checkpoints.export(job.domain, vm_name, job.timestamp,
+                                                                             parent_checkpoint, job.temp_dir)
+                sample["bytes_out"] = sum(os.path.getsize(path) for _, path in job.exported)
+            job.chain_info = self.owner.checkpoints.chain_info(vm_name, job.archive_name, backup_type, job.checkpoint)
+            job.chain_file = self.owner.checkpoints.write_chain_file(job.chain_info, job.temp_dir)
+            job.exported.append((os.path.basename(job.chain_file), job.chain_file))
+        job.parent = job.chain_info["chain"][-2] if job.checkpoint and len(job.chain_info["chain"]) > 1 else None
+        if self.mode == "streaming" or job.exported is not None:
+            return
+        
+        # VM arrêtée (ou figée par un instantané à chaud): copie complète de chaque disque
+        if self.owner.live.applicable(job.domain):
+            job.live = self.owner.live.create(job.domain, vm_name, job.disks, job.timestamp)
+        for disk_path in job.disks:
+            if not os.path.exists(disk_path):
+                self._log(f"Disque {disk_path} non trouvé pour {vm_name}", "warning")
+                continue
+            
+            disk_name = os.path.basename(disk_path)
+            backup_file = os.path.join(job.temp_dir, f"{vm_name}_{disk_name}")
+            command = ["qemu-img", "convert", "-O", "qcow2", disk_path, backup_file]
+            with self.slots.acquire("disk_read"), self.metrics.stage(vm_name, "convert", disk_name) as sample:
+                if self.progress:
+                    ProgressMeter(self.progress, vm_name, f"Conversion {disk_name}", os.path.getsize(disk_path)).run_qemu_img(command)
+                else:
+                    StageMetrics.run(command, sample)
+                sample["bytes_in"] = os.path.getsize(disk_path)
+                sample["bytes_out"] = os.path.getsize(backup_file)
+        
+        # Disques copiés: la VM reprend ses disques d'origine avant la compression et l'envoi
+        self._release_live(job)
+    
+    def _archive(self, job):
+        """Archive compressée et son SHA256, calculé pendant l'écriture sans relire l'archive"""
+        from kvm_backup_archive import HashingWriter, SparseFile
+        from kvm_backup_snapshot import CheckpointBackup
+        vm_name = job.vm_name
+        job.archive_path = os.path.join(job.temp_dir, job.archive_name)
+        archive_stats = {}
+        with self.slots.acquire("compression"), self.metrics.stage(vm_name, "archive") as sample:
+            with open(job.archive_path, "wb") as archive_file:
+                hasher = HashingWriter(archive_file)
+                with self.compression.tar_writer(hasher, archive_stats) as tar:
+                    tar.add(job.xml_file, arcname=f"{vm_name}.xml")
+                    members = CheckpointBackup.disk_members(job.xml_config, vm_name)
+                    for file in sorted(os.listdir(job.temp_dir)):
+                        if file in members:
+                            SparseFile.add_to_tar(tar, os.path.join(job.temp_dir, file), file)
+                    if job.checkpoint:
+                        tar.add(job.chain_file, arcname=os.path.basename(job.chain_file))
+            # Temps CPU des threads de compression; le hachage au fil de l'écriture est compté à part
+            sample.update(bytes_in=archive_stats["bytes_in"], bytes_out=hasher.bytes_written,
+                          cpu_seconds=archive_stats["cpu_seconds"])
+        job.checksum = hasher.hexdigest()
+        self.metrics.add(vm_name, "hash", hasher.cpu_seconds, hasher.cpu_seconds, hasher.bytes_written, 0)
+        
+        # Relecture de contrôle optionnelle
+        if self.config.get("verify_archives"):
+            with self.metrics.stage(vm_name, "verify") as sample:
+                sample["bytes_in"] = os.path.getsize(job.archive_path)
+                if HashingWriter.hash_file(job.archive_path) != job.checksum:
+                    raise Exception(f"Vérification de l'archive {job.archive_name} échouée")
+        
+        # Les disques convertis ne servent plus: libérer /tmp avant l'attente de l'envoi
+        for file in os.listdir(job.temp_dir):
+            if file in members:
+                os.remove(os.path.join(job.temp_dir, file))
+        
+        job.checksum_file = f"{job.archive_path}.sha256"
+        with open(job.checksum_file, 'w') as f:
+            f.write(f"{job.checksum}  {job.archive_name}\n")
+    
+    def _upload(self, job):
+        """Envoi de l'archive et de son checksum, puis validation du point de contrôle et catalogue"""
+        from kvm_backup_retention import BackupCatalog
+        vm_name = job.vm_name
+        size = os.path.getsize(job.archive_path)
+        job.record.entry = BackupCatalog.entry(vm_name, job.archive_name, job.backup_type, size, job.checksum,
+                                               time.monotonic() - job.start, job.parent)
+        if self.config.get("backup_host"):
+            with self.slots.acquire("upload"), self.metrics.stage(vm_name, "upload") as sample:
+                verification = self.transfer_to_backup(vm_name, job.archive_path, job.checksum)
+                self.transfer_to_backup(vm_name, job.checksum_file)
+                sample["bytes_in"] = sample["bytes_out"] = size + os.path.getsize(job.checksum_file)
+            if verification:
+                # Contrôle sur le serveur (compris dans l'envoi): octets relus à distance, octets renvoyés
+                self.metrics.add(vm_name, "remote_verify", verification["seconds"], 0.0, verification["bytes"], verification["repaired"])
+            if job.checkpoint:
+                self.owner.checkpoints.commit(job.domain, job.chain_info)
+            self.record_in_catalog(job.record.entry)
+        elif job.checkpoint:
+            # Archive non conservée: la chaîne ne peut pas s'appuyer sur ce point de contrôle
+            self.owner.checkpoints.discard(job.domain, job.checkpoint)
+        job.checkpoint = None
+        self._log(f"Sauvegarde de {vm_name} terminée (taille: {size} bytes, SHA256: {job.checksum})")
+    
+    def _stream(self, job):
+        """Mode flux: les disques sont lus une seule fois et envoyés directement au serveur"""
+        from kvm_backup_retention import BackupCatalog
+        vm_name = job.vm_name
+        if not job.use_checkpoints and self.owner.live.applicable(job.domain):
+            job.live = self.owner.live.create(job.domain, vm_name, job.disks, job.timestamp)
+        with self.slots.acquire("disk_read"), self.slots.acquire("compression"), self.slots.acquire("upload"), \
+                self.metrics.stage(vm_name, "stream") as sample:
+            checksum, size = self.stream_to_backup(vm_name, job.archive_name, job.xml_config, job.disks,
+                                                   job.temp_dir, self.compression, job.exported)
+            sample["bytes_out"] = size
+        self._release_live(job)
+        if job.checkpoint:
+            self.owner.checkpoints.commit(job.domain, job.chain_info)
+            job.checkpoint = None
+        job.record.entry = BackupCatalog.entry(vm_name, job.archive_name, job.backup_type, size, checksum,
+                                               time.monotonic() - job.start, job.parent)
+        self.record_in_catalog(job.record.entry)
+        self._log(f"Sauvegarde en flux de {vm_name} terminée (taille: {size} bytes, SHA256: {checksum})")
+    
+    def _store(self, job):
+        """Dépôt dédupliqué: chaque sauvegarde est complète, seuls les blocs inconnus du dépôt sont envoyés"""
+        from kvm_backup_retention import BackupCatalog
+        vm_name = job.vm_name
+        if not job.use_checkpoints and self.owner.live.applicable(job.domain):
+            job.live = self.owner.live.create(job.domain, vm_name, job.disks, job.timestamp)
+        with self.slots.acquire("disk_read"), self.slots.acquire("compression"), self.slots.acquire("upload"), \
+                self.metrics.stage(vm_name, "repository") as sample:
+            manifest_name, size = self.store_in_repository(job.domain, vm_name, job.timestamp, job.xml_config, job.disks,
+                                                           job.temp_dir, self.compression, self.repository)
+            sample["bytes_in"] = size
+        self._release_live(job)
+        job.record.entry = BackupCatalog.entry(vm_name, manifest_name, "repository", size, duration=time.monotonic() - job.start)
+        self.record_in_catalog(job.record.entry)
+        self._log(f"Sauvegarde de {vm_name} dans le dépôt terminée (manifeste {manifest_name})")
+    
+    def transfer_to_backup(self, vm_name, local_path, checksum=None):
+        """Transférer un fichier vers le serveur de backup (checksum: contrôle sur le serveur); retourne ce contrôle éventuel"""
+        from kvm_backup_transfer import ParallelUploader
+        try:
+            # Canal SFTP emprunté au pool: pas de nouvelle négociation SSH par fichier
+            remote_path = f"{self._remote_vm_dir(vm_name)}/{os.path.basename(local_path)}"
+            
+            # Plages d'octets envoyées en parallèle sur plusieurs canaux
+            meter = None
+            if self.progress:
+                meter = ProgressMeter(self.progress, vm_name, f"Envoi {os.path.basename(local_path)}", os.path.getsize(local_path))
+            uploader = ParallelUploader.from_config(self.owner.ssh_pool, self.logger, self.config, self.owner.bandwidth)
+            rate = uploader.upload(local_path, remote_path, meter.update if meter else None, checksum)
+            
+            self._log(f"Fichier transféré vers {remote_path} ({rate:.1f} Mo/s)")
+            if uploader.verification:
+                verification = uploader.verification
+                repaired = f", {verification['repaired'] / (1024 * 1024):.1f} Mo renvoyés" if verification["repaired"] else ""
+                self._log(f"Archive vérifiée sur le serveur en {verification['seconds']:.1f}s "
+                          f"({verification['bytes'] / (1024 * 1024) / max(verification['seconds'], 1e-6):.1f} Mo/s{repaired})")
+            return uploader.verification
+        except Exception as e:
+            self._log(f"Erreur lors du transfert de {local_path}: {str(e)}", "error")
+            raise
+    
+    def stream_to_backup(self, vm_name, archive_name, xml_config, disks, temp_dir, compression, exported=None):
+        """Envoyer l'archive en flux vers le serveur de backup, sans archive locale"""
+        from kvm_backup_archive import StreamingArchiver
+        from kvm_backup_transfer import ParallelUploader
+        if not self.config.get("backup_host"):
+            raise Exception("Le mode flux nécessite un serveur de backup (backup_host)")
+        
+        archiver = StreamingArchiver(self.logger, compression)
+        # Disques déjà exportés par point de contrôle, sinon lecture directe des images
+        disk_members = exported or [archiver.prepare_disk(vm_name, disk_path, temp_dir) for disk_path in disks]
+        remote_vm_dir = self._remote_vm_dir(vm_name)
+        
+        start = time.monotonic()
+        uploader = ParallelUploader.from_config(self.owner.ssh_pool, self.logger, self.config, self.owner.bandwidth)
+        checksum, size = archiver.upload(uploader, remote_vm_dir, archive_name, vm_name, xml_config, disk_members)
+        rate = size / (1024 * 1024) / max(time.monotonic() - start, 1e-6)
+        
+        self._log(f"Archive envoyée en flux vers {remote_vm_dir}/{archive_name} ({rate:.1f} Mo/s)")
+        return checksum, size
+    
+    def store_in_repository(self, domain, vm_name, timestamp, xml_config, disks, temp_dir, compression, repository):
+        """Découper les disques en blocs dédupliqués puis publier le manifeste de la sauvegarde"""
+        from kvm_backup_repository import ChunkRepository
+        if not self.config.get("backup_host"):
+            raise Exception("Le dépôt dédupliqué nécessite un serveur de backup (backup_host)")
+        
+        members = ChunkRepository.prepare_raw_disks(self.owner.checkpoints, domain, vm_name, disks, timestamp, temp_dir,
+                                                    self.config.get("use_checkpoints", True))
+        manifest = {"vm": vm_name, "timestamp": timestamp, "xml": xml_config, "disks": []}
+        for arcname, raw_path in members:
+            chunks = repository.store_disk(raw_path, compression)
+            manifest["disks"].append({"name": arcname, "size": os.path.getsize(raw_path), "chunks": chunks})
+        
+        manifest_name = f"{vm_name}_{timestamp}.full{ChunkRepository.MANIFEST_SUFFIX}"
+        repository.write_manifest(self._remote_vm_dir(vm_name), manifest_name, manifest)
+        self._log(f"Manifeste {manifest_name} publié ({sum(len(disk['chunks']) for disk in manifest['disks'])} blocs référencés)")
+        return manifest_name, sum(disk["size"] for disk in manifest["disks"])
+    
+    def record_in_catalog(self, entry):
+        """Ajouter la sauvegarde au catalogue distant; un échec n'invalide pas la sauvegarde"""
+        from kvm_backup_retention import BackupCatalog
+        try:
+            BackupCatalog.from_config(self.owner.ssh_pool, self.logger, self.config).append(entry)
+        except Exception as e:
+            self.logger.warning(f"Catalogue non mis à jour pour {entry['archive']}: {str(e)}")
+    
+    def _remote_vm_dir(self, vm_name):
+        """Répertoire de la VM sur le serveur de backup, créé au besoin"""
+        remote_vm_dir = f"{self.config['backup_path']}/{vm_name}"
+        with self.owner.ssh_pool.sftp() as sftp:
+            try:
+                sftp.mkdir(remote_vm_dir)
+            except IOError:
+                pass  # Le répertoire existe déjà
+        return remote_vm_dir
+    
+    def _fail(self, job, error):
+        self._log(f"Erreur lors de la sauvegarde de {job.vm_name}: {str(error)}", "error")
+        job.record.error = str(error)
+        if job.live is not None:
+            # Ne jamais laisser la VM sur l'instantané temporaire
+            try:
+                self._release_live(job)
+            except Exception as commit_error:
+                self.logger.error(str(commit_error))
+        if job.checkpoint:
+            # L'archive n'a pas abouti: la prochaine incrémentielle repart du point de contrôle précédent
+            self.owner.checkpoints.discard(job.domain, job.checkpoint)
+        self._finish(job, False)
+    
+    def _finish(self, job, ok):
+        shutil.rmtree(job.temp_dir, ignore_errors=True)
+        record = job.record
+        record.ok = ok
+        record.duration = time.time() - record.started
+        with self._lock:
+            self.results[job.vm_name] = ok
+        if self._history is not None:
+            stages = dict(job.resources)
+            stages.update({stage: (0.0, seconds) for stage, seconds in record.stages.items()})
+            self._history.record_vm(self._job_id, record, stages)
+    
+    def _release_live(self, job):
+        """Fusionner l'instantané à chaud dans les disques de la VM et noter ses temps d'arrêt"""
+        live, job.live = job.live, None
+        if live is None:
+            return
+        timings = self.owner.live.commit(job.domain, live)
+        if timings is None:
+            return
+        vm_name, record = live["vm"], job.record
+        if live["freeze"] is not None:
+            record.stages["freeze"] = live["freeze"]
+            self.metrics.add(vm_name, "freeze", live["freeze"], 0.0, 0, 0)
+        record.stages.update(commit=timings["commit"], pivot=timings["pivot"])
+        self.metrics.add(vm_name, "commit", timings["commit"], 0.0, 0, 0)
+        self.metrics.add(vm_name, "pivot", timings["pivot"], 0.0, 0, 0)
+        freeze = f"gel {live['freeze'] * 1000:.0f} ms" if live["freeze"] is not None else "sans gel"
+        self._log(f"Sauvegarde à chaud de {vm_name}: {freeze}, fusion {timings['commit']:.1f}s, "
+                  f"pivot {timings['pivot'] * 1000:.0f} ms")
+    
+    def _log(self, message, level="info"):
+        getattr(self.logger, level)(message)
+        if self.notify:
+            self.notify(message)
+    
+    def vm_disks(self, xml_config):
+        """Extraire les chemins des disques depuis la configuration XML"""
+        try:
+            root = ET.fromstring(xml_config)
+            disks = []
+            
+            # Disques de fichier seulement (device='disk'), comme disk_members: les ISO de lecteurs CD-ROM
+            # ne sont ni convertis ni archivés
+            for disk in root.findall(".//disk[@type='file']"):
+                source = disk.find("source")
+                if disk.get("device", "disk") == "disk" and source is not None and source.get("file"):
+                    disk_path = source.get("file")
+                    if os.path.exists(disk_path):
+                        disks.append(disk_path)
+                    else:
+                        self.logger.warning(f"Disque non trouvé: {disk_path}")
+            
+            return disks
+        except ET.ParseError as e:
+            self.logger.error(f"Erreur lors de l'analyse XML: {str(e)}")
+            return []
+
+def main():
+    """Point d'entrée principal avec support CLI"""
+    parser = argparse.ArgumentParser(description='KVM Backup Tool')
+    parser.add_argument('--auto', action='store_true', 
+                        help='Mode automatique (sans GUI)')
+    parser.add_argument('--config', type=str, 
+                        help='Chemin vers le fichier de configuration')
+    parser.add_argument('--list-vms', action='store_true',
+                        help='Lister les VMs disponibles')
+    parser.add_argument('--jobs', '-j', type=int, metavar='N',
+                        help='Nombre de VMs sauvegardées en parallèle (défaut: 1)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Envoyer les archives en flux vers le serveur, sans copie dans /tmp')
+    parser.add_argument('--repository', action='store_true',
+                        help='Sauvegarder dans le dépôt dédupliqué du serveur (blocs inconnus uniquement)')
+    parser.add_argument('--list-backups', action='store_true',
+                        help='Lister les sauvegardes du catalogue du serveur')
+    parser.add_argument('--prune', action='store_true',
+                        help='Supprimer du serveur les sauvegardes expirées (rétention GFS)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Avec --prune: afficher ce qui serait supprimé et l\'espace récupéré, sans rien supprimer')
+    parser.add_argument('--history', nargs='?', type=int, const=30, metavar='JOURS',
+                        help='Afficher l\'historique local des sauvegardes (défaut: 30 derniers jours)')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Rester en service et exécuter les tâches planifiées (backup_freq, prune_freq, scrub_freq)')
+    parser.add_argument('--scrub', action='store_true',
+                        help='Revérifier sur le serveur une tranche des archives (les moins récemment vérifiées d\'abord)')
+    
+    args = parser.parse_args()
+    
+    if args.auto:
+        # Mode automatique sans GUI
+        from pathlib import Path
+        
+        config_file = args.config or os.path.expanduser("~/.kvm_backup_config.json")
+        
+        if not Path(config_file).exists():
+            print(f"Erreur: Fichier de configuration non trouvé: {config_file}")
+            sys.exit(1)
+        
+        # Créer une instance sans GUI pour la sauvegarde automatique
+        backup_engine = KVMBackupEngine(config_file, jobs=args.jobs, streaming=args.streaming, repository=args.repository)
+        try:
+            # Une exécution encore en cours (cron ou démon) n'est jamais rejointe par la suivante
+            with InstanceLock.from_config(backup_engine.config):
+                backup_engine.run_auto_backup()
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    elif args.daemon:
+        from kvm_backup_daemon import BackupDaemon
+        config_file = args.config or os.path.expanduser("~/.kvm_backup_config.json")
+        try:
+            BackupDaemon(config_file, jobs=args.jobs, streaming=args.streaming, repository=args.repository).run()
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    elif args.prune:
+        config_file = args.config or os.path.expanduser("~/.kvm_backup_config.json")
+        try:
+            engine = KVMBackupEngine(config_file)
+            with InstanceLock.from_config(engine.config):
+                engine.prune_backups(dry_run=args.dry_run)
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    elif args.scrub:
+        config_file = args.config or os.path.expanduser("~/.kvm_backup_config.json")
+        try:
+            engine = KVMBackupEngine(config_file)
+            with InstanceLock.from_config(engine.config):
+                if not engine.scrub_backups():
+                    sys.exit(1)
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    elif args.history is not None:
+        config_file = args.config or os.path.expanduser("~/.kvm_backup_config.json")
+        try:
+            KVMBackupEngine(config_file).show_history(args.history)
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    elif args.list_backups:
+        config_file = args.config or os.path.expanduser("~/.kvm_backup_config.json")
+        try:
+            KVMBackupEngine(config_file).list_backups()
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    elif args.list_vms:
+        # Lister les VMs
+        try:
+            import libvirt
+            conn = libvirt.open('qemu:///system')
+            if conn is None:
+                print("Erreur: Impossible de se connecter à l'hyperviseur KVM")
+                sys.exit(1)
+            
+            domains = conn.listAllDomains(0)
+            print("VMs disponibles:")
+            for domain in domains:
+                status = "En cours" if domain.isActive() else "Arrêtée"
+                print(f"  - {domain.name()} ({status})")
+            
+            conn.close()
+        except Exception as e:
+            print(f"Erreur: {str(e)}")
+            sys.exit(1)
+    
+    else:
+        # Mode GUI par défaut: tkinter n'est chargé qu'ici
+        import tkinter as tk
+        from kvm_backup_gui import KVMBackupGUI
+        root = tk.Tk()
+        app = KVMBackupGUI(root)
+        root.mainloop()
+
+class KVMBackupEngine:
+    """Moteur de sauvegarde sans interface graphique pour l'automatisation"""
+    
+    def __init__(self, config_file, jobs=None, streaming=False, repository=False, keep_connections=False, logger=None):
+        from kvm_backup_snapshot import CheckpointBackup, LiveSnapshot
+        from kvm_backup_transfer import BandwidthLimiter, SSHSessionPool
+        self.config_file = config_file
+        self.logger = logger or Logger()
+        self.load_config()
+        
+        # Mode démon: connexions libvirt et SSH conservées d'une tâche à l'autre
+        self.keep_connections = keep_connections
+        self._conn = None
+        
+        # Nombre de VMs sauvegardées en parallèle (CLI prioritaire sur la configuration)
+        self.jobs = max(1, int(jobs or self.config.get("jobs", 1)))
+        self.streaming = streaming or self.config.get("streaming", False)
+        self.repository_mode = repository or self.config.get("repository_mode", False)
+        
+        # Une seule négociation SSH par tâche, partagée entre les VMs
+        self.ssh_pool = SSHSessionPool(self.create_ssh_connection, self.logger,
+                                       self.config.get("ssh_max_connections", 2))
+        
+        # Débit des envois partagé par toutes les VMs de la tâche, ajustable en modifiant la configuration
+        self.bandwidth = BandwidthLimiter.from_config(self.logger, self.config, self.config_file)
+        
+        # VMs actives sans point de contrôle: instantané externe puis blockcommit
+        self.live = LiveSnapshot.from_config(self.logger, self.config)
+    
+        # Points de contrôle libvirt pour les sauvegardes incrémentielles
+        self.checkpoints = CheckpointBackup(self.logger)
+    
+    def load_config(self):
+        try:
+            with open(self.config_file, 'r') as f:
+                self.config = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            self.logger.error(f"Erreur lors du chargement de la configuration: {str(e)}")
+            raise
+    
+    def open_hypervisor(self):
+        """Connexion libvirt, réutilisée tant qu'elle est vivante en mode démon"""
+        import libvirt
+        if self._conn is not None:
+            try:
+                if self._conn.isAlive():
+                    return self._conn
+            except libvirt.libvirtError:
+                pass
+            self.logger.info("Connexion libvirt perdue, reconnexion")
+            self._conn = None
+        conn = libvirt.open(self.config.get('libvirt_uri', 'qemu:///system'))
+        if self.keep_connections:
+            self._conn = conn
+        return conn
+    
+    def release_connections(self, conn=None):
+        """Fin de tâche: tout fermer, sauf en mode démon où les connexions restent prêtes pour la suivante"""
+        if self.keep_connections:
+            return
+        if conn is not None:
+            conn.close()
+        self.ssh_pool.close()
+    
+    def close(self):
+        import libvirt
+        self.ssh_pool.close()
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except libvirt.libvirtError:
+                pass
+            self._conn = None
+    
+    def run_auto_backup(self):
+        """Exécuter la sauvegarde automatique"""
+        self.logger.info("Démarrage de la sauvegarde automatique")
+        
+        try:
+            # Récupérer les VMs sélectionnées
+            selected_vms = [vm for vm, selected in self.config.get("selected_vms", {}).items() if selected]
+            
+            if not selected_vms:
+                self.logger.warning("Aucune VM sélectionnée pour la sauvegarde automatique")
+                return
+            
+            # Exécuter la sauvegarde directement sans GUI
+            self.perform_backup_headless(selected_vms, self.auto_backup_type())
+            
+            # Rétention appliquée après la sauvegarde si elle est activée
+            if self.config.get("retention_auto") and self.config.get("backup_host"):
+                self.prune_backups()
+            
+            self.logger.info("Sauvegarde automatique terminée")
+            
+        except Exception as e:
+            self.logger.error(f"Erreur lors de la sauvegarde automatique: {str(e)}")
+    
+    def auto_backup_type(self, today=None):
+        """Type des sauvegardes planifiées: auto_backup_type, avec une complète le jour auto_full_weekday"""
+        backup_type = self.config.get("auto_backup_type", "full")
+        if backup_type not in ("full", "incr"):
+            self.logger.warning(f"auto_backup_type inconnu ({backup_type}): sauvegarde complète")
+            return "full"
+        full_weekday = self.config.get("auto_full_weekday")
+        today = today or datetime.now()
+        if backup_type == "incr" and full_weekday is not None and today.weekday() == int(full_weekday):
+            self.logger.info("Jour de sauvegarde complète planifiée")
+            return "full"
+        return backup_type
+    
+    def perform_backup_headless(self, vm_names, backup_type):
+        """Effectuer une sauvegarde sans interface graphique"""
+        from kvm_backup_archive import CompressionEngine
+        from kvm_backup_repository import ChunkRepository
+        # Répertoire propre à la tâche: deux exécutions (GUI, démon, cron) ne se partagent jamais leurs fichiers
+        import tempfile
+        temp_dir = tempfile.mkdtemp(prefix="kvm_backup-")
+        
+        try:
+            conn = self.open_hypervisor()
+            if conn is None:
+                self.logger.error("Échec de la connexion à l'hyperviseur KVM")
+                return {}
+            
+            slots = ResourceSlots.from_config(self.config, self.jobs)
+            self.logger.info(f"Sauvegarde de {len(vm_names)} VMs avec {self.jobs} tâche(s) parallèle(s) ({slots})")
+            
+            # Niveau adaptatif: comparé au débit d'envoi mesuré par le limiteur (flux et dépôt: étapes recouvertes)
+            compression = CompressionEngine.from_config(self.config, self.bandwidth, self.streaming or self.repository_mode)
+            repository = None
+            if self.repository_mode:
+                if not self.config.get("backup_host"):
+                    raise Exception("Le dépôt dédupliqué nécessite un serveur de backup (backup_host)")
+                repository = ChunkRepository.from_config(self.ssh_pool, self.logger, self.config, self.bandwidth)
+            history = BackupHistory.from_config(self.logger, self.config)
+            metrics = StageMetrics()
+            try:
+                self.bandwidth.seed(history.upload_rate())
+                mode = "repository" if repository else "streaming" if self.streaming else "staged"
+                job_id = history.start_job(mode, backup_type, len(vm_names))
+                pipeline = BackupPipeline.from_config(self, conn, backup_type, temp_dir, slots, compression, metrics, mode, repository)
+                results = pipeline.run(vm_names, history, job_id)
+                history.finish_job(job_id, results)
+                self.export_metrics(metrics, results)
+            finally:
+                compression.close()
+                if repository is not None:
+                    repository.close()
+                history.close()
+                self.release_connections(conn)
+            
+            failed = [vm_name for vm_name, ok in results.items() if not ok]
+            self.logger.info(f"{len(vm_names) - len(failed)}/{len(vm_names)} VMs sauvegardées")
+            self.logger.info(pipeline.summary())
+            self.logger.info(compression.summary())
+            if repository is not None:
+                self.logger.info(repository.summary())
+            if failed:
+                self.logger.error(f"VMs en échec: {', '.join(failed)}")
+            return results
+        
+        except Exception as e:
+            self.logger.error(f"Erreur générale lors de la sauvegarde: {str(e)}")
+            return {}
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    def list_backups(self):
+        """Afficher les sauvegardes du catalogue (seule la fin ajoutée depuis la dernière lecture est transférée)"""
+        from kvm_backup_retention import BackupCatalog
+        entries = BackupCatalog.from_config(self.ssh_pool, self.logger, self.config).sync()
+        print(f"{'VM':<20} {'Date':<19}  {'Type':<17} {'Taille':>10} {'Durée':>8}  Parent")
+        for entry in entries:
+            duration = f"{entry['duration']:.0f}s" if entry.get("duration") is not None else "-"
+            print(f"{entry['vm']:<20} {entry['date']:<19}  {BackupCatalog.TYPE_LABELS.get(entry['type'], entry['type']):<17} "
+                  f"{entry['size'] / (1024 * 1024):>8.1f}Mo {duration:>8}  {entry.get('parent') or '-'}")
+        return entries
+    
+    def export_metrics(self, metrics, results):
+        """Écrire les mesures de la tâche (collecteur textfile de node_exporter et résumé JSON)"""
+        for key, default, writer in (
+                ("metrics_textfile", "/var/lib/node_exporter/textfile_collector/kvm_backup.prom", metrics.write_textfile),
+                ("metrics_summary", "~/.kvm_backup_last_job.json", metrics.write_summary)):
+            path = self.config.get(key, default)
+            if not path:
+                continue
+            try:
+                writer(path, results)
+            except OSError as e:
+                self.logger.warning(f"Mesures non écrites dans {path}: {str(e)}")
+        for (vm_name, disk, stage), total in sorted(metrics.totals().items()):
+            rate = total["bytes_in"] / (1024 * 1024) / total["seconds"] if total["seconds"] > 0 else 0.0
+            self.logger.info(f"{vm_name}{'/' + disk if disk else ''} {stage}: {total['seconds']:.1f}s "
+                             f"(CPU {total['cpu_seconds']:.1f}s), {rate:.1f} Mo/s")
+    
+    def prune_backups(self, dry_run=False):
+        """Appliquer la rétention GFS sur le serveur; en simulation, seul le rapport est produit"""
+        from kvm_backup_retention import BackupPruner
+        pruner = BackupPruner(self.ssh_pool, self.logger, self.config)
+        try:
+            report = pruner.prune(dry_run)
+        finally:
+            self.release_connections()
+        
+        prefix = "[simulation] " if dry_run else ""
+        self.logger.info(f"{prefix}Rétention: {pruner.policy}")
+        for vm_name, (kept, expired) in report["vms"].items():
+            self.logger.info(f"{prefix}{vm_name}: {len(kept)} conservée(s), {len(expired)} expirée(s)")
+            for entry in expired:
+                self.logger.info(f"{prefix}  - {entry['archive']}")
+        reclaimed = (report["bytes"] + report["chunk_bytes"]) / (1024 * 1024)
+        self.logger.info(f"{prefix}{len(report['files'])} fichier(s) et {len(report['chunks'])} bloc(s) du dépôt "
+                         f"{'à supprimer' if dry_run else 'supprimés'}: {reclaimed:.1f} Mo récupérés")
+        return report
+    
+    def scrub_backups(self):
+        """Revérifier une tranche des archives du serveur; retourne False si une archive est corrompue ou illisible"""
+        from kvm_backup_retention import BackupScrubber
+        history = BackupHistory.from_config(self.logger, self.config)
+        try:
+            report = BackupScrubber.from_config(self.ssh_pool, self.logger, self.config, history).scrub()
+        finally:
+            self.release_connections()
+            history.close()
+        
+        rate = report["bytes"] / (1024 * 1024) / max(report["seconds"], 1e-6)
+        self.logger.info(f"Contrôle d'intégrité: {report['checked']} archive(s), {report['bytes'] / (1024 ** 3):.2f} Go "
+                         f"en {report['seconds']:.0f}s ({rate:.1f} Mo/s), {report['remaining']} restante(s) pour les prochaines tranches")
+        for path, status, error in report["failed"]:
+            self.logger.error(f"Archive {'corrompue' if status == 'corrupt' else 'non vérifiable'}: {path} ({error})")
+        for path, error in report["incomplete"]:
+            self.logger.warning(f"Archive non contrôlée dans le budget: {path} ({error})")
+        return not report["failed"]
+    
+    def show_history(self, days=30):
+        """Afficher l'historique local: dernière sauvegarde réussie, VMs les plus lentes, croissance"""
+        history = BackupHistory.from_config(self.logger, self.config)
+        try:
+            print("Dernière sauvegarde réussie par VM:")
+            for vm_name, started, backup_type, archive, size in history.last_good():
+                size_text = f"{size / (1024 * 1024):.1f} Mo" if size is not None else "-"
+                print(f"  {vm_name:<20} {datetime.fromtimestamp(started):%Y-%m-%d %H:%M:%S}  {backup_type or '-':<10} {size_text:>12}  {archive or '-'}")
+            
+            print(f"\nVMs les plus lentes ({days} derniers jours):")
+            for vm_name, average, longest, count in history.slowest(days):
+                print(f"  {vm_name:<20} moyenne {average:>8.1f}s  max {longest:>8.1f}s  ({count} sauvegardes)")
+            
+            print(f"\nCroissance des sauvegardes complètes ({days} derniers jours):")
+            for vm_name, first_size, last_size, rate in history.growth(days):
+                print(f"  {vm_name:<20} {first_size / (1024 * 1024):>10.1f} Mo -> {last_size / (1024 * 1024):>10.1f} Mo  "
+                      f"({rate / (1024 * 1024):+.1f} Mo/jour)")
+            
+            stalls = history.live_stalls(days)
+            if stalls:
+                print(f"\nArrêts des sauvegardes à chaud ({days} derniers jours):")
+                for vm_name, longest, average, pivot, commit in stalls:
+                    freeze = f"gel max {longest * 1000:>6.0f} ms (moy. {average * 1000:.0f} ms)" if longest is not None else "sans gel"
+                    print(f"  {vm_name:<20} {freeze}  pivot max {(pivot or 0) * 1000:>5.0f} ms  fusion max {commit or 0:>7.1f}s")
+            
+            total, never, oldest, failed = history.scrub_summary()
+            if total:
+                oldest_text = f"{datetime.fromtimestamp(oldest):%Y-%m-%d %H:%M}" if oldest else "-"
+                print(f"\nContrôle d'intégrité: {total} archive(s), {never} jamais vérifiée(s), plus ancienne vérification {oldest_text}")
+                for path, status, error in failed:
+                    print(f"  {'CORROMPUE' if status == 'corrupt' else 'ERREUR':<10} {path}  {error or ''}")
+        finally:
+            history.close()
+    
+    def create_ssh_connection(self, max_retries=3):
+        """Créer une connexion SSH par clé (aucune saisie possible en mode headless)"""
+        from kvm_backup_transfer import SSHTransportOptions
+        import paramiko
+        
+        try:
+            # Clé explicite si configurée, sinon agent SSH et clés par défaut (~/.ssh/id_*)
+            return SSHTransportOptions.connect(self.config, self.logger, max_retries,
+                                               key_filename=self.config.get("ssh_key_file") or None)
+        except paramiko.AuthenticationException:
+            self.logger.error("Échec d'authentification SSH - vérifiez la clé (ssh_key_file)")
+            raise Exception("Authentification SSH par clé refusée")
+    
+
+class InstanceLock:
+    """Verrou exclusif (flock) qui empêche deux tâches de l'outil de se chevaucher (démon, --auto, --prune, --scrub)"""
+    
+    def __init__(self, path="~/.kvm_backup.lock"):
+        self.path = os.path.expanduser(path)
+        self._file = None
+    
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get("lock_file", "~/.kvm_backup.lock"))
+    
+    def acquire(self):
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.seek(0)
+            owner = lock_file.read().strip()
+            lock_file.close()
+            raise Exception(f"Une autre instance de l'outil est en cours (pid {owner or '?'}, verrou {self.path})")
+        # Le verrou est libéré par le noyau à la fin du processus, même après un arrêt brutal
+        lock_file.truncate(0)
+        lock_file.write(f"{os.getpid()}\n")
+        lock_file.flush()
+        self._file = lock_file
+    
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+# Classes réparties dans les modules par domaine: toujours importables d'ici (from kvm_backup_core import ...),
+# le module qui les définit n'est chargé qu'au premier accès
+MODULE_CLASSES = {
+    "kvm_backup_archive": ("HashingWriter", "BoundedBufferWriter", "CompressionTuner", "CompressionEngine", "ParallelCompressor", "SparseFile", "StreamingArchiver"),
+    "kvm_backup_snapshot": ("CheckpointBackup", "LiveSnapshot"),
+    "kvm_backup_transfer": ("SSHSessionPool", "SSHTransportOptions", "TransferManifest", "BandwidthLimiter", "RangeStreamWriter", "ParallelUploader", "RemoteVerifier", "ResumableDownloader"),
+    "kvm_backup_repository": ("BloomFilter", "ChunkIndex", "ChunkRepository"),
+    "kvm_backup_restore": ("RemoteReadahead", "DiskImageWriter", "StreamingRestorer"),
+    "kvm_backup_retention": ("BackupCatalog", "RetentionPolicy", "BackupPruner", "BackupScrubber"),
+    "kvm_backup_daemon": ("CronSchedule", "BackupDaemon")
+}
+
+def __getattr__(name):
+    for module_name, names in MODULE_CLASSES.items():
+        if name in names:
+            import importlib
+            return getattr(importlib.import_module(module_name), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
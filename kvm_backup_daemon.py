@@ -0,0 +1,167 @@
+"""Mode démon (--daemon): planification cron dans le processus et exécution des tâches une à une"""
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timedelta
+from collections import deque
+from kvm_backup_core import InputValidator, InstanceLock, KVMBackupEngine, Logger
+
+class CronSchedule:
+    """Expression cron à 5 champs (valeur, * ou */N, comme la valide InputValidator) évaluée dans le processus"""
+    
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+    
+    def __init__(self, expression):
+        if not InputValidator.validate_cron_expression(expression):
+            raise Exception(f"Expression cron invalide: {expression}")
+        self.expression = expression
+        fields = expression.split()
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._expand(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        # Comme cron: jour du mois et jour de la semaine tous deux restreints, l'un ou l'autre suffit
+        self._either_day = fields[2] != "*" and fields[4] != "*"
+    
+    @staticmethod
+    def _expand(field, low, high):
+        if field == "*":
+            return set(range(low, high + 1))
+        if field.startswith("*/"):
+            return set(range(low, high + 1, max(1, int(field[2:]))))
+        return {int(field)}
+    
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = moment.isoweekday() % 7 in self.weekdays  # 0 = dimanche
+        return (day or weekday) if self._either_day else (day and weekday)
+    
+    def matches(self, moment):
+        return (moment.minute in self.minutes and moment.hour in self.hours and moment.month in self.months
+                and self._day_matches(moment))
+    
+    def next_run(self, after):
+        """Première minute strictement postérieure à after qui correspond à l'expression"""
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=5 * 366)
+        while not self.matches(moment):
+            if moment > limit:
+                raise Exception(f"L'expression cron {self.expression} ne correspond à aucune date")
+            # Sauter les jours puis les heures qui ne peuvent pas correspondre
+            if moment.month not in self.months or not self._day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            else:
+                moment += timedelta(minutes=1)
+        return moment
+
+class BackupDaemon:
+    """Planificateur résident (--daemon): tâches cron exécutées dans le processus, une à la fois, connexions conservées"""
+    
+    SCHEDULES = (("backup", "backup_freq"), ("prune", "prune_freq"), ("scrub", "scrub_freq"))
+    CONFIG_CHECK_INTERVAL = 60
+    
+    def __init__(self, config_file, jobs=None, streaming=False, repository=False):
+        self.config_file = config_file
+        self.options = {"jobs": jobs, "streaming": streaming, "repository": repository}
+        self.logger = Logger()
+        self.engine = None
+        self.schedules = {}
+        self.next_runs = {}
+        self.pending = deque()  # Tâches échues en attente, sans doublon
+        self._mtime = None
+        self._stop = threading.Event()
+        self._reload = threading.Event()
+    
+    def load(self):
+        """(Re)charger la configuration; une configuration invalide conserve la précédente"""
+        engine = KVMBackupEngine(self.config_file, keep_connections=True, logger=self.logger, **self.options)
+        schedules = {action: CronSchedule(engine.config[key]) for action, key in self.SCHEDULES if engine.config.get(key)}
+        if not schedules:
+            raise Exception("Aucune tâche planifiée (backup_freq, prune_freq ou scrub_freq)")
+        
+        if self.engine is not None:
+            self.engine.close()
+        self.engine = engine
+        self._mtime = os.path.getmtime(self.config_file)
+        now = datetime.now()
+        # Une planification inchangée garde son échéance: une tâche en retard reste due
+        self.next_runs = {action: self.next_runs[action]
+                          if action in self.schedules and self.schedules[action].expression == schedule.expression
+                          else schedule.next_run(now)
+                          for action, schedule in schedules.items()}
+        self.schedules = schedules
+        self.pending = deque(action for action in self.pending if action in schedules)
+        for action, schedule in schedules.items():
+            self.logger.info(f"Tâche {action} ({schedule.expression}): prochaine exécution {self.next_runs[action]:%Y-%m-%d %H:%M}")
+    
+    def run(self):
+        """Boucle principale; SIGTERM/SIGINT arrêtent le démon après la tâche en cours, SIGHUP recharge la configuration"""
+        self.load()
+        lock = InstanceLock.from_config(self.engine.config)
+        lock.acquire()
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self._stop.set())
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._reload.set())
+        self.logger.info(f"Démon de sauvegarde démarré (pid {os.getpid()})")
+        
+        try:
+            while not self._stop.is_set():
+                if self._reload.is_set() or self._config_changed():
+                    self._reload.clear()
+                    try:
+                        self.load()
+                        self.logger.info("Configuration rechargée")
+                    except Exception as e:
+                        self._mtime = self._config_mtime()
+                        self.logger.error(f"Configuration non rechargée, la précédente reste active: {str(e)}")
+                
+                self.enqueue_due(datetime.now())
+                if self.pending:
+                    self.run_job(self.pending.popleft())
+                    continue
+                
+                wait = (min(self.next_runs.values()) - datetime.now()).total_seconds()
+                self._stop.wait(min(max(wait, 1), self.CONFIG_CHECK_INTERVAL))
+        finally:
+            self.engine.close()
+            lock.release()
+            self.logger.info("Démon de sauvegarde arrêté")
+    
+    def enqueue_due(self, now):
+        """Mettre en file les tâches échues; plusieurs échéances manquées d'une même tâche n'en font qu'une"""
+        for action, due in self.next_runs.items():
+            if now < due:
+                continue
+            if action in self.pending:
+                self.logger.warning(f"Tâche {action} de {due:%H:%M} fusionnée avec celle déjà en attente")
+            else:
+                self.pending.append(action)
+                delay = (now - due).total_seconds()
+                if delay >= 60:
+                    self.logger.warning(f"Tâche {action} de {due:%H:%M} retardée de {delay / 60:.0f} min (tâche précédente en cours)")
+            self.next_runs[action] = self.schedules[action].next_run(now)
+    
+    def run_job(self, action):
+        start = time.monotonic()
+        self.logger.info(f"Démon: début de la tâche {action}")
+        try:
+            if action == "backup":
+                self.engine.run_auto_backup()
+            elif action == "prune":
+                self.engine.prune_backups()
+            else:
+                self.engine.scrub_backups()
+        except Exception as e:
+            self.logger.error(f"Tâche {action} en échec: {str(e)}")
+        self.logger.info(f"Démon: tâche {action} terminée en {time.monotonic() - start:.0f}s, "
+                         f"prochaine exécution {self.next_runs[action]:%Y-%m-%d %H:%M}")
+    
+    def _config_mtime(self):
+        try:
+            return os.path.getmtime(self.config_file)
+        except OSError:
+            return None
+    
+    def _config_changed(self):
+        return self._config_mtime() != self._mtime
@@ -0,0 +1,899 @@
+"""Interface graphique Tk de KVM Backup Tool, chargée uniquement en mode GUI (auth_kvm_backup.py sans option)"""
+import tkinter as tk
+from tkinter import ttk, messagebox, scrolledtext
+import libvirt
+import paramiko
+import os
+import json
+import shutil
+import tempfile
+import logging
+import threading
+import queue
+import time
+from datetime import datetime
+from collections import deque
+from crontab import CronTab
+
+from kvm_backup_archive import CompressionEngine, SparseFile
+from kvm_backup_core import BackupHistory, BackupPipeline, InputValidator, Logger, ResourceSlots, StageMetrics
+from kvm_backup_repository import ChunkRepository
+from kvm_backup_restore import StreamingRestorer
+from kvm_backup_retention import BackupCatalog
+from kvm_backup_snapshot import CheckpointBackup, LiveSnapshot
+from kvm_backup_transfer import BandwidthLimiter, ResumableDownloader, SSHSessionPool, SSHTransportOptions
+
+class GUIEventPump:
+    """File d'événements des threads de travail, vidée par lots dans la boucle Tk (seul thread qui touche aux widgets)"""
+    
+    def __init__(self, root, interval_ms=100, max_batch=500):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self._events = queue.SimpleQueue()
+        self._latest = {}  # Dernier état par clé (progression): les états intermédiaires sont écrasés
+        self._latest_lock = threading.Lock()
+        self._main_thread = threading.current_thread()
+        self.root.after(self.interval_ms, self._drain)
+    
+    def post(self, function, *args):
+        """Exécuter function(*args) dans la boucle Tk"""
+        self._events.put((function, args))
+    
+    def post_latest(self, key, function, *args):
+        """Comme post, mais seul le dernier appel en attente pour cette clé est exécuté"""
+        with self._latest_lock:
+            self._latest[key] = (function, args)
+    
+    def call(self, function, *args):
+        """Exécuter function(*args) dans la boucle Tk et attendre son résultat (dialogues)"""
+        if threading.current_thread() is self._main_thread:
+            return function(*args)
+        done = threading.Event()
+        result = {}
+        
+        def run():
+            try:
+                result["value"] = function(*args)
+            except Exception as e:
+                result["error"] = e
+            finally:
+                done.set()
+        
+        self.post(run)
+        done.wait()
+        if "error" in result:
+            raise result["error"]
+        return result.get("value")
+    
+    def _drain(self):
+        try:
+            for _ in range(self.max_batch):
+                try:
+                    function, args = self._events.get_nowait()
+                except queue.Empty:
+                    break
+                self._run(function, args)
+            with self._latest_lock:
+                latest, self._latest = self._latest, {}
+            for function, args in latest.values():
+                self._run(function, args)
+        finally:
+            self.root.after(self.interval_ms, self._drain)
+    
+    @staticmethod
+    def _run(function, args):
+        try:
+            function(*args)
+        except Exception as e:
+            logging.getLogger("kvm_backup").error(f"Erreur dans la boucle d'événements: {str(e)}")
+
+class PasswordDialog:
+    """Dialogue pour saisir le mot de passe SSH"""
+    
+    def __init__(self, parent):
+        self.password = None
+        self.dialog = tk.Toplevel(parent)
+        self.dialog.title("Authentification SSH")
+        self.dialog.geometry("300x150")
+        self.dialog.resizable(False, False)
+        self.dialog.transient(parent)
+        self.dialog.grab_set()
+        
+        # Centrer la fenêtre
+        self.dialog.geometry("+%d+%d" % (parent.winfo_rootx() + 50, parent.winfo_rooty() + 50))
+        
+        # Interface
+        ttk.Label(self.dialog, text="Mot de passe SSH:").pack(pady=10)
+        
+        self.password_var = tk.StringVar()
+        self.password_entry = ttk.Entry(self.dialog, textvariable=self.password_var, show="*", width=30)
+        self.password_entry.pack(pady=5)
+        self.password_entry.focus()
+        
+        # Boutons
+        button_frame = ttk.Frame(self.dialog)
+        button_frame.pack(pady=10)
+        
+        ttk.Button(button_frame, text="OK", command=self.ok_clicked).pack(side='left', padx=5)
+        ttk.Button(button_frame, text="Annuler", command=self.cancel_clicked).pack(side='left', padx=5)
+        
+        # Bind Enter key
+        self.dialog.bind('<Return>', lambda e: self.ok_clicked())
+        self.dialog.bind('<Escape>', lambda e: self.cancel_clicked())
+    
+    def ok_clicked(self):
+        self.password = self.password_var.get()
+        self.dialog.destroy()
+    
+    def cancel_clicked(self):
+        self.password = None
+        self.dialog.destroy()
+
+class KVMBackupGUI:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("Sauvegarde KVM - Version Production")
+        self.root.geometry("900x700")
+        
+        # Initialiser le logger
+        self.logger = Logger()
+        self.logger.info("Démarrage de l'application KVM Backup")
+        
+        # Configuration
+        self.config_file = os.path.expanduser("~/.kvm_backup_config.json")
+        self.load_config()
+        
+        # Variables pour stocker les credentials temporairement
+        self.ssh_password = None
+        self._ssh_lock = threading.Lock()
+        
+        # Connexions SSH partagées par les transferts et la liste des sauvegardes
+        self.ssh_pool = SSHSessionPool(self.create_ssh_connection, self.logger,
+                                       self.config.get("ssh_max_connections", 2))
+        
+        # Débit des envois partagé par tous les transferts, ajustable en modifiant la configuration
+        self.bandwidth = BandwidthLimiter.from_config(self.logger, self.config, self.config_file)
+        
+        # VMs actives sans point de contrôle: instantané externe puis blockcommit
+        self.live = LiveSnapshot.from_config(self.logger, self.config)
+        
+        # Points de contrôle libvirt pour les sauvegardes incrémentielles
+        self.checkpoints = CheckpointBackup(self.logger)
+        
+        # Les threads de travail passent par la file d'événements: seule la boucle Tk touche aux widgets
+        self.events = GUIEventPump(self.root)
+        self._log_lines = deque()
+        self.log_max_lines = self.config.get("log_max_lines", 5000)
+        self.progress_rows = {}
+        
+        # Style
+        self.style = ttk.Style()
+        self.style.configure('TNotebook.Tab', padding=[10, 5])
+        self.style.configure('TButton', padding=5)
+        
+        # Notebook (onglets)
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.pack(fill='both', expand=True, padx=10, pady=10)
+        
+        # Onglet Sauvegarde
+        self.backup_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.backup_tab, text='Sauvegarde')
+        self.setup_backup_tab()
+        
+        # Onglet Restauration
+        self.restore_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.restore_tab, text='Restauration')
+        self.setup_restore_tab()
+        
+        # Onglet Configuration
+        self.config_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.config_tab, text='Configuration')
+        self.setup_config_tab()
+        
+        # Onglet Crédits
+        self.credits_tab = ttk.Frame(self.notebook)
+        self.notebook.add(self.credits_tab, text='À propos')
+        self.setup_credits_tab()
+        
+        # Charger les VMs au démarrage
+        self.populate_vm_list()
+    
+    def load_config(self):
+        try:
+            with open(self.config_file, 'r') as f:
+                self.config = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.config = {
+                "backup_host": "",
+                "backup_user": "",
+                "backup_path": "/backup/kvm",
+                "auto_backup": False,
+                "backup_freq": "0 2 * * *",
+                "selected_vms": {}
+            }
+    
+    def save_config(self):
+        with open(self.config_file, 'w') as f:
+            json.dump(self.config, f, indent=4)
+    
+    def setup_backup_tab(self):
+        # Frame pour la liste des VMs
+        vm_frame = ttk.LabelFrame(self.backup_tab, text="Machines Virtuelles", padding=10)
+        vm_frame.pack(fill='both', expand=True, padx=5, pady=5)
+        
+        # Treeview pour les VMs
+        self.vm_tree = ttk.Treeview(vm_frame, columns=('name', 'backup'), show='headings')
+        self.vm_tree.heading('name', text='Nom de la VM')
+        self.vm_tree.heading('backup', text='Sauvegarder')
+        self.vm_tree.column('name', width=300)
+        self.vm_tree.column('backup', width=100, anchor='center')
+        
+        # Scrollbar
+        scrollbar = ttk.Scrollbar(vm_frame, orient='vertical', command=self.vm_tree.yview)
+        self.vm_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.vm_tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        
+        # Frame pour les options de sauvegarde
+        options_frame = ttk.Frame(self.backup_tab)
+        options_frame.pack(fill='x', padx=5, pady=5)
+        
+        ttk.Label(options_frame, text="Type de sauvegarde:").pack(side='left')
+        
+        self.backup_type = tk.StringVar(value="full")
+        ttk.Radiobutton(options_frame, text="Complète", variable=self.backup_type, value="full").pack(side='left', padx=5)
+        ttk.Radiobutton(options_frame, text="Incrémentielle", variable=self.backup_type, value="incr").pack(side='left', padx=5)
+        
+        # Mode flux: pas d'archive intermédiaire dans /tmp
+        self.streaming_var = tk.BooleanVar(value=self.config.get("streaming", False))
+        ttk.Checkbutton(options_frame, text="Envoi en flux", variable=self.streaming_var).pack(side='left', padx=10)
+        
+        # Dépôt dédupliqué: seuls les blocs inconnus du serveur sont envoyés
+        self.repository_var = tk.BooleanVar(value=self.config.get("repository_mode", False))
+        ttk.Checkbutton(options_frame, text="Dépôt dédupliqué", variable=self.repository_var).pack(side='left', padx=10)
+        
+        # Nombre de VMs sauvegardées en parallèle
+        self.jobs_var = tk.IntVar(value=self.config.get("jobs", 1))
+        ttk.Spinbox(options_frame, from_=1, to=64, width=4, textvariable=self.jobs_var).pack(side='right')
+        ttk.Label(options_frame, text="Tâches parallèles:").pack(side='right', padx=5)
+        
+        # Bouton de sauvegarde
+        ttk.Button(self.backup_tab, text="Lancer la sauvegarde", command=self.start_backup).pack(pady=10)
+        
+        # Avancement par VM (octets, débit, temps restant)
+        self.progress_frame = ttk.LabelFrame(self.backup_tab, text="Progression", padding=10)
+        self.progress_frame.pack(fill='x', padx=5, pady=5)
+        self.progress_frame.columnconfigure(1, weight=1)
+        
+        # Console de sortie
+        output_frame = ttk.LabelFrame(self.backup_tab, text="Journal", padding=10)
+        output_frame.pack(fill='both', expand=True, padx=5, pady=5)
+        
+        self.output_text = scrolledtext.ScrolledText(output_frame, height=10)
+        self.output_text.pack(fill='both', expand=True)
+    
+    def setup_restore_tab(self):
+        # Frame principal
+        main_frame = ttk.Frame(self.restore_tab)
+        main_frame.pack(fill='both', expand=True, padx=5, pady=5)
+        
+        # Bouton d'actualisation
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(fill='x', pady=(0, 5))
+        
+        ttk.Button(button_frame, text="Actualiser la liste des sauvegardes", 
+                  command=self.populate_restore_list).pack(side='left')
+        
+        # Treeview pour les sauvegardes disponibles
+        tree_frame = ttk.Frame(main_frame)
+        tree_frame.pack(fill='both', expand=True)
+        
+        self.restore_tree = ttk.Treeview(tree_frame, columns=('vm', 'date', 'type'), show='headings')
+        self.restore_tree.heading('vm', text='Machine Virtuelle')
+        self.restore_tree.heading('date', text='Date')
+        self.restore_tree.heading('type', text='Type')
+        self.restore_tree.column('vm', width=250)
+        self.restore_tree.column('date', width=150)
+        self.restore_tree.column('type', width=100)
+        
+        # Scrollbar
+        scrollbar = ttk.Scrollbar(tree_frame, orient='vertical', command=self.restore_tree.yview)
+        self.restore_tree.configure(yscrollcommand=scrollbar.set)
+        
+        self.restore_tree.pack(side='left', fill='both', expand=True)
+        scrollbar.pack(side='right', fill='y')
+        
+        # Bouton de restauration
+        ttk.Button(self.restore_tab, text="Restaurer la sauvegarde sélectionnée", 
+                  command=self.restore_backup).pack(pady=10)
+        
+        # Charger automatiquement la liste si les paramètres sont configurés
+        if self.config.get("backup_host") and self.config.get("backup_user"):
+            # Essayer de charger avec un délai
+            self.root.after(1000, self.try_populate_restore_list)
+    
+    def setup_config_tab(self):
+        # Configuration du serveur de backup
+        ttk.Label(self.config_tab, text="Serveur de backup:").grid(row=0, column=0, sticky='e', padx=5, pady=5)
+        self.backup_host = ttk.Entry(self.config_tab)
+        self.backup_host.insert(0, self.config.get("backup_host", ""))
+        self.backup_host.grid(row=0, column=1, sticky='ew', padx=5, pady=5)
+        
+        ttk.Label(self.config_tab, text="Utilisateur:").grid(row=1, column=0, sticky='e', padx=5, pady=5)
+        self.backup_user = ttk.Entry(self.config_tab)
+        self.backup_user.insert(0, self.config.get("backup_user", ""))
+        self.backup_user.grid(row=1, column=1, sticky='ew', padx=5, pady=5)
+        
+        ttk.Label(self.config_tab, text="Chemin sur le serveur:").grid(row=2, column=0, sticky='e', padx=5, pady=5)
+        self.backup_path = ttk.Entry(self.config_tab)
+        self.backup_path.insert(0, self.config.get("backup_path", "/backup/kvm"))
+        self.backup_path.grid(row=2, column=1, sticky='ew', padx=5, pady=5)
+        
+        # Mot de passe SSH
+        ttk.Label(self.config_tab, text="Mot de passe SSH:").grid(row=3, column=0, sticky='e', padx=5, pady=5)
+        self.ssh_password_entry = ttk.Entry(self.config_tab, show="*")
+        self.ssh_password_entry.grid(row=3, column=1, sticky='ew', padx=5, pady=5)
+        
+        # Sauvegarde automatique
+        self.auto_backup = tk.BooleanVar(value=self.config.get("auto_backup", False))
+        ttk.Checkbutton(self.config_tab, text="Sauvegarde automatique", variable=self.auto_backup).grid(row=4, column=0, columnspan=2, sticky='w', padx=5, pady=5)
+        
+        ttk.Label(self.config_tab, text="Fréquence (cron):").grid(row=5, column=0, sticky='e', padx=5, pady=5)
+        self.backup_freq = ttk.Entry(self.config_tab)
+        self.backup_freq.insert(0, self.config.get("backup_freq", "0 2 * * *"))
+        self.backup_freq.grid(row=5, column=1, sticky='ew', padx=5, pady=5)
+        
+        # Bouton de test de connexion
+        ttk.Button(self.config_tab, text="Tester la connexion SSH", 
+                  command=self.test_ssh_connection).grid(row=6, column=0, columnspan=2, pady=5)
+        
+        # Bouton de sauvegarde de configuration
+        ttk.Button(self.config_tab, text="Enregistrer la configuration", 
+                  command=self.save_configuration).grid(row=7, column=0, columnspan=2, pady=10)
+    
+    def setup_credits_tab(self):
+        """Configuration de l'onglet Crédits/À propos"""
+        # Frame principal avec padding
+        main_frame = ttk.Frame(self.credits_tab, padding=20)
+        main_frame.pack(fill='both', expand=True)
+        
+        # Titre de l'application
+        title_label = ttk.Label(main_frame, text="KVM Backup Tool", 
+                               font=('Arial', 16, 'bold'))
+        title_label.pack(pady=(0, 10))
+        
+        # Version
+        version_label = ttk.Label(main_frame, text="Version Production 2.0", 
+                                 font=('Arial', 10))
+        version_label.pack(pady=(0, 20))
+        
+        # Description
+        description_text = """
+Application de sauvegarde et restauration pour machines virtuelles KVM.
+Fonctionnalités principales :
+• Sauvegarde complète et incrémentielle
+• Transfert automatique vers serveur distant
+• Planification automatique avec cron
+• Vérification d'intégrité SHA256
+• Interface graphique intuitive
+        """.strip()
+        
+        description_label = ttk.Label(main_frame, text=description_text, 
+                                     font=('Arial', 10), justify='left')
+        description_label.pack(pady=(0, 30))
+        
+        # Section développeur
+        dev_frame = ttk.LabelFrame(main_frame, text="Développeur", padding=15)
+        dev_frame.pack(fill='x', pady=(0, 20))
+        
+        # Nom du développeur
+        dev_name_label = ttk.Label(dev_frame, text="Développé par : authentik", 
+                                  font=('Arial', 11, 'bold'))
+        dev_name_label.pack(anchor='w')
+        
+        # Lien vers le site
+        link_frame = ttk.Frame(dev_frame)
+        link_frame.pack(anchor='w', pady=(5, 0))
+        
+        ttk.Label(link_frame, text="Site web : ").pack(side='left')
+        
+        # Créer un lien cliquable
+        link_label = ttk.Label(link_frame, text="https://fabiansulu.com", 
+                              foreground='blue', cursor='hand2',
+                              font=('Arial', 10, 'underline'))
+        link_label.pack(side='left')
+        
+        # Fonction pour ouvrir le lien
+        def open_website(event):
+            import webbrowser
+            webbrowser.open("https://fabiansulu.com")
+        
+        link_label.bind("<Button-1>", open_website)
+        
+        # Informations techniques
+        tech_frame = ttk.LabelFrame(main_frame, text="Informations techniques", padding=15)
+        tech_frame.pack(fill='x')
+        
+        tech_info = """Python 3 • Tkinter • libvirt • paramiko • qemu-img"""
+        tech_label = ttk.Label(tech_frame, text=tech_info, font=('Arial', 9))
+        tech_label.pack()
+        
+        # Copyright en bas
+        copyright_label = ttk.Label(main_frame, text="© 2025 authentik - Tous droits réservés", 
+                                   font=('Arial', 8), foreground='gray')
+        copyright_label.pack(side='bottom', pady=(20, 0))
+    
+    def populate_vm_list(self):
+        self.vm_tree.delete(*self.vm_tree.get_children())
+        try:
+            conn = libvirt.open(self.config.get('libvirt_uri', 'qemu:///system'))
+            if conn is None:
+                self.log_output("Échec de la connexion à l'hyperviseur KVM")
+                return
+            
+            domains = conn.listAllDomains(0)
+            for domain in domains:
+                vm_name = domain.name()
+                selected = self.config["selected_vms"].get(vm_name, False)
+                self.vm_tree.insert('', 'end', values=(vm_name, '✓' if selected else ''))
+            
+            conn.close()
+        except Exception as e:
+            self.log_output(f"Erreur: {str(e)}")
+            self.logger.error(f"Erreur lors du peuplement de la liste VM: {str(e)}")
+    
+    def try_populate_restore_list(self):
+        """Essayer de charger la liste des sauvegardes sans afficher d'erreurs"""
+        try:
+            self.populate_restore_list()
+        except Exception as e:
+            self.logger.info(f"Impossible de charger les sauvegardes au démarrage: {str(e)}")
+            # Ajouter un message informatif dans l'interface
+            self.restore_tree.insert('', 'end', values=('Info', 'Cliquez sur "Actualiser" pour voir les sauvegardes', 'Configuration requise'))
+    
+    def populate_restore_list(self):
+        self.restore_tree.delete(*self.restore_tree.get_children())
+        try:
+            # Catalogue du serveur: une lecture de la fin ajoutée, copie locale si le serveur est injoignable
+            entries = BackupCatalog.from_config(self.ssh_pool, self.logger, self.config).sync()
+            if not entries:
+                self.log_output("Aucune sauvegarde trouvée sur le serveur distant")
+            for entry in entries:
+                self.restore_tree.insert('', 'end',
+                                         values=(entry["vm"], entry["date"], BackupCatalog.TYPE_LABELS[entry["type"]]))
+        except Exception as e:
+            self.log_output(f"Erreur lors de la récupération des sauvegardes: {str(e)}")
+            self.logger.error(f"Erreur lors de la récupération des sauvegardes: {str(e)}")
+    
+    def start_backup(self):
+        selected_items = self.vm_tree.selection()
+        if not selected_items:
+            messagebox.showwarning("Avertissement", "Aucune machine virtuelle sélectionnée")
+            return
+        
+        selected_vms = [self.vm_tree.item(item)['values'][0] for item in selected_items]
+        backup_type = self.backup_type.get()
+        jobs = self.jobs_var.get()
+        streaming = self.streaming_var.get()
+        repository_mode = self.repository_var.get()
+        
+        self.log_output(f"Début de la sauvegarde {'complète' if backup_type == 'full' else 'incrémentielle'} pour les VMs: {', '.join(selected_vms)}")
+        
+        for widgets in self.progress_rows.values():
+            for widget in widgets:
+                widget.destroy()
+        self.progress_rows = {}
+        
+        # Démarrer la sauvegarde dans un thread séparé pour ne pas bloquer l'interface
+        threading.Thread(target=self.perform_backup, args=(selected_vms, backup_type, jobs, streaming, repository_mode), daemon=True).start()
+    
+    def perform_backup(self, vm_names, backup_type, jobs=1, streaming=False, repository_mode=False):
+        # Répertoire propre à la tâche: deux exécutions (GUI, démon, cron) ne se partagent jamais leurs fichiers
+        temp_dir = tempfile.mkdtemp(prefix="kvm_backup-")
+        conn = None
+        
+        try:
+            conn = libvirt.open(self.config.get('libvirt_uri', 'qemu:///system'))
+            if conn is None:
+                self.log_output("Échec de la connexion à l'hyperviseur KVM")
+                return
+            
+            slots = ResourceSlots.from_config(self.config, jobs)
+            if jobs > 1:
+                self.log_output(f"Exécution parallèle: {jobs} VMs simultanées ({slots})")
+            
+            # Niveau adaptatif: comparé au débit d'envoi mesuré par le limiteur (flux et dépôt: étapes recouvertes)
+            compression = CompressionEngine.from_config(self.config, self.bandwidth, streaming or repository_mode)
+            repository = ChunkRepository.from_config(self.ssh_pool, self.logger, self.config, self.bandwidth) if repository_mode else None
+            history = BackupHistory.from_config(self.logger, self.config)
+            try:
+                self.bandwidth.seed(history.upload_rate())
+                mode = "repository" if repository_mode else "streaming" if streaming else "staged"
+                job_id = history.start_job(mode, backup_type, len(vm_names))
+                # Même moteur que le mode headless; les mesures par étape ne sont pas exportées depuis l'interface
+                pipeline = BackupPipeline.from_config(self, conn, backup_type, temp_dir, slots, compression, StageMetrics(), mode,
+                                                      repository, notify=self.log_output, progress=self.report_progress)
+                results = pipeline.run(vm_names, history, job_id)
+                history.finish_job(job_id, results)
+            finally:
+                compression.close()
+                if repository is not None:
+                    repository.close()
+                history.close()
+            
+            succeeded = sum(1 for ok in results.values() if ok)
+            self.log_output(f"Sauvegarde terminée: {succeeded}/{len(vm_names)} VMs sauvegardées")
+            self.log_output(pipeline.summary())
+            self.logger.info(pipeline.summary())
+            self.log_output(compression.summary())
+            self.logger.info(compression.summary())
+            if repository is not None:
+                self.log_output(repository.summary())
+                self.logger.info(repository.summary())
+        
+        except Exception as e:
+            self.log_output(f"Erreur générale lors de la sauvegarde: {str(e)}")
+            self.logger.error(f"Erreur générale lors de la sauvegarde: {str(e)}")
+        finally:
+            if conn is not None:
+                conn.close()
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    
+    def create_ssh_connection(self, max_retries=3):
+        """Créer une connexion SSH sécurisée avec retry et authentification par mot de passe"""
+        # Demander le mot de passe si pas encore saisi (une seule fois pour tous les threads)
+        with self._ssh_lock:
+            if not self.ssh_password:
+                password = self.events.call(self.ask_password)
+                if password:
+                    self.ssh_password = password
+                else:
+                    raise Exception("Mot de passe SSH requis")
+        
+        try:
+            return SSHTransportOptions.connect(self.config, self.logger, max_retries, password=self.ssh_password)
+        except paramiko.AuthenticationException:
+            self.logger.error("Échec d'authentification SSH - Mot de passe incorrect")
+            self.ssh_password = None  # Réinitialiser pour redemander
+            raise Exception("Mot de passe SSH incorrect")
+    
+    def restore_backup(self):
+        selected_item = self.restore_tree.selection()
+        if not selected_item:
+            messagebox.showwarning("Avertissement", "Aucune sauvegarde sélectionnée")
+            return
+        
+        item = self.restore_tree.item(selected_item)
+        vm_name = item['values'][0]
+        backup_date = item['values'][1]
+        
+        if not messagebox.askyesno("Confirmation", f"Voulez-vous vraiment restaurer {vm_name} (sauvegarde du {backup_date})?"):
+            return
+        
+        self.log_output(f"Début de la restauration de {vm_name} (sauvegarde du {backup_date})")
+        
+        import threading
+        threading.Thread(target=self.perform_restore, args=(vm_name, backup_date), daemon=True).start()
+    
+    def perform_restore(self, vm_name, backup_date):
+        local_temp_dir = "/tmp/kvm_restore"
+        # Hors du répertoire temporaire: un téléchargement interrompu est repris à la tentative suivante
+        download_dir = "/var/tmp/kvm_restore"
+        try:
+            with self.ssh_pool.sftp() as sftp:
+                backup_path = f"{self.config['backup_path']}/{vm_name}"
+                
+                date_str = datetime.strptime(backup_date, "%Y-%m-%d %H:%M:%S").strftime("%Y%m%d-%H%M%S")
+                backup_file = None
+                for file in sftp.listdir(backup_path):
+                    if date_str in file and (CompressionEngine.codec_for_archive(file) or file.endswith(ChunkRepository.MANIFEST_SUFFIX)):
+                        backup_file = file
+                        break
+                
+                if backup_file is None:
+                    self.log_output("Fichier de sauvegarde non trouvé")
+                    return
+            
+            # Restauration en flux: disques écrits directement à leur emplacement final (hors chaîne incrémentielle)
+            if self.config.get("streaming_restore", True) and ".incr." not in backup_file:
+                self.stream_restore(vm_name, f"{backup_path}/{backup_file}", backup_file)
+                self.events.post(messagebox.showinfo, "Succès", "Restauration terminée avec succès")
+                return
+            
+            os.makedirs(local_temp_dir, exist_ok=True)
+            if backup_file.endswith(ChunkRepository.MANIFEST_SUFFIX):
+                # Dépôt dédupliqué: disques reconstitués bloc par bloc à partir du manifeste
+                repository = ChunkRepository.from_config(self.ssh_pool, self.logger, self.config)
+                repository.restore(f"{backup_path}/{backup_file}", local_temp_dir)
+                self.log_output(f"Disques de {vm_name} reconstitués depuis le dépôt")
+            else:
+                self.restore_archive(vm_name, backup_path, backup_file, local_temp_dir, download_dir)
+            
+            # Restaurer la configuration XML
+            xml_file = os.path.join(local_temp_dir, f"{vm_name}.xml")
+            if not os.path.exists(xml_file):
+                self.log_output("Fichier de configuration XML non trouvé")
+                return
+            
+            with open(xml_file, 'r') as f:
+                xml_config = f.read()
+            
+            # Vérifier si la VM existe déjà
+            conn = libvirt.open(self.config.get('libvirt_uri', 'qemu:///system'))
+            if conn is None:
+                self.log_output("Échec de la connexion à l'hyperviseur KVM")
+                return
+            
+            self.remove_existing_vm(conn, vm_name)
+            
+            # Restaurer les disques
+            members = CheckpointBackup.disk_members(xml_config, vm_name)
+            disk_files = [f for f in os.listdir(local_temp_dir) if f in members]
+            restored = {}
+            for disk_file in disk_files:
+                disk_path = os.path.join("/var/lib/libvirt/images", disk_file)
+                src_path = os.path.join(local_temp_dir, disk_file)
+                
+                SparseFile.copy(src_path, disk_path)
+                os.chmod(disk_path, 0o660)
+                restored[disk_file] = disk_path
+            
+            xml_config = StreamingRestorer.relocate_disks(xml_config, vm_name, restored)
+            
+            # Recréer la VM
+            conn.defineXML(xml_config)
+            conn.close()
+            
+            self.log_output(f"Restauration de {vm_name} terminée avec succès")
+            self.events.post(messagebox.showinfo, "Succès", "Restauration terminée avec succès")
+        
+        except Exception as e:
+            self.log_output(f"Erreur lors de la restauration: {str(e)}")
+            self.events.post(messagebox.showerror, "Erreur", f"Erreur lors de la restauration: {str(e)}")
+        finally:
+            shutil.rmtree(local_temp_dir, ignore_errors=True)
+    
+    def remove_existing_vm(self, conn, vm_name):
+        """Arrêter et retirer la VM existante (métadonnées de points de contrôle comprises)"""
+        try:
+            existing_vm = conn.lookupByName(vm_name)
+            if existing_vm is not None:
+                if existing_vm.isActive():
+                    existing_vm.destroy()
+                existing_vm.undefineFlags(libvirt.VIR_DOMAIN_UNDEFINE_CHECKPOINTS_METADATA)
+        except libvirt.libvirtError:
+            pass
+    
+    def stream_restore(self, vm_name, remote_path, backup_file):
+        """Restaurer sans passage par /tmp: le flux distant est décodé vers les disques finaux"""
+        start = time.monotonic()
+        conn = libvirt.open(self.config.get('libvirt_uri', 'qemu:///system'))
+        if conn is None:
+            raise Exception("Échec de la connexion à l'hyperviseur KVM")
+        try:
+            restorer = StreamingRestorer.from_config(self.ssh_pool, self.logger, self.config)
+            remove_existing = lambda xml_config: self.remove_existing_vm(conn, vm_name)
+            if backup_file.endswith(ChunkRepository.MANIFEST_SUFFIX):
+                repository = ChunkRepository.from_config(self.ssh_pool, self.logger, self.config)
+                xml_config, restored = restorer.restore_manifest(repository, remote_path, vm_name, remove_existing)
+            else:
+                xml_config, restored = restorer.restore_archive(remote_path, backup_file, vm_name, remove_existing)
+            
+            for disk_path in restored.values():
+                os.chmod(disk_path, 0o660)
+            conn.defineXML(StreamingRestorer.relocate_disks(xml_config, vm_name, restored))
+        finally:
+            conn.close()
+        
+        self.log_output(f"Restauration en flux de {vm_name} terminée en {time.monotonic() - start:.1f}s "
+                        f"({len(restored)} disque(s))")
+    
+    def restore_archive(self, vm_name, backup_path, backup_file, local_temp_dir, download_dir):
+        """Télécharger et extraire une archive (et les archives parentes d'une incrémentielle)"""
+        os.makedirs(download_dir, exist_ok=True)
+        local_archive_path = os.path.join(download_dir, backup_file)
+        downloader = ResumableDownloader.from_config(self.ssh_pool, self.logger, self.config)
+        rate = downloader.download(f"{backup_path}/{backup_file}", local_archive_path)
+        self.log_output(f"Archive {backup_file} téléchargée ({rate:.1f} Mo/s)")
+        
+        # Extraire l'archive
+        with open(local_archive_path, "rb") as archive_file:
+            with CompressionEngine.open_archive(archive_file, backup_file) as tar:
+                tar.extractall(path=local_temp_dir)
+        os.remove(local_archive_path)
+        
+        # Incrémentielle: appliquer la chaîne sur la sauvegarde complète dont elle dépend
+        chain_file = os.path.join(local_temp_dir, f"{vm_name}.chain.json")
+        if os.path.exists(chain_file):
+            with open(chain_file, 'r') as f:
+                chain = json.load(f)["chain"]
+            if len(chain) > 1:
+                self.restore_chain(vm_name, backup_path, chain[:-1], local_temp_dir, download_dir, downloader)
+    
+    def restore_chain(self, vm_name, backup_path, parents, local_temp_dir, download_dir, downloader):
+        """Reconstituer les disques complets à partir des archives parentes d'une incrémentielle"""
+        chain_dir = os.path.join(local_temp_dir, "chain")
+        layer_dirs = []
+        for archive_name in parents:
+            self.log_output(f"Récupération de {archive_name} (chaîne incrémentielle)")
+            layer_dir = os.path.join(chain_dir, archive_name)
+            os.makedirs(layer_dir, exist_ok=True)
+            local_archive_path = os.path.join(download_dir, archive_name)
+            downloader.download(f"{backup_path}/{archive_name}", local_archive_path)
+            with open(local_archive_path, "rb") as archive_file:
+                with CompressionEngine.open_archive(archive_file, archive_name) as tar:
+                    tar.extractall(path=layer_dir)
+            os.remove(local_archive_path)
+            layer_dirs.append(layer_dir)
+        
+        with open(os.path.join(local_temp_dir, f"{vm_name}.xml"), 'r') as f:
+            members = CheckpointBackup.disk_members(f.read(), vm_name)
+        for disk_file in os.listdir(local_temp_dir):
+            if disk_file in members:
+                top_layer = os.path.join(local_temp_dir, disk_file)
+                layers = [os.path.join(d, disk_file) for d in layer_dirs if os.path.exists(os.path.join(d, disk_file))]
+                CheckpointBackup.flatten(layers + [top_layer], f"{top_layer}.flat")
+                os.replace(f"{top_layer}.flat", top_layer)
+        shutil.rmtree(chain_dir, ignore_errors=True)
+    
+    def save_configuration(self):
+        # Valider les entrées
+        backup_host = self.backup_host.get().strip()
+        backup_user = self.backup_user.get().strip()
+        backup_path = self.backup_path.get().strip()
+        backup_freq = self.backup_freq.get().strip()
+        
+        # Validation des champs
+        errors = []
+        if not InputValidator.validate_hostname(backup_host):
+            errors.append("Nom d'hôte ou IP invalide")
+        
+        if not InputValidator.validate_username(backup_user):
+            errors.append("Nom d'utilisateur invalide")
+        
+        if not InputValidator.validate_path(backup_path):
+            errors.append("Chemin de sauvegarde invalide")
+        
+        if self.auto_backup.get() and not InputValidator.validate_cron_expression(backup_freq):
+            errors.append("Expression cron invalide (format: minute heure jour mois jour_semaine)")
+        
+        if errors:
+            error_msg = "Erreurs de validation:\n" + "\n".join(f"- {error}" for error in errors)
+            messagebox.showerror("Erreurs de validation", error_msg)
+            self.logger.error(f"Erreurs de validation: {errors}")
+            return
+        
+        # Sauvegarder la configuration
+        self.config["backup_host"] = backup_host
+        self.config["backup_user"] = backup_user
+        self.config["backup_path"] = backup_path
+        self.config["auto_backup"] = self.auto_backup.get()
+        self.config["backup_freq"] = backup_freq
+        
+        # Capturer le mot de passe SSH s'il est saisi
+        if self.ssh_password_entry.get():
+            self.ssh_password = self.ssh_password_entry.get()
+        
+        self.save_config()
+        self.logger.info("Configuration sauvegardée avec succès")
+        
+        # Les connexions existantes visent peut-être un autre serveur
+        self.ssh_pool.close()
+        
+        if self.config["auto_backup"]:
+            self.setup_cron_job()
+        
+        self.log_output("Configuration enregistrée")
+        messagebox.showinfo("Succès", "Configuration enregistrée avec succès")
+    
+    def test_ssh_connection(self):
+        """Tester la connexion SSH avec les paramètres actuels"""
+        # Valider les champs obligatoires
+        backup_host = self.backup_host.get().strip()
+        backup_user = self.backup_user.get().strip()
+        
+        if not backup_host:
+            messagebox.showerror("Erreur", "Veuillez saisir l'adresse du serveur de backup")
+            return
+        
+        if not backup_user:
+            messagebox.showerror("Erreur", "Veuillez saisir le nom d'utilisateur")
+            return
+        
+        # Sauvegarder temporairement la config pour le test
+        old_config = self.config.copy()
+        self.config["backup_host"] = backup_host
+        self.config["backup_user"] = backup_user
+        
+        try:
+            self.log_output("Test de connexion SSH en cours...")
+            ssh = self.create_ssh_connection()
+            
+            # Test simple : lister le répertoire home
+            stdin, stdout, stderr = ssh.exec_command('pwd')
+            result = stdout.read().decode().strip()
+            
+            ssh.close()
+            
+            self.log_output(f"✓ Connexion SSH réussie ! Répertoire: {result}")
+            messagebox.showinfo("Succès", f"Connexion SSH établie avec succès !\nRépertoire distant: {result}")
+        
+        except Exception as e:
+            error_msg = str(e)
+            self.log_output(f"✗ Échec de la connexion SSH: {error_msg}")
+            messagebox.showerror("Erreur de connexion", f"Impossible de se connecter au serveur SSH:\n{error_msg}")
+        
+        finally:
+            # Restaurer l'ancienne config
+            self.config = old_config
+    
+    def setup_cron_job(self):
+        try:
+            cron = CronTab(user=True)
+            cron.remove_all(comment="kvm_backup")
+            if self.config.get("daemon_mode"):
+                # Le démon (--daemon) planifie lui-même backup_freq: pas de tâche cron en double
+                cron.write()
+                self.log_output(f"Planification assurée par le démon: {self.config['backup_freq']}")
+                return
+            
+            entry_point = os.path.join(os.path.dirname(os.path.abspath(__file__)), "auth_kvm_backup.py")
+            job = cron.new(command=f"python3 {entry_point} --auto", comment="kvm_backup")
+            job.setall(self.config["backup_freq"])
+            
+            cron.write()
+            self.log_output(f"Tâche cron configurée: {self.config['backup_freq']}")
+        except Exception as e:
+            self.log_output(f"Erreur lors de la configuration cron: {str(e)}")
+    
+    def ask_password(self):
+        """Demander le mot de passe SSH (boucle Tk uniquement)"""
+        password_dialog = PasswordDialog(self.root)
+        self.root.wait_window(password_dialog.dialog)
+        return password_dialog.password
+    
+    def log_output(self, message):
+        """Journaliser dans la console de l'interface (appelable depuis n'importe quel thread)"""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._log_lines.append(f"[{timestamp}] {message}\n")
+        self.events.post_latest("log", self._flush_log)
+    
+    def _flush_log(self):
+        lines = []
+        while self._log_lines:
+            lines.append(self._log_lines.popleft())
+        if not lines:
+            return
+        self.output_text.insert('end', "".join(lines))
+        # Console bornée: les lignes les plus anciennes sont retirées
+        excess = int(self.output_text.index('end-1c').split('.')[0]) - self.log_max_lines
+        if excess > 0:
+            self.output_text.delete('1.0', f"{excess + 1}.0")
+        self.output_text.see('end')
+    
+    def report_progress(self, vm_name, stage, done, total, rate, eta):
+        """Rappel des ProgressMeter (threads de travail): seul le dernier état de chaque VM est affiché"""
+        self.events.post_latest(("progress", vm_name), self._show_progress, vm_name, stage, done, total, rate, eta)
+    
+    def _show_progress(self, vm_name, stage, done, total, rate, eta):
+        if vm_name not in self.progress_rows:
+            row = len(self.progress_rows)
+            label = ttk.Label(self.progress_frame, text=vm_name, width=20)
+            bar = ttk.Progressbar(self.progress_frame, mode='determinate', maximum=100)
+            status = ttk.Label(self.progress_frame, width=60)
+            label.grid(row=row, column=0, sticky='w')
+            bar.grid(row=row, column=1, sticky='ew', padx=5)
+            status.grid(row=row, column=2, sticky='w')
+            self.progress_rows[vm_name] = (label, bar, status)
+        _, bar, status = self.progress_rows[vm_name]
+        
+        text = f"{stage}: {done / (1024 ** 3):.2f}"
+        if total:
+            bar['value'] = min(100, done * 100 / total)
+            text += f"/{total / (1024 ** 3):.2f}"
+        text += f" Go - {rate / (1024 * 1024):.1f} Mo/s"
+        if eta is not None:
+            text += f" - reste {int(eta) // 3600:d}:{int(eta) % 3600 // 60:02d}:{int(eta) % 60:02d}"
+        status['text'] = text
@@ -0,0 +1,462 @@
+"""Dépôt dédupliqué: blocs adressés par SHA256, index local et filtres de Bloom, manifestes par sauvegarde"""
+import subprocess
+import os
+import json
+import hashlib
+import threading
+import time
+import zlib
+from datetime import datetime
+from collections import deque
+from kvm_backup_archive import CompressionEngine, SparseFile
+from kvm_backup_transfer import ParallelUploader
+
+class BloomFilter:
+    """Filtre de Bloom de capacité fixe sur des empreintes SHA256"""
+    
+    HASHES = 7
+    BITS_PER_ENTRY = 10
+    
+    def __init__(self, capacity):
+        self.capacity = max(capacity, 1 << 16)
+        self.count = 0
+        self._size = self.capacity * self.BITS_PER_ENTRY
+        self._bits = bytearray((self._size + 7) // 8)
+    
+    def _positions(self, digest):
+        # Les empreintes SHA256 sont uniformes: leurs tranches servent directement de fonctions de hachage
+        for i in range(self.HASHES):
+            yield int.from_bytes(digest[i * 4:i * 4 + 4], "big") % self._size
+    
+    def add(self, digest):
+        for position in self._positions(digest):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+    
+    def __contains__(self, digest):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+class ChunkIndex:
+    """Index local compact des blocs présents dans le dépôt, précédé de filtres de Bloom"""
+    
+    DIGEST_SIZE = 32
+    HEADER = b"KVMIDX1\n"
+    # Marge du filtre initial: une sauvegarde peut ajouter autant de blocs que l'index en connaît déjà
+    BLOOM_HEADROOM = 2
+    
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.generation = None
+        self._sorted = b""  # Empreintes triées, concaténées (32 octets chacune)
+        self._added = set()
+        self._lock = threading.Lock()
+        self._reset_bloom(0)
+    
+    def __len__(self):
+        return len(self._sorted) // self.DIGEST_SIZE + len(self._added)
+    
+    def load(self):
+        """Charger l'index; retourne la génération du dépôt qu'il décrit (None si absent)"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except IOError:
+            return None
+        if not data.startswith(self.HEADER):
+            return None
+        end = data.index(b"\n", len(self.HEADER))
+        self.reset(data[end + 1:], data[len(self.HEADER):end].decode())
+        return self.generation
+    
+    def reset(self, digests, generation):
+        """Remplacer le contenu de l'index (empreintes concaténées ou itérable d'empreintes)"""
+        if not isinstance(digests, bytes):
+            digests = b"".join(sorted(set(digests)))
+        with self._lock:
+            self._sorted = digests
+            self._added = set()
+            self.generation = generation
+            self._reset_bloom(len(digests) // self.DIGEST_SIZE * self.BLOOM_HEADROOM)
+            for i in range(0, len(digests), self.DIGEST_SIZE):
+                self._blooms[-1].add(digests[i:i + self.DIGEST_SIZE])
+    
+    def save(self):
+        with self._lock:
+            digests = b"".join(sorted(self._known() | self._added)) if self._added else self._sorted
+            self._sorted, self._added = digests, set()
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(self.HEADER + (self.generation or "").encode() + b"\n" + digests)
+        os.replace(temp_path, self.path)
+    
+    def add(self, digest):
+        with self._lock:
+            self._added.add(digest)
+            if self._blooms[-1].count >= self._blooms[-1].capacity:
+                # Filtre saturé: les nouveaux blocs vont dans un filtre deux fois plus grand, sans rien relire
+                self._blooms.append(BloomFilter(self._blooms[-1].capacity * 2))
+            self._blooms[-1].add(digest)
+    
+    def __contains__(self, digest):
+        with self._lock:
+            # Pré-contrôle: un bloc absent du filtre n'est certainement pas dans le dépôt
+            if not any(digest in bloom for bloom in self._blooms):
+                return False
+            if digest in self._added:
+                return True
+            low, high = 0, len(self._sorted) // self.DIGEST_SIZE
+            while low < high:
+                middle = (low + high) // 2
+                candidate = self._sorted[middle * self.DIGEST_SIZE:(middle + 1) * self.DIGEST_SIZE]
+                if candidate == digest:
+                    return True
+                if candidate < digest:
+                    low = middle + 1
+                else:
+                    high = middle
+            return False
+    
+    def _known(self):
+        return {self._sorted[i:i + self.DIGEST_SIZE] for i in range(0, len(self._sorted), self.DIGEST_SIZE)}
+    
+    def _reset_bloom(self, capacity):
+        self._blooms = [BloomFilter(capacity)]
+
+class ChunkRepository:
+    """Dépôt dédupliqué sur le serveur de backup: blocs définis par le contenu, adressés par leur SHA256"""
+    
+    INDEX_FILE = "~/.kvm_backup_chunks.idx"
+    MANIFEST_SUFFIX = ".chunks.json"
+    
+    def __init__(self, pool, logger, root, streams=4, block_size=64 * 1024, min_size=256 * 1024,
+                 average_size=1024 * 1024, max_size=4 * 1024 * 1024, index_file=INDEX_FILE, limiter=None):
+        self.pool = pool
+        self.logger = logger
+        self.limiter = limiter
+        self.root = root
+        self.streams = max(1, int(streams))
+        self.block_size = block_size
+        self.min_size = min_size
+        self.max_size = max_size
+        # Une frontière tombe en moyenne tous les (mask + 1) blocs au-delà de la taille minimale
+        blocks = max(2, (average_size - min_size) // block_size)
+        self.mask = (1 << (blocks.bit_length() - 1)) - 1
+        self.index = ChunkIndex(index_file)
+        self._opened = False
+        self._lease = None
+        self._open_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"bytes": 0, "chunks": 0, "zero_bytes": 0, "new_bytes": 0, "new_chunks": 0, "uploaded_bytes": 0}
+    
+    @classmethod
+    def from_config(cls, pool, logger, config, limiter=None):
+        return cls(
+            pool, logger, f"{config['backup_path']}/repository",
+            streams=config.get("upload_streams", 4),
+            average_size=int(config.get("repository_chunk_size_kb", 1024) * 1024),
+            limiter=limiter
+        )
+    
+    def open(self):
+        """Préparer le dépôt distant et synchroniser l'index local avec sa génération"""
+        with self._open_lock:
+            if self._opened:
+                return
+            with self.pool.sftp() as sftp:
+                try:
+                    with sftp.open(f"{self.root}/generation", "r") as f:
+                        generation = f.read().decode().strip()
+                except IOError:
+                    generation = self._initialize(sftp)
+                
+                # Index absent ou dépôt modifié (purge, autre hôte): relister les blocs distants
+                if self.index.load() != generation:
+                    self.logger.info(f"Reconstruction de l'index local du dépôt {self.root}")
+                    digests = []
+                    for prefix in sftp.listdir(f"{self.root}/chunks"):
+                        digests.extend(bytes.fromhex(name) for name in sftp.listdir(f"{self.root}/chunks/{prefix}")
+                                       if len(name) == ChunkIndex.DIGEST_SIZE * 2)
+                    self.index.reset(digests, generation)
+                    self.index.save()
+                self._take_lease(sftp)
+            self.logger.info(f"Dépôt {self.root}: {len(self.index)} blocs connus")
+            self._opened = True
+    
+    def _initialize(self, sftp):
+        for path in (self.root, f"{self.root}/chunks"):
+            try:
+                sftp.mkdir(path)
+            except IOError:
+                pass
+        for prefix in range(256):
+            try:
+                sftp.mkdir(f"{self.root}/chunks/{prefix:02x}")
+            except IOError:
+                pass
+        generation = os.urandom(16).hex()
+        with sftp.open(f"{self.root}/generation", "w") as f:
+            f.write(generation)
+        return generation
+    
+    def close(self):
+        if self._opened:
+            self.index.save()
+            self._release_lease()
+    
+    def _take_lease(self, sftp):
+        """Signaler une sauvegarde en cours: `--prune` ne supprime aucun bloc tant que le bail est actif"""
+        try:
+            sftp.mkdir(f"{self.root}/leases")
+        except IOError:
+            pass  # Le répertoire existe déjà
+        self._lease = f"{self.root}/leases/{os.uname().nodename}-{os.getpid()}-{os.urandom(4).hex()}"
+        with sftp.open(self._lease, "w") as f:
+            f.write(datetime.now().isoformat())
+    
+    def _renew_lease(self, sftp):
+        if self._lease:
+            now = time.time()
+            sftp.utime(self._lease, (now, now))
+    
+    def _release_lease(self):
+        lease, self._lease = self._lease, None
+        if lease:
+            try:
+                with self.pool.sftp() as sftp:
+                    sftp.remove(lease)
+            except (IOError, OSError) as e:
+                self.logger.warning(f"Bail du dépôt {lease} non supprimé: {str(e)}")
+    
+    def active_leases(self, sftp, max_age):
+        """Sauvegardes en cours vers le dépôt (baux renouvelés depuis moins de `max_age` secondes)"""
+        try:
+            leases = sftp.listdir_attr(f"{self.root}/leases")
+        except IOError:
+            return []
+        cutoff = time.time() - max_age
+        return [attr.filename for attr in leases if attr.st_mtime is not None and attr.st_mtime > cutoff]
+    
+    def split(self, fileobj, length):
+        """Découper une plage en blocs dont les frontières, alignées sur block_size, sont choisies par le contenu
+        
+        Ce n'est pas un découpage glissant octet par octet: un disque est réécrit sur place par blocs alignés
+        (secteurs, blocs du système de fichiers invité), sans insertion qui décale la suite. Un seul CRC32 par bloc
+        de 64 Ko suffit donc et reste rapide en Python, là où une empreinte glissante coûterait un calcul par octet.
+        """
+        blocks, size = [], 0
+        while length > 0:
+            block = fileobj.read(min(self.block_size, length))
+            if not block:
+                raise IOError(f"Fin de fichier inattendue dans {fileobj.name}")
+            length -= len(block)
+            blocks.append(block)
+            size += len(block)
+            if size >= self.max_size or (size >= self.min_size and zlib.crc32(block) & self.mask == self.mask):
+                yield b"".join(blocks)
+                blocks, size = [], 0
+        if blocks:
+            yield b"".join(blocks)
+    
+    def store_disk(self, source_path, compression):
+        """Envoyer les blocs absents du dépôt; retourne la liste [empreinte, longueur] du disque"""
+        self.open()
+        chunks = []
+        in_flight = deque()
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.streams, thread_name_prefix="kvm_chunks") as executor, \
+                open(source_path, "rb") as source:
+            # Les trous ne sont pas lus: référence nulle, recréée en trou à la restauration
+            extents, size = SparseFile.extents(source)
+            position = 0
+            for offset, length in extents + [(size, 0)]:
+                if offset > position:
+                    self._append_zero(chunks, offset - position)
+                position = offset + length
+                source.seek(offset)
+                for data in self.split(source, length):
+                    with self._stats_lock:
+                        self._stats["bytes"] += len(data)
+                        self._stats["chunks"] += 1
+                    if data.count(0) == len(data):
+                        self._append_zero(chunks, len(data))
+                        continue
+                    digest = hashlib.sha256(data).digest()
+                    chunks.append([digest.hex(), len(data)])
+                    if digest in self.index:
+                        continue
+                    in_flight.append(executor.submit(self._store_chunk, digest, data, compression))
+                    # Nombre borné de blocs en mémoire
+                    while len(in_flight) > self.streams * 2:
+                        in_flight.popleft().result()
+            while in_flight:
+                in_flight.popleft().result()
+        return chunks
+    
+    def _append_zero(self, chunks, length):
+        if chunks and chunks[-1][0] is None:
+            chunks[-1][1] += length
+        else:
+            chunks.append([None, length])
+        with self._stats_lock:
+            self._stats["zero_bytes"] += length
+    
+    def _store_chunk(self, digest, data, compression):
+        # Un même bloc peut apparaître simultanément dans plusieurs VMs: un seul envoi
+        with self._pending_lock:
+            if digest in self.index:
+                return
+            done = self._pending.get(digest)
+            owner = done is None
+            if owner:
+                done = self._pending[digest] = threading.Event()
+        if not owner:
+            done.wait()
+            if digest not in self.index:
+                raise Exception(f"Envoi du bloc {digest.hex()} échoué")
+            return
+        
+        try:
+            start = time.monotonic()
+            compressed, cpu_seconds = compression.compress_block(data)
+            compression.record(len(data), len(compressed), time.monotonic() - start, cpu_seconds)
+            chunk_path = self.chunk_path(digest.hex())
+            if self.limiter is not None:
+                self.limiter.consume(len(compressed))
+            with self.pool.sftp() as sftp:
+                with sftp.open(f"{chunk_path}.part", "wb") as chunk_file:
+                    chunk_file.set_pipelined(True)
+                    chunk_file.write(compressed)
+                ParallelUploader.commit(sftp, f"{chunk_path}.part", chunk_path)
+            self.index.add(digest)
+            with self._stats_lock:
+                self._stats["new_bytes"] += len(data)
+                self._stats["new_chunks"] += 1
+                self._stats["uploaded_bytes"] += len(compressed)
+        finally:
+            with self._pending_lock:
+                del self._pending[digest]
+            done.set()
+    
+    def chunk_path(self, digest_hex):
+        return f"{self.root}/chunks/{digest_hex[:2]}/{digest_hex}"
+    
+    def write_manifest(self, remote_vm_dir, manifest_name, manifest):
+        """Publier le manifeste de la sauvegarde (références des blocs de chaque disque)"""
+        remote_path = f"{remote_vm_dir}/{manifest_name}"
+        with self.pool.sftp() as sftp:
+            with sftp.open(f"{remote_path}.part", "w") as manifest_file:
+                manifest_file.write(json.dumps(manifest))
+            ParallelUploader.commit(sftp, f"{remote_path}.part", remote_path)
+            # Une tâche longue reste visible de `--prune` tant qu'elle publie des manifestes
+            self._renew_lease(sftp)
+    
+    def read_manifest(self, remote_path):
+        with self.pool.sftp() as sftp, sftp.open(remote_path, "r") as manifest_file:
+            return json.loads(manifest_file.read())
+    
+    def unreferenced_chunks(self, manifest_paths, grace=0):
+        """Blocs (et fichiers .part abandonnés) qu'aucun des manifestes donnés ne référence: [(chemin, taille)]
+        
+        Les blocs écrits depuis moins de `grace` secondes sont gardés: ils peuvent appartenir à une sauvegarde dont
+        le manifeste n'est pas encore publié.
+        """
+        cutoff = time.time() - grace
+        referenced = set()
+        for manifest_path in manifest_paths:
+            for disk in self.read_manifest(manifest_path)["disks"]:
+                referenced.update(digest_hex for digest_hex, _ in disk["chunks"] if digest_hex is not None)
+        
+        unreferenced = []
+        with self.pool.sftp() as sftp:
+            try:
+                prefixes = sftp.listdir(f"{self.root}/chunks")
+            except IOError:
+                return []
+            for prefix in prefixes:
+                for attr in sftp.listdir_attr(f"{self.root}/chunks/{prefix}"):
+                    if attr.st_mtime is not None and attr.st_mtime > cutoff:
+                        continue
+                    if attr.filename.split(".")[0] not in referenced or attr.filename.endswith(ParallelUploader.PART_SUFFIX):
+                        unreferenced.append((f"{self.root}/chunks/{prefix}/{attr.filename}", attr.st_size))
+        return unreferenced
+    
+    def bump_generation(self, sftp):
+        """Changer la génération du dépôt: les index locaux seront reconstruits à la prochaine ouverture"""
+        part_path = f"{self.root}/generation{ParallelUploader.PART_SUFFIX}"
+        with sftp.open(part_path, "w") as f:
+            f.write(os.urandom(16).hex())
+        ParallelUploader.commit(sftp, part_path, f"{self.root}/generation")
+    
+    def restore_disk(self, chunks, output_path):
+        """Reconstituer une image brute à partir de ses blocs, téléchargés en parallèle"""
+        offsets = []
+        offset = 0
+        for digest_hex, length in chunks:
+            # Référence nulle: trou laissé par ftruncate
+            if digest_hex is not None:
+                offsets.append((digest_hex, offset, length))
+            offset += length
+        
+        def fetch(item):
+            digest_hex, chunk_offset, length = item
+            with self.pool.sftp() as sftp, sftp.open(self.chunk_path(digest_hex), "rb") as chunk_file:
+                chunk_file.prefetch()
+                data = CompressionEngine.decompress_block(chunk_file.read())
+            if len(data) != length or hashlib.sha256(data).hexdigest() != digest_hex:
+                raise Exception(f"Bloc {digest_hex} corrompu dans le dépôt")
+            os.pwrite(fd, data, chunk_offset)
+        
+        fd = os.open(output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, offset)
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.streams, thread_name_prefix="kvm_chunks") as executor:
+                for _ in executor.map(fetch, offsets):
+                    pass
+        finally:
+            os.close(fd)
+    
+    def restore(self, remote_path, output_dir):
+        """Restaurer la configuration XML et les disques (qcow2) décrits par un manifeste"""
+        manifest = self.read_manifest(remote_path)
+        with open(os.path.join(output_dir, f"{manifest['vm']}.xml"), "w") as f:
+            f.write(manifest["xml"])
+        for disk in manifest["disks"]:
+            raw_path = os.path.join(output_dir, f"{disk['name']}.raw")
+            self.restore_disk(disk["chunks"], raw_path)
+            subprocess.run(["qemu-img", "convert", "-f", "raw", "-O", "qcow2", raw_path,
+                            os.path.join(output_dir, disk["name"])], check=True)
+            os.remove(raw_path)
+        return manifest
+    
+    def summary(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        mb = lambda value: value / (1024 * 1024)
+        return (f"Dépôt: {mb(stats['bytes']):.1f} Mo lus en {stats['chunks']} blocs, {mb(stats['zero_bytes']):.1f} Mo de zéros ou trous ignorés, "
+                f"{mb(stats['new_bytes']):.1f} Mo nouveaux ({stats['new_chunks']} blocs), "
+                f"{mb(stats['uploaded_bytes']):.1f} Mo envoyés après compression")
+    
+    @staticmethod
+    def prepare_raw_disks(checkpoints, domain, vm_name, disks, timestamp, temp_dir, use_checkpoints=True):
+        """Retourner [(nom, image brute)]: le découpage porte sur le contenu vu par l'invité, pas sur le qcow2"""
+        if use_checkpoints and checkpoints.supported(domain):
+            _, members = checkpoints.export(domain, vm_name, timestamp, None, temp_dir,
+                                            target_format="raw", create_checkpoint=False)
+            return members
+        
+        members = []
+        for disk_path in disks:
+            arcname = f"{vm_name}_{os.path.basename(disk_path)}"
+            result = subprocess.run(["qemu-img", "info", "--output=json", "--force-share", disk_path],
+                                    capture_output=True, text=True, check=True)
+            info = json.loads(result.stdout)
+            if info.get("format") == "raw" and not info.get("backing-filename"):
+                members.append((arcname, disk_path))
+                continue
+            raw_file = os.path.join(temp_dir, f"{arcname}.raw")
+            subprocess.run(["qemu-img", "convert", "-O", "raw", disk_path, raw_file], check=True)
+            members.append((arcname, raw_file))
+        return members
@@ -0,0 +1,273 @@
+"""Restauration en flux: lecture anticipée du fichier distant, écriture des disques à leur emplacement final"""
+import subprocess
+import os
+import xml.etree.ElementTree as ET
+import threading
+import queue
+from kvm_backup_archive import CompressionEngine, SparseFile
+from kvm_backup_snapshot import CheckpointBackup
+
+class RemoteReadahead:
+    """Lecture séquentielle d'un fichier distant: plusieurs fenêtres lues en même temps sur des canaux du pool, rendues dans
+    l'ordre; au plus `windows` fenêtres en vol ou en attente de lecture (mémoire bornée)
+    
+    Fenêtres courtes: paramiko parcourt tous les blocs en attente à chaque lecture de 32 Ko, le coût d'une fenêtre croît
+    avec le carré de sa taille; le parallélisme entre canaux remplace la profondeur d'une seule fenêtre.
+    """
+    
+    def __init__(self, pool, remote_path, size, window_size=512 * 1024, windows=16, streams=4):
+        self.size = size
+        self.window_size = window_size
+        self.windows = max(1, int(windows))
+        self._ready = {}  # index de fenêtre -> données
+        self._next = 0  # Prochaine fenêtre à demander
+        self._current = 0  # Fenêtre en cours de lecture par le consommateur
+        self._count = -(-size // window_size)
+        self._buffer = b""
+        self._position = 0  # Position de lecture dans la fenêtre courante (pas de recopie du reste)
+        self._error = None
+        self._stop = False
+        self._condition = threading.Condition()
+        # Chaque flux a son canal: les fenêtres voisines arrivent en parallèle, sans attente entre deux fenêtres
+        self._threads = [threading.Thread(target=self._fetch, args=(pool, remote_path), daemon=True)
+                         for _ in range(max(1, min(int(streams), self.windows, self._count)))]
+        for thread in self._threads:
+            thread.start()
+    
+    def _fetch(self, pool, remote_path):
+        try:
+            with pool.sftp() as sftp, sftp.open(remote_path, "rb") as remote_file:
+                while True:
+                    with self._condition:
+                        while not self._stop and self._error is None and self._next >= self._current + self.windows:
+                            self._condition.wait()
+                        if self._stop or self._error is not None or self._next >= self._count:
+                            return
+                        index = self._next
+                        self._next += 1
+                    offset = index * self.window_size
+                    # Une fenêtre = un lot de requêtes en pipeline
+                    data = b"".join(remote_file.readv([(offset, min(self.window_size, self.size - offset))]))
+                    with self._condition:
+                        self._ready[index] = data
+                        self._condition.notify_all()
+        except Exception as e:
+            with self._condition:
+                self._error = self._error or e
+                self._condition.notify_all()
+    
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self._position >= len(self._buffer):
+                if self._current >= self._count:
+                    break  # Fin de fichier: les lectures suivantes retournent vide
+                with self._condition:
+                    while self._current not in self._ready and self._error is None:
+                        self._condition.wait()
+                    if self._current not in self._ready:
+                        raise self._error
+                    self._buffer, self._position = self._ready.pop(self._current), 0
+                    self._current += 1
+                    self._condition.notify_all()
+            end = len(self._buffer) if size < 0 else min(len(self._buffer), self._position + size)
+            parts.append(self._buffer[self._position:end])
+            if size > 0:
+                size -= end - self._position
+            self._position = end
+        return b"".join(parts)
+    
+    def close(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._ready.clear()
+
+class DiskImageWriter:
+    """Écriture positionnée d'une image par un thread dédié; les plages nulles restent des trous"""
+    
+    def __init__(self, path, size, max_pending=4):
+        self.path = path
+        self.size = size
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._thread.start()
+    
+    def write(self, offset, data):
+        if self._error is not None:
+            raise self._error
+        if data.count(0) != len(data):
+            self._pending.put((offset, data))
+    
+    def _drain(self):
+        while True:
+            item = self._pending.get()
+            if item is None:
+                return
+            if self._error is None:
+                try:
+                    os.pwrite(self._fd, item[1], item[0])
+                except Exception as e:
+                    self._error = e
+    
+    def close(self):
+        """Attendre la fin des écritures, fixer la taille apparente et synchroniser"""
+        self._pending.put(None)
+        self._thread.join()
+        try:
+            if self._error is not None:
+                raise self._error
+            os.ftruncate(self._fd, self.size)
+            os.fsync(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+    
+    def abort(self):
+        """Abandonner l'image et supprimer le fichier partiel; sans effet sur un descripteur déjà fermé"""
+        if self._fd is not None:
+            self._error = self._error or Exception("Écriture interrompue")
+            self._pending.put(None)
+            self._thread.join()
+            os.close(self._fd)
+            self._fd = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class StreamingRestorer:
+    """Restauration en flux: serveur -> décompression -> tar -> emplacement final des disques, sans /tmp"""
+    
+    def __init__(self, pool, logger, images_dir="/var/lib/libvirt/images", window_size=512 * 1024, windows=16, streams=4):
+        self.pool = pool
+        self.logger = logger
+        self.images_dir = images_dir
+        self.window_size = window_size
+        self.windows = windows
+        self.streams = streams
+    
+    @classmethod
+    def from_config(cls, pool, logger, config):
+        return cls(
+            pool, logger,
+            images_dir=config.get("restore_images_dir", "/var/lib/libvirt/images"),
+            window_size=int(config.get("restore_window_size_mb", 0.5) * 1024 * 1024),
+            windows=config.get("restore_windows", 16),
+            streams=config.get("restore_streams", 4)
+        )
+    
+    def restore_archive(self, remote_path, archive_name, vm_name, before_replace):
+        """Écrire les disques d'une archive à leur emplacement final; retourne (xml, {membre: chemin})
+        
+        before_replace(xml) n'est appelé qu'une fois tous les disques écrits, juste avant leur mise en place.
+        """
+        xml_config = None
+        members = {}
+        writers = []
+        committed = 0
+        try:
+            with self.pool.sftp() as sftp:
+                size = sftp.stat(remote_path).st_size
+            reader = RemoteReadahead(self.pool, remote_path, size, self.window_size, self.windows, self.streams)
+            try:
+                with CompressionEngine.open_archive(reader, archive_name) as tar:
+                    for member in tar:
+                        if member.name == f"{vm_name}.xml":
+                            xml_config = tar.extractfile(member).read().decode()
+                            members = CheckpointBackup.disk_members(xml_config, vm_name)
+                        elif member.isfile() and member.name.startswith(f"{vm_name}_"):
+                            if xml_config is None:
+                                raise Exception(f"Configuration XML absente en tête de {archive_name}")
+                            if member.name not in members:
+                                continue
+                            target = os.path.join(self.images_dir, os.path.basename(member.name))
+                            writer = DiskImageWriter(f"{target}.part", member.size)
+                            writers.append((writer, target))
+                            self._copy_member(tar, member, writer)
+            finally:
+                reader.close()
+            
+            if xml_config is None:
+                raise Exception(f"Configuration XML absente de {archive_name}")
+            # Chaque disque poursuit son écriture pendant le décodage du suivant
+            for writer, target in writers:
+                writer.close()
+            # La VM existante n'est retirée qu'une fois l'archive entièrement lue et écrite
+            before_replace(xml_config)
+            for writer, target in writers:
+                os.replace(writer.path, target)
+                committed += 1
+        except BaseException:
+            for writer, target in writers[committed:]:
+                writer.abort()
+            raise
+        return xml_config, {os.path.basename(target): target for _, target in writers}
+    
+    def _copy_member(self, tar, member, writer):
+        # Lecture non tamponnée: en mode flux, le tampon de tarfile refuse tout seek
+        source = tar.extractfile(member).raw
+        # Membre creux: seules les plages de données sont lues, les trous ne sont jamais écrits
+        for offset, length in member.sparse or [(0, member.size)]:
+            source.seek(offset)
+            while length > 0:
+                data = source.read(min(length, SparseFile.COPY_SIZE))
+                if not data:
+                    raise IOError(f"Fin de flux inattendue dans {member.name}")
+                writer.write(offset, data)
+                offset += len(data)
+                length -= len(data)
+    
+    def restore_manifest(self, repository, remote_path, vm_name, before_replace):
+        """Reconstituer en parallèle les disques d'un manifeste du dépôt; retourne (xml, {disque: chemin})"""
+        manifest = repository.read_manifest(remote_path)
+        targets = {disk["name"]: os.path.join(self.images_dir, disk["name"]) for disk in manifest["disks"]}
+        
+        def restore_disk(disk):
+            target = targets[disk["name"]]
+            raw_path = f"{target}.raw.part"
+            try:
+                repository.restore_disk(disk["chunks"], raw_path)
+                subprocess.run(["qemu-img", "convert", "-f", "raw", "-O", "qcow2", raw_path, f"{target}.part"], check=True)
+            finally:
+                if os.path.exists(raw_path):
+                    os.remove(raw_path)
+        
+        from concurrent.futures import ThreadPoolExecutor
+        pending = list(targets.values())
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, len(manifest["disks"])), thread_name_prefix="kvm_restore") as executor:
+                list(executor.map(restore_disk, manifest["disks"]))
+            # Comme pour une archive: la VM existante n'est retirée qu'une fois tous les disques reconstitués
+            before_replace(manifest["xml"])
+            while pending:
+                os.replace(f"{pending[0]}.part", pending[0])
+                pending.pop(0)
+        finally:
+            for target in pending:
+                if os.path.exists(f"{target}.part"):
+                    os.remove(f"{target}.part")
+        return manifest["xml"], targets
+    
+    @staticmethod
+    def relocate_disks(xml_config, vm_name, restored):
+        """Faire pointer la configuration vers les disques restaurés, au format réellement écrit"""
+        members = {path: name for name, path in CheckpointBackup.disk_members(xml_config, vm_name).items()}
+        root = ET.fromstring(xml_config)
+        for disk in root.findall("./devices/disk"):
+            source = disk.find("source")
+            if disk.get("type") != "file" or source is None:
+                continue
+            restored_path = restored.get(members.get(source.get("file")))
+            if restored_path:
+                source.set("file", restored_path)
+                driver = disk.find("driver")
+                if driver is None:
+                    driver = ET.SubElement(disk, "driver", name="qemu")
+                # Un disque brut converti en qcow2 à la sauvegarde garde son nom mais pas son format
+                driver.set("type", CheckpointBackup.image_format(restored_path))
+        return ET.tostring(root, encoding="unicode")
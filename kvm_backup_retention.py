@@ -0,0 +1,522 @@
+"""Catalogue des sauvegardes, rétention GFS et suppression des expirées, contrôle d'intégrité (--scrub)"""
+import os
+import errno
+import json
+import shlex
+import hashlib
+import threading
+import time
+from datetime import datetime
+from kvm_backup_archive import CompressionEngine
+from kvm_backup_repository import ChunkRepository
+from kvm_backup_transfer import BandwidthLimiter, ParallelUploader, RemoteVerifier, TransferManifest
+
+class BackupCatalog:
+    """Catalogue des sauvegardes tenu sur le serveur (JSON lines en ajout seul) avec copie locale incrémentale"""
+    
+    CATALOG_NAME = "catalog.jsonl"
+    TYPE_LABELS = {"full": "Complète", "incr": "Incrémentielle", "repository": "Dépôt dédupliqué"}
+    _append_lock = threading.Lock()
+    
+    def __init__(self, pool, logger, backup_path, cache_file="~/.kvm_backup_catalog.jsonl"):
+        self.pool = pool
+        self.logger = logger
+        self.backup_path = backup_path
+        self.remote_path = f"{backup_path}/{self.CATALOG_NAME}"
+        self.cache_file = os.path.expanduser(cache_file)
+    
+    @classmethod
+    def from_config(cls, pool, logger, config):
+        return cls(pool, logger, config["backup_path"], config.get("catalog_cache", "~/.kvm_backup_catalog.jsonl"))
+    
+    @staticmethod
+    def describe(file_name):
+        """Type de sauvegarde d'un fichier distant d'après son nom, None s'il ne s'agit pas d'une sauvegarde"""
+        if file_name.endswith(ChunkRepository.MANIFEST_SUFFIX):
+            return "repository"
+        if CompressionEngine.codec_for_archive(file_name) is None:
+            return None
+        if ".full." in file_name:
+            return "full"
+        if ".incr." in file_name:
+            return "incr"
+        return None
+    
+    @staticmethod
+    def entry(vm_name, archive_name, backup_type, size, checksum=None, duration=None, parent=None):
+        date_str = archive_name[len(vm_name) + 1:].split(".")[0]
+        return {
+            "vm": vm_name, "archive": archive_name, "type": backup_type,
+            "date": datetime.strptime(date_str, "%Y%m%d-%H%M%S").strftime("%Y-%m-%d %H:%M:%S"),
+            "size": size, "checksum": checksum,
+            "duration": round(duration, 1) if duration is not None else None, "parent": parent
+        }
+    
+    def append(self, entry):
+        """Ajouter une entrée au catalogue distant (créé à partir du contenu du serveur s'il n'existe pas)"""
+        self._append_records([entry])
+    
+    def remove(self, entries):
+        """Noter la suppression de sauvegardes (le catalogue n'est jamais réécrit)"""
+        self._append_records([{"vm": entry["vm"], "removed": entry["archive"]} for entry in entries])
+    
+    def _append_records(self, records):
+        line = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records).encode()
+        with self._append_lock, self.pool.sftp() as sftp:
+            try:
+                sftp.stat(self.remote_path)
+            except IOError:
+                self._rebuild(sftp)
+            # Une seule écriture en mode ajout: les lignes de plusieurs hôtes ne se mélangent pas
+            with sftp.open(self.remote_path, "ab") as catalog_file:
+                catalog_file.write(line)
+    
+    def sync(self):
+        """Rapatrier la seule fin du catalogue ajoutée depuis la dernière synchronisation; retourne les entrées"""
+        local_data = b""
+        if os.path.exists(self.cache_file):
+            with open(self.cache_file, "rb") as f:
+                local_data = f.read()
+        header = local_data[:local_data.find(b"\n") + 1]
+        
+        try:
+            with self.pool.sftp() as sftp:
+                try:
+                    remote_file = sftp.open(self.remote_path, "rb")
+                except IOError:
+                    with self._append_lock:
+                        self._rebuild(sftp)
+                    remote_file = sftp.open(self.remote_path, "rb")
+                with remote_file:
+                    size = remote_file.stat().st_size
+                    ranges = ([(0, len(header))] if header else []) + \
+                             ([(len(local_data), size - len(local_data))] if size > len(local_data) else [])
+                    parts = list(remote_file.readv(ranges)) if ranges else []
+                    if header and (size < len(local_data) or parts[0] != header):
+                        # Catalogue recréé sur le serveur: copie locale entièrement remplacée
+                        local_data, tail = b"", b"".join(remote_file.readv([(0, size)]))
+                    else:
+                        tail = parts[-1] if size > len(local_data) else b""
+        except Exception as e:
+            self.logger.warning(f"Catalogue distant injoignable, copie locale utilisée: {str(e)}")
+            return self._parse(local_data)
+        
+        # Une ligne en cours d'écriture sur le serveur sera reprise à la synchronisation suivante
+        tail = tail[:tail.rfind(b"\n") + 1]
+        if tail or not local_data:
+            local_data += tail
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, "wb") as f:
+                f.write(local_data)
+            os.replace(tmp_file, self.cache_file)
+        return self._parse(local_data)
+    
+    def entries(self):
+        """Entrées de la copie locale, sans accès réseau"""
+        if not os.path.exists(self.cache_file):
+            return []
+        with open(self.cache_file, "rb") as f:
+            return self._parse(f.read())
+    
+    @staticmethod
+    def _parse(data):
+        entries = {}
+        for line in data.decode(errors="replace").splitlines()[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "removed" in record:
+                entries.pop(record["removed"], None)
+            elif "archive" in record:
+                entries[record["archive"]] = record
+        return sorted(entries.values(), key=lambda e: (e["vm"], e["date"]))
+    
+    def _rebuild(self, sftp):
+        """Créer le catalogue à partir des fichiers présents sur le serveur (une seule fois)"""
+        lines = [json.dumps({"catalog": 1, "generation": os.urandom(8).hex()})]
+        try:
+            vm_dirs = sftp.listdir(self.backup_path)
+        except IOError:
+            vm_dirs = []
+        for vm_dir in vm_dirs:
+            if vm_dir in ("repository", self.CATALOG_NAME):
+                continue
+            try:
+                files = sftp.listdir_attr(f"{self.backup_path}/{vm_dir}")
+            except IOError:
+                continue
+            for attr in files:
+                backup_type = self.describe(attr.filename)
+                if backup_type is not None and attr.filename.startswith(f"{vm_dir}_"):
+                    try:
+                        lines.append(json.dumps(self.entry(vm_dir, attr.filename, backup_type, attr.st_size), ensure_ascii=False))
+                    except ValueError:
+                        continue
+        
+        part_path = f"{self.remote_path}{ParallelUploader.PART_SUFFIX}"
+        with sftp.open(part_path, "wb") as catalog_file:
+            catalog_file.write(("\n".join(lines) + "\n").encode())
+        ParallelUploader.commit(sftp, part_path, self.remote_path)
+        self.logger.info(f"Catalogue {self.remote_path} créé ({len(lines) - 1} sauvegardes)")
+
+class RetentionPolicy:
+    """Règles grand-père/père/fils: dernières sauvegardes, puis une par jour, par semaine et par mois"""
+    
+    def __init__(self, keep_last=1, daily=7, weekly=4, monthly=6):
+        self.keep_last = max(1, int(keep_last))
+        self.daily = int(daily)
+        self.weekly = int(weekly)
+        self.monthly = int(monthly)
+    
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            keep_last=config.get("retention_keep_last", 1),
+            daily=config.get("retention_daily", 7),
+            weekly=config.get("retention_weekly", 4),
+            monthly=config.get("retention_monthly", 6)
+        )
+    
+    def __str__(self):
+        return f"{self.keep_last} dernière(s), {self.daily} jour(s), {self.weekly} semaine(s), {self.monthly} mois"
+    
+    def select(self, entries):
+        """Répartir les entrées d'une VM en (conservées, expirées), dépendances des incrémentielles comprises"""
+        ordered = sorted(entries, key=lambda e: e["date"], reverse=True)
+        keep = {entry["archive"] for entry in ordered[:self.keep_last]}
+        
+        # La plus récente sauvegarde de chaque période est conservée, pour les N dernières périodes
+        for count, period in ((self.daily, lambda d: d.date()),
+                              (self.weekly, lambda d: d.isocalendar()[:2]),
+                              (self.monthly, lambda d: (d.year, d.month))):
+            seen = set()
+            for entry in ordered:
+                if len(seen) >= count:
+                    break
+                key = period(datetime.strptime(entry["date"], "%Y-%m-%d %H:%M:%S"))
+                if key not in seen:
+                    seen.add(key)
+                    keep.add(entry["archive"])
+        
+        # Une incrémentielle conservée retient toute sa chaîne jusqu'à la complète
+        by_archive = {entry["archive"]: entry for entry in ordered}
+        for archive in list(keep):
+            keep.update(self._dependencies(by_archive[archive], by_archive, ordered))
+        
+        kept = [entry for entry in ordered if entry["archive"] in keep]
+        expired = [entry for entry in ordered if entry["archive"] not in keep]
+        return kept, expired
+    
+    @staticmethod
+    def _dependencies(entry, by_archive, ordered):
+        dependencies = []
+        while entry["type"] == "incr":
+            parent = by_archive.get(entry.get("parent"))
+            if parent is None:
+                # Parente inconnue (catalogue reconstruit): tout conserver jusqu'à la complète précédente
+                for older in ordered:
+                    if older["date"] < entry["date"]:
+                        dependencies.append(older["archive"])
+                        if older["type"] != "incr":
+                            break
+                break
+            dependencies.append(parent["archive"])
+            entry = parent
+        return dependencies
+
+class BackupPruner:
+    """Suppression des sauvegardes expirées sur le serveur: `rm -f` par lots, sinon SFTP sur quelques canaux"""
+    
+    REMOVE_BATCH = 256
+    REMOVE_THREADS = 4
+    
+    def __init__(self, pool, logger, config, policy=None):
+        self.pool = pool
+        self.logger = logger
+        self.config = config
+        self.policy = policy or RetentionPolicy.from_config(config)
+        self.catalog = BackupCatalog.from_config(pool, logger, config)
+        # Délai de grâce des blocs du dépôt et durée au-delà de laquelle un bail non renouvelé est abandonné
+        self.chunk_grace = config.get("chunk_gc_grace_hours", 24) * 3600
+        self.exec_available = True  # Faux dès que le serveur refuse l'exécution de commandes (compte SFTP seul)
+    
+    def prune(self, dry_run=False):
+        """Appliquer la rétention; retourne le rapport {vms, files, bytes, chunks, chunk_bytes}"""
+        backup_path = self.config["backup_path"]
+        entries = {}
+        for entry in self.catalog.sync():
+            entries.setdefault(entry["vm"], []).append(entry)
+        
+        report = {"vms": {}, "files": [], "bytes": 0, "chunks": [], "chunk_bytes": 0}
+        expired_entries = []
+        with self.pool.sftp() as sftp:
+            for vm_name, vm_entries in sorted(entries.items()):
+                kept, expired = self.policy.select(vm_entries)
+                report["vms"][vm_name] = (kept, expired)
+                if not expired:
+                    continue
+                # Tailles réelles (archive et fichier .sha256) relevées dans le répertoire de la VM
+                try:
+                    sizes = {attr.filename: attr.st_size for attr in sftp.listdir_attr(f"{backup_path}/{vm_name}")}
+                except IOError as e:
+                    # Répertoire supprimé ou renommé à la main: les autres VMs sont tout de même traitées
+                    self.logger.warning(f"Répertoire {backup_path}/{vm_name} illisible, rétention ignorée pour {vm_name}: {str(e)}")
+                    report["vms"][vm_name] = (kept + expired, [])
+                    continue
+                for entry in expired:
+                    expired_entries.append(entry)
+                    for file_name in (entry["archive"], f"{entry['archive']}.sha256",
+                                      f"{entry['archive']}{ParallelUploader.RANGES_SUFFIX}"):
+                        if file_name in sizes:
+                            report["files"].append(f"{backup_path}/{vm_name}/{file_name}")
+                            report["bytes"] += sizes[file_name]
+            
+            expired_manifests = {f"{backup_path}/{e['vm']}/{e['archive']}" for e in expired_entries if e["type"] == "repository"}
+            repository = None
+            if expired_manifests:
+                repository = ChunkRepository.from_config(self.pool, self.logger, self.config)
+                leases = repository.active_leases(sftp, self.chunk_grace)
+                if leases:
+                    # Une sauvegarde en cours peut réutiliser un bloc qu'aucun manifeste publié ne référence encore
+                    self.logger.warning(f"Nettoyage des blocs du dépôt reporté, sauvegarde(s) en cours: {', '.join(leases)}")
+                else:
+                    # Manifestes restants relevés sur le serveur: un manifeste absent du catalogue protège aussi ses blocs
+                    remaining = [path for path in self._list_manifests(sftp, backup_path) if path not in expired_manifests]
+                    report["chunks"] = repository.unreferenced_chunks(remaining, self.chunk_grace)
+                    report["chunk_bytes"] = sum(size for _, size in report["chunks"])
+            
+            if dry_run:
+                return report
+            
+            if report["chunks"]:
+                # Les index locaux de tous les hôtes doivent oublier les blocs supprimés
+                repository.bump_generation(sftp)
+        
+        failures = self.remove_files(report["files"] + [path for path, _ in report["chunks"]])
+        for path, error in failures:
+            self.logger.warning(f"Suppression de {path} impossible: {error}")
+        failed = {path for path, _ in failures}
+        removed = [e for e in expired_entries if f"{backup_path}/{e['vm']}/{e['archive']}" not in failed]
+        if removed:
+            self.catalog.remove(removed)
+        return report
+    
+    @staticmethod
+    def _list_manifests(sftp, backup_path):
+        manifests = []
+        for vm_dir in sftp.listdir(backup_path):
+            if vm_dir in ("repository", BackupCatalog.CATALOG_NAME):
+                continue
+            try:
+                files = sftp.listdir(f"{backup_path}/{vm_dir}")
+            except IOError:
+                continue
+            manifests.extend(f"{backup_path}/{vm_dir}/{name}" for name in files if name.endswith(ChunkRepository.MANIFEST_SUFFIX))
+        return manifests
+    
+    def remove_files(self, paths):
+        """Supprimer des fichiers distants; retourne [(chemin, erreur)] (un fichier déjà absent n'est pas une erreur)"""
+        failures = []
+        for start in range(0, len(paths), self.REMOVE_BATCH):
+            batch = paths[start:start + self.REMOVE_BATCH]
+            if self.exec_available and self._remove_batch(batch):
+                continue
+            # Sans commande distante ou après un échec partiel: fichier par fichier, pour savoir lesquels restent
+            failures.extend(self._remove_sftp(batch))
+        return failures
+    
+    def _remove_batch(self, paths):
+        """Un seul aller-retour pour tout le lot: `rm -f` sur le serveur; False si le lot est à reprendre par SFTP"""
+        try:
+            status, _, stderr = self.pool.run("rm -f -- " + " ".join(shlex.quote(path) for path in paths), 600)
+        except Exception as e:
+            self.exec_available = False
+            self.logger.warning(f"Suppression par commande distante impossible, repli sur SFTP: {str(e)}")
+            return False
+        if status == 127:
+            self.exec_available = False
+        return status == 0
+    
+    def _remove_sftp(self, paths):
+        from concurrent.futures import ThreadPoolExecutor
+        
+        def remove(share):
+            failures = []
+            with self.pool.sftp() as sftp:
+                for path in share:
+                    try:
+                        sftp.remove(path)
+                    except IOError as e:
+                        if getattr(e, "errno", None) != errno.ENOENT:
+                            failures.append((path, str(e)))
+            return failures
+        
+        # Quelques canaux du pool en parallèle, chacun avec sa part des fichiers
+        shares = [paths[index::self.REMOVE_THREADS] for index in range(min(self.REMOVE_THREADS, len(paths)))]
+        with ThreadPoolExecutor(max(1, len(shares))) as executor:
+            return [failure for failures in executor.map(remove, shares) for failure in failures]
+
+class BackupScrubber:
+    """Relecture des archives du serveur contre leur fichier .sha256, par tranches bornées; les moins récemment vérifiées d'abord"""
+    
+    def __init__(self, pool, logger, config, history, io_rate_mb=None, max_bytes=None, max_seconds=None, limiter=None):
+        self.pool = pool
+        self.logger = logger
+        self.config = config
+        self.history = history
+        self.io_rate = io_rate_mb * 1024 * 1024 if io_rate_mb else None  # Lecture moyenne sur le serveur
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.limiter = limiter  # Archives rapatriées quand le serveur refuse les commandes
+        self._start = time.monotonic()
+        # Priorité d'E/S minimale sur le serveur: les sauvegardes en cours passent avant
+        self.verifier = RemoteVerifier(pool, logger, config.get("verify_remote_timeout", 3600), idle=True)
+    
+    @classmethod
+    def from_config(cls, pool, logger, config, history):
+        max_gb = config.get("scrub_max_gb")
+        max_minutes = config.get("scrub_max_minutes", 60)
+        return cls(
+            pool, logger, config, history,
+            io_rate_mb=config.get("scrub_io_rate_mb", 50),
+            max_bytes=int(max_gb * 1024 ** 3) if max_gb else None,
+            max_seconds=max_minutes * 60 if max_minutes else None,
+            limiter=BandwidthLimiter(logger, config.get("scrub_bandwidth_mbps"))
+        )
+    
+    def inventory(self):
+        """Archives accompagnées d'un .sha256 sur le serveur: [(chemin, vm, taille, mtime)]"""
+        backup_path = self.config["backup_path"]
+        archives = []
+        with self.pool.sftp() as sftp:
+            for vm_dir in sftp.listdir(backup_path):
+                if vm_dir in ("repository", BackupCatalog.CATALOG_NAME):
+                    continue
+                try:
+                    files = {attr.filename: attr for attr in sftp.listdir_attr(f"{backup_path}/{vm_dir}")}
+                except IOError:
+                    continue
+                for name, attr in files.items():
+                    if f"{name}.sha256" in files:
+                        archives.append((f"{backup_path}/{vm_dir}/{name}", vm_dir, attr.st_size, attr.st_mtime))
+        return archives
+    
+    def scrub(self):
+        """Vérifier une tranche d'archives dans le budget; retourne le rapport {checked, bytes, failed, incomplete, remaining, seconds}
+        
+        Le budget est tenu à l'intérieur d'une archive: elle est relue plage par plage (liste .ranges de l'envoi) et la
+        position atteinte est enregistrée, la tranche suivante reprend à cet offset.
+        """
+        self.history.scrub_sync(self.inventory())
+        pending = self.history.scrub_queue()
+        report = {"checked": 0, "bytes": 0, "failed": [], "incomplete": [], "remaining": len(pending), "seconds": 0.0}
+        self._start = time.monotonic()
+        
+        for path, size, resume in pending:
+            if self._exhausted(report):
+                break
+            if resume:
+                self.logger.info(f"Reprise du contrôle de {os.path.basename(path)} à {resume / (1024 * 1024):.0f} Mo")
+            
+            archive_start = time.monotonic()
+            status, error, offset = self.check(path, size, resume, report)
+            seconds = time.monotonic() - archive_start
+            if status == "partial":
+                # Budget épuisé au milieu de l'archive: la prochaine tranche reprend à cet offset
+                self.history.record_scrub_progress(path, offset)
+                break
+            # Résultat enregistré aussitôt: une tranche interrompue reprend là où elle s'est arrêtée
+            self.history.record_scrub(path, status, seconds, error)
+            report["remaining"] -= 1
+            if status == "incomplete":
+                report["incomplete"].append((path, error))
+                break
+            report["checked"] += 1
+            if status != "ok":
+                report["failed"].append((path, status, error))
+        
+        report["seconds"] = time.monotonic() - self._start
+        return report
+    
+    def check(self, path, size, resume=0, report=None):
+        """Contrôler une archive à partir de `resume`; retourne (statut ok|corrupt|error|partial|incomplete, erreur, offset atteint)"""
+        report = report if report is not None else {"bytes": 0}
+        try:
+            with self.pool.sftp() as sftp:
+                with sftp.open(f"{path}.sha256", "r") as checksum_file:
+                    expected = checksum_file.read().decode().split()[0]
+                try:
+                    with sftp.open(f"{path}{ParallelUploader.RANGES_SUFFIX}", "r") as ranges_file:
+                        ranges = TransferManifest.loads(ranges_file.read().decode())
+                except IOError:
+                    ranges = None  # Archive envoyée en flux ou par une version antérieure
+            if ranges is not None and ranges.size == size and not ranges.pending_ranges():
+                return self._check_ranges(path, ranges, resume, report)
+            return self._check_file(path, size, expected, report)
+        except Exception as e:
+            self._throttle(report)
+            return "error", str(e), 0
+    
+    def _check_ranges(self, path, ranges, resume, report):
+        """Relire les plages une à une contre leur SHA256; pause après chacune pour tenir le débit moyen"""
+        for offset, length in ranges.ranges():
+            if offset < resume:
+                continue
+            if self._exhausted(report):
+                return "partial", None, offset
+            digest = self.verifier.range_digest(path, offset, length)
+            if digest is None:
+                digest = self._download_digest(path, offset, length)
+            report["bytes"] += length
+            if digest != ranges.chunks[offset]:
+                return "corrupt", f"plage {offset}+{length} différente de la liste des SHA256 de l'envoi", offset
+            self._throttle(report)
+        return "ok", None, ranges.size
+    
+    def _check_file(self, path, size, expected, report):
+        """Sans liste par plage: relecture complète, ralentie sur le serveur et interrompue à la fin du budget"""
+        if self.max_bytes and report["bytes"] and report["bytes"] + size > self.max_bytes:
+            return "partial", None, 0  # Ne tiendrait pas dans le volume restant: prochaine tranche
+        remaining = self.max_seconds - (time.monotonic() - self._start) if self.max_seconds else None
+        digest = self.verifier.file_digest(path, size, self.io_rate, remaining)
+        if digest is None:
+            digest = self._download_digest(path, 0, size, remaining)
+        if digest == "":
+            # Pas de reprise possible sans liste par plage: l'archive passe en fin de file pour ne pas bloquer les suivantes
+            needed = f", environ {size / self.io_rate / 60:.1f} min nécessaires" if self.io_rate else ""
+            return "incomplete", f"budget épuisé avant la fin de l'archive (pas de fichier .ranges{needed})", 0
+        report["bytes"] += size
+        if digest != expected:
+            return "corrupt", f"SHA256 différent de {os.path.basename(path)}.sha256", 0
+        return "ok", None, size
+    
+    def _exhausted(self, report):
+        elapsed = time.monotonic() - self._start
+        return bool((self.max_seconds and elapsed >= self.max_seconds) or
+                    (self.max_bytes and report["bytes"] >= self.max_bytes))
+    
+    def _throttle(self, report):
+        """Budget d'E/S du serveur: pause pour ramener la lecture de la tranche au débit moyen configuré"""
+        if not self.io_rate:
+            return
+        elapsed = time.monotonic() - self._start
+        pause = report["bytes"] / self.io_rate - elapsed
+        if self.max_seconds:
+            pause = min(pause, self.max_seconds - elapsed)
+        if pause > 0:
+            time.sleep(pause)
+    
+    def _download_digest(self, path, offset, length, seconds=None, window=1024 * 1024):
+        """SHA256 calculé localement, la plage étant lue par fenêtres dans la limite de bande passante; "" si interrompu"""
+        sha256_hash = hashlib.sha256()
+        deadline = time.monotonic() + seconds if seconds else None
+        with self.pool.sftp() as sftp, sftp.open(path, "rb") as remote_file:
+            for start in range(offset, offset + length, window):
+                if deadline and time.monotonic() >= deadline:
+                    return ""
+                size = min(window, offset + length - start)
+                self.limiter.consume(size)
+                for data in remote_file.readv([(start, size)]):
+                    sha256_hash.update(data)
+        return sha256_hash.hexdigest()
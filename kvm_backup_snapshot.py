@@ -0,0 +1,310 @@
+"""Points de contrôle libvirt (sauvegardes incrémentielles) et instantanés à chaud des VMs actives"""
+import subprocess
+import os
+import json
+import xml.etree.ElementTree as ET
+import threading
+import time
+
+class CheckpointBackup:
+    """Sauvegardes incrémentielles par points de contrôle libvirt (bitmaps de blocs modifiés QEMU)"""
+    
+    STATE_FILE = "~/.kvm_backup_checkpoints.json"
+    CHECKPOINT_PREFIX = "kvm_backup-"
+    
+    def __init__(self, logger, state_file=STATE_FILE, poll_interval=2):
+        self.logger = logger
+        self.state_file = os.path.expanduser(state_file)
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+    
+    def supported(self, domain):
+        """L'API de sauvegarde libvirt n'est utilisable que sur une VM en cours d'exécution"""
+        return hasattr(domain, "backupBegin") and domain.isActive()
+    
+    def chain_for(self, vm_name):
+        """Dernier point de contrôle et archives de la chaîne courante d'une VM"""
+        with self._lock:
+            return self._load_state().get(vm_name)
+    
+    def resolve(self, domain, vm_name, backup_type):
+        """Retourner (type effectif, point de contrôle parent) pour la sauvegarde demandée"""
+        if backup_type != "incr":
+            return "full", None
+        previous = self.chain_for(vm_name)
+        if previous and self._find_checkpoint(domain, previous["checkpoint"]) is not None:
+            return "incr", previous["checkpoint"]
+        self.logger.warning(f"Aucun point de contrôle exploitable pour {vm_name}: sauvegarde complète")
+        return "full", None
+    
+    def export(self, domain, vm_name, timestamp, parent_checkpoint, temp_dir, target_format="qcow2", create_checkpoint=True):
+        """Exporter les disques (mode push) et créer le nouveau point de contrôle; retourne (point de contrôle, membres)"""
+        checkpoint = f"{self.CHECKPOINT_PREFIX}{timestamp}" if create_checkpoint else None
+        targets = []
+        for target, disk_path in self.disk_targets(domain.XMLDesc(0)):
+            staged_file = os.path.join(temp_dir, f"{vm_name}_{os.path.basename(disk_path)}") if disk_path else None
+            targets.append((target, staged_file))
+        
+        checkpoint_xml = self._checkpoint_xml(checkpoint, targets) if checkpoint else None
+        domain.backupBegin(self._backup_xml(targets, parent_checkpoint, target_format), checkpoint_xml, 0)
+        try:
+            self._wait(domain, vm_name)
+        except BaseException:
+            try:
+                domain.abortJob()
+            except Exception:
+                pass
+            if checkpoint:
+                self.discard(domain, checkpoint)
+            raise
+        
+        members = [(os.path.basename(staged_file), staged_file) for _, staged_file in targets if staged_file]
+        written = sum(os.stat(staged_file).st_blocks * 512 for _, staged_file in members)
+        label = f"depuis {parent_checkpoint}" if parent_checkpoint else "complet"
+        self.logger.info(f"Export {label} de {vm_name}: {written / (1024 * 1024):.1f} Mo écrits")
+        return checkpoint, members
+    
+    def chain_info(self, vm_name, archive_name, backup_type, checkpoint):
+        """Métadonnées de chaîne enregistrées dans l'archive ({vm}.chain.json)"""
+        previous = self.chain_for(vm_name)
+        chain = previous["chain"] if backup_type == "incr" and previous else []
+        return {"vm": vm_name, "type": backup_type, "checkpoint": checkpoint, "chain": chain + [archive_name]}
+    
+    def write_chain_file(self, chain_info, temp_dir):
+        chain_file = os.path.join(temp_dir, f"{chain_info['vm']}.chain.json")
+        with open(chain_file, "w") as f:
+            json.dump(chain_info, f, indent=2)
+        return chain_file
+    
+    def commit(self, domain, chain_info):
+        """Enregistrer la chaîne une fois l'archive en lieu sûr et supprimer l'ancien point de contrôle"""
+        vm_name = chain_info["vm"]
+        with self._lock:
+            state = self._load_state()
+            previous = state.get(vm_name)
+            state[vm_name] = {"checkpoint": chain_info["checkpoint"], "chain": chain_info["chain"]}
+            self._save_state(state)
+        # Seul le dernier point de contrôle est nécessaire à la prochaine incrémentielle
+        if previous and previous["checkpoint"] != chain_info["checkpoint"]:
+            self.discard(domain, previous["checkpoint"])
+    
+    def discard(self, domain, checkpoint):
+        snapshot = self._find_checkpoint(domain, checkpoint)
+        if snapshot is None:
+            return
+        try:
+            snapshot.delete(0)
+        except Exception as e:
+            self.logger.warning(f"Impossible de supprimer le point de contrôle {checkpoint}: {str(e)}")
+    
+    @staticmethod
+    def flatten(layers, output_path):
+        """Reconstituer une image complète à partir d'une chaîne [complète, incr1, ..., incrN]"""
+        for parent, child in zip(layers, layers[1:]):
+            # Les clusters non exportés d'une incrémentielle sont lus dans l'image précédente
+            subprocess.run(["qemu-img", "rebase", "-u", "-F", "qcow2", "-b", parent, child], check=True)
+        subprocess.run(["qemu-img", "convert", "-O", "qcow2", layers[-1], output_path], check=True)
+    
+    @staticmethod
+    def disk_targets(xml_config):
+        """Retourner [(cible, chemin)] pour tous les disques; chemin None pour ceux qui ne sont pas sauvegardés"""
+        targets = []
+        for disk in ET.fromstring(xml_config).findall("./devices/disk"):
+            target = disk.find("target")
+            if target is None or not target.get("dev"):
+                continue
+            source = disk.find("source")
+            disk_path = None
+            if disk.get("type") == "file" and disk.get("device", "disk") == "disk" and source is not None:
+                disk_path = source.get("file")
+            targets.append((target.get("dev"), disk_path))
+        return targets
+    
+    @staticmethod
+    def disk_members(xml_config, vm_name):
+        """Retourner {membre de l'archive: chemin d'origine} pour les disques sauvegardés d'une configuration"""
+        return {f"{vm_name}_{os.path.basename(disk_path)}": disk_path
+                for _, disk_path in CheckpointBackup.disk_targets(xml_config) if disk_path}
+    
+    @staticmethod
+    def image_format(path):
+        """Format réel d'une image restaurée: le nom du disque d'origine ne dit rien de son contenu"""
+        with open(path, "rb") as f:
+            return "qcow2" if f.read(4) == b"QFI\xfb" else "raw"
+    
+    @staticmethod
+    def _backup_xml(targets, parent_checkpoint, target_format="qcow2"):
+        backup = ET.Element("domainbackup", mode="push")
+        if parent_checkpoint:
+            ET.SubElement(backup, "incremental").text = parent_checkpoint
+        disks = ET.SubElement(backup, "disks")
+        for target, staged_file in targets:
+            if staged_file is None:
+                ET.SubElement(disks, "disk", name=target, backup="no")
+                continue
+            disk = ET.SubElement(disks, "disk", name=target, backup="yes", type="file")
+            ET.SubElement(disk, "target", file=staged_file)
+            ET.SubElement(disk, "driver", type=target_format)
+        return ET.tostring(backup, encoding="unicode")
+    
+    @staticmethod
+    def _checkpoint_xml(checkpoint, targets):
+        root = ET.Element("domaincheckpoint")
+        ET.SubElement(root, "name").text = checkpoint
+        ET.SubElement(root, "description").text = "KVM Backup Tool"
+        disks = ET.SubElement(root, "disks")
+        for target, staged_file in targets:
+            ET.SubElement(disks, "disk", name=target, checkpoint="bitmap" if staged_file else "no")
+        return ET.tostring(root, encoding="unicode")
+    
+    def _wait(self, domain, vm_name):
+        import libvirt
+        while domain.jobInfo()[0] != libvirt.VIR_DOMAIN_JOB_NONE:
+            time.sleep(self.poll_interval)
+        stats = domain.jobStats(libvirt.VIR_DOMAIN_JOB_STATS_COMPLETED)
+        if stats.get("type") != libvirt.VIR_DOMAIN_JOB_COMPLETED:
+            raise Exception(f"Export des disques de {vm_name} échoué: {stats.get('errmsg', 'tâche interrompue')}")
+    
+    @staticmethod
+    def _find_checkpoint(domain, checkpoint):
+        import libvirt
+        try:
+            return domain.checkpointLookupByName(checkpoint, 0)
+        except libvirt.libvirtError:
+            return None
+    
+    def _load_state(self):
+        try:
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+    
+    def _save_state(self, state):
+        temp_path = f"{self.state_file}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_path, self.state_file)
+
+class LiveSnapshot:
+    """Sauvegarde à chaud sans point de contrôle: gel bref de l'invité, instantané externe, puis blockcommit actif"""
+    
+    SNAPSHOT_PREFIX = "kvm_backup-"
+    
+    def __init__(self, logger, enabled=True, require_agent=False, commit_timeout=3600, poll_interval=0.2):
+        self.logger = logger
+        self.enabled = enabled
+        self.require_agent = require_agent
+        self.commit_timeout = commit_timeout
+        self.poll_interval = poll_interval
+    
+    @classmethod
+    def from_config(cls, logger, config):
+        return cls(
+            logger,
+            enabled=config.get("live_backup", True),
+            require_agent=config.get("live_backup_require_agent", False),
+            commit_timeout=config.get("live_commit_timeout", 3600)
+        )
+    
+    def applicable(self, domain):
+        return self.enabled and domain.isActive()
+    
+    def create(self, domain, vm_name, disks, timestamp):
+        """Geler l'invité, basculer ses disques sur des images temporaires et le dégeler; les disques d'origine sont alors figés"""
+        import libvirt
+        name = f"{self.SNAPSHOT_PREFIX}{timestamp}"
+        overlays = []
+        root = ET.Element("domainsnapshot")
+        ET.SubElement(root, "name").text = name
+        ET.SubElement(root, "description").text = "KVM Backup Tool"
+        disks_element = ET.SubElement(root, "disks")
+        for target, disk_path in CheckpointBackup.disk_targets(domain.XMLDesc(0)):
+            if disk_path not in disks:
+                ET.SubElement(disks_element, "disk", name=target, snapshot="no")
+                continue
+            overlay = f"{disk_path}.{name}"
+            disk = ET.SubElement(disks_element, "disk", name=target, snapshot="external", type="file")
+            ET.SubElement(disk, "driver", type="qcow2")
+            ET.SubElement(disk, "source", file=overlay)
+            overlays.append((target, disk_path, overlay))
+        
+        # Sans métadonnées: libvirt ne garde aucune trace de l'instantané une fois fusionné
+        flags = (libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_DISK_ONLY | libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_ATOMIC |
+                 libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_NO_METADATA)
+        frozen = self._freeze(domain, vm_name)
+        start = time.monotonic()
+        try:
+            domain.snapshotCreateXML(ET.tostring(root, encoding="unicode"), flags)
+        finally:
+            if frozen:
+                domain.fsThaw()
+            stall = time.monotonic() - start
+        
+        if frozen:
+            self.logger.info(f"Instantané externe de {vm_name}: invité gelé {stall * 1000:.0f} ms")
+        else:
+            self.logger.info(f"Instantané externe de {vm_name} sans gel ({stall * 1000:.0f} ms): cohérence de type coupure de courant")
+        return {"vm": vm_name, "overlays": overlays, "freeze": stall if frozen else None, "snapshot": stall,
+                "committed": False}
+    
+    def commit(self, domain, snapshot):
+        """Fusionner les écritures de l'instantané dans les disques d'origine (blockcommit actif + pivot)"""
+        import libvirt
+        if snapshot["committed"]:
+            return None
+        snapshot["committed"] = True
+        vm_name = snapshot["vm"]
+        start = time.monotonic()
+        deadline = start + self.commit_timeout
+        pivot = 0.0
+        try:
+            # Toutes les fusions avancent en parallèle; le pivot ne bascule que la dernière écriture
+            for target, _, _ in snapshot["overlays"]:
+                domain.blockCommit(target, None, None, 0, libvirt.VIR_DOMAIN_BLOCK_COMMIT_ACTIVE)
+            for target, _, overlay in snapshot["overlays"]:
+                self._wait_ready(domain, target, deadline)
+                pivot = max(pivot, self._pivot(domain, target, deadline))
+                os.remove(overlay)
+        except Exception as e:
+            pending = ", ".join(target for target, _, overlay in snapshot["overlays"] if os.path.exists(overlay))
+            raise Exception(f"Fusion de l'instantané de {vm_name} échouée ({str(e)}); disques encore sur l'instantané: {pending} "
+                            f"(virsh blockcommit {vm_name} <disque> --active --pivot)")
+        elapsed = time.monotonic() - start
+        self.logger.info(f"Instantané de {vm_name} fusionné en {elapsed:.1f}s (pivot {pivot * 1000:.0f} ms)")
+        return {"commit": elapsed, "pivot": pivot}
+    
+    def _freeze(self, domain, vm_name):
+        import libvirt
+        try:
+            domain.fsFreeze()
+            return True
+        except libvirt.libvirtError as e:
+            if self.require_agent:
+                raise Exception(f"Gel des systèmes de fichiers de {vm_name} impossible (qemu-guest-agent): {str(e)}")
+            self.logger.warning(f"Gel des systèmes de fichiers de {vm_name} impossible (qemu-guest-agent): {str(e)}")
+            return False
+    
+    def _wait_ready(self, domain, target, deadline):
+        while True:
+            info = domain.blockJobInfo(target, 0)
+            if not info:
+                raise Exception(f"tâche de fusion de {target} interrompue")
+            if info.get("ready") or (info.get("end") and info.get("cur") == info.get("end")):
+                return
+            if time.monotonic() > deadline:
+                raise Exception(f"fusion de {target} trop longue ({info.get('cur')}/{info.get('end')} octets)")
+            time.sleep(self.poll_interval)
+    
+    def _pivot(self, domain, target, deadline):
+        # Le miroir peut repasser brièvement en retard: réessayer jusqu'à ce qu'il soit prêt
+        import libvirt
+        while True:
+            start = time.monotonic()
+            try:
+                domain.blockJobAbort(target, libvirt.VIR_DOMAIN_BLOCK_JOB_ABORT_PIVOT)
+                return time.monotonic() - start
+            except libvirt.libvirtError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(self.poll_interval)
@@ -0,0 +1,920 @@
+"""Transferts vers le serveur de backup: pool SSH/SFTP, bande passante, envoi par plages avec reprise, contrôle distant"""
+import os
+import json
+import shlex
+import hashlib
+import threading
+import queue
+import time
+from datetime import datetime
+from contextlib import contextmanager
+from kvm_backup_archive import BoundedBufferWriter
+
+class SSHSessionPool:
+    """Connexions SSH authentifiées et canaux SFTP réutilisés pour toute la durée d'une tâche"""
+    
+    MAX_CHANNELS_PER_CONNECTION = 8
+    
+    def __init__(self, connect, logger, max_connections=2, health_check_interval=30, keepalive=30):
+        self._connect = connect  # Fabrique de SSHClient authentifié (avec backoff)
+        self.logger = logger
+        self.max_connections = max(1, int(max_connections))
+        self.health_check_interval = health_check_interval
+        self.keepalive = keepalive
+        self._condition = threading.Condition()
+        self._clients = []  # Connexions ouvertes
+        self._channels = {}  # id(client) -> nombre de canaux empruntés ou inactifs
+        self._idle = []  # (sftp, client, dernière utilisation)
+        self._connecting = 0
+    
+    @contextmanager
+    def sftp(self):
+        """Emprunter un canal SFTP exclusif, rendu au pool à la sortie du bloc"""
+        sftp, client = self._acquire()
+        healthy = False
+        try:
+            yield sftp
+            healthy = True
+        finally:
+            self._release(sftp, client, healthy)
+    
+    def run(self, command, timeout=None):
+        """Exécuter une commande sur le serveur par une connexion du pool; retourne (code de sortie, stdout, stderr)"""
+        sftp, client = self._acquire()
+        healthy = False
+        try:
+            channel = client.get_transport().open_session(timeout=timeout)
+            try:
+                channel.settimeout(timeout)
+                channel.exec_command(command)
+                stdout = channel.makefile("rb").read()
+                stderr = channel.makefile_stderr("rb").read()
+                status = channel.recv_exit_status()
+            finally:
+                channel.close()
+            healthy = True
+            return status, stdout.decode(errors="replace"), stderr.decode(errors="replace")
+        finally:
+            self._release(sftp, client, healthy)
+    
+    def close(self):
+        """Fermer tous les canaux et connexions du pool"""
+        with self._condition:
+            idle, clients = self._idle, self._clients
+            self._idle, self._clients, self._channels = [], [], {}
+        for sftp, _, _ in idle:
+            self._close_quietly(sftp)
+        for client in clients:
+            self._close_quietly(client)
+    
+    def _acquire(self):
+        while True:
+            with self._condition:
+                # 1. Canal inactif, sinon créneau réservé sur une connexion ouverte
+                idle = self._idle.pop() if self._idle else None
+                client = self._reserve_channel() if idle is None else None
+                if idle is None and client is None:
+                    # 2. Attendre qu'un canal se libère si le nombre de connexions est atteint
+                    if len(self._clients) + self._connecting >= self.max_connections:
+                        self._condition.wait()
+                        continue
+                    self._connecting += 1
+            
+            # Vérification et ouverture de canal hors verrou: un aller-retour réseau lent ne bloque pas le pool
+            if idle is not None:
+                sftp, client, last_used = idle
+                if self._is_alive(sftp, client, last_used):
+                    return sftp, client
+                with self._condition:
+                    self._discard_channel(sftp, client)
+                    self._condition.notify_all()
+                continue
+            if client is not None:
+                try:
+                    return client.open_sftp(), client
+                except Exception as e:
+                    with self._condition:
+                        # Rendre le créneau réservé; la connexion n'est écartée que si aucun autre canal ne s'en sert
+                        if id(client) in self._channels:
+                            self._channels[id(client)] -= 1
+                        transport = client.get_transport()
+                        if self._channels.get(id(client), 0) == 0 or transport is None or not transport.is_active():
+                            self.logger.warning(f"Ouverture d'un canal SFTP impossible, reconnexion: {str(e)}")
+                            self._discard_client(client)
+                        else:
+                            # Serveur à sa limite de canaux: attendre qu'un canal de cette connexion soit rendu
+                            self.logger.warning(f"Ouverture d'un canal SFTP impossible, nouvel essai après libération: {str(e)}")
+                            self._condition.wait(timeout=5)
+                        self._condition.notify_all()
+                    continue
+            
+            # Connexion hors verrou (authentification et backoff existants)
+            try:
+                client = self._connect()
+                transport = client.get_transport()
+                if transport is not None and self.keepalive:
+                    transport.set_keepalive(self.keepalive)
+            finally:
+                with self._condition:
+                    self._connecting -= 1
+                    self._condition.notify_all()
+            with self._condition:
+                self._clients.append(client)
+                self._channels[id(client)] = 0
+    
+    def _reserve_channel(self):
+        """Réserver (sous le verrou) un canal sur la connexion la moins chargée; None s'il faut une connexion"""
+        # Une connexion supplémentaire est préférée tant que la limite le permet
+        # (plusieurs flux TCP sur les liens lointains)
+        can_connect = len(self._clients) + self._connecting < self.max_connections
+        for client in sorted(self._clients, key=lambda c: self._channels[id(c)]):
+            if self._channels[id(client)] >= self.MAX_CHANNELS_PER_CONNECTION:
+                continue
+            if self._channels[id(client)] > 0 and can_connect:
+                return None
+            if not client.get_transport() or not client.get_transport().is_active():
+                self._discard_client(client)
+                continue
+            self._channels[id(client)] += 1
+            return client
+        return None
+    
+    def _release(self, sftp, client, healthy):
+        with self._condition:
+            transport = client.get_transport()
+            if healthy and client in self._clients and transport is not None and transport.is_active():
+                self._idle.append((sftp, client, time.monotonic()))
+            else:
+                self._discard_channel(sftp, client)
+            self._condition.notify_all()
+    
+    def _is_alive(self, sftp, client, last_used):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        # Canal inactif depuis longtemps: vérifier par un aller-retour SFTP
+        try:
+            sftp.normalize(".")
+            return True
+        except Exception:
+            return False
+    
+    def _discard_channel(self, sftp, client):
+        self._close_quietly(sftp)
+        if id(client) in self._channels:
+            self._channels[id(client)] -= 1
+            transport = client.get_transport()
+            if transport is None or not transport.is_active():
+                self._discard_client(client)
+    
+    def _discard_client(self, client):
+        if client in self._clients:
+            self._clients.remove(client)
+            self._channels.pop(id(client), None)
+            self._idle = [entry for entry in self._idle if entry[1] is not client]
+            self.logger.info("Connexion SSH inactive fermée, elle sera rétablie à la demande")
+        self._close_quietly(client)
+    
+    @staticmethod
+    def _close_quietly(resource):
+        try:
+            resource.close()
+        except Exception:
+            pass
+
+class SSHTransportOptions:
+    """Réglages du transport SSH pour les gros transferts (fenêtre, taille de paquet, chiffrement AEAD)"""
+    
+    DEFAULT_CIPHERS = ("aes128-gcm@openssh.com", "aes256-gcm@openssh.com", "aes128-ctr")
+    
+    def __init__(self, window_size=16 * 1024 * 1024, max_packet_size=32768, ciphers=DEFAULT_CIPHERS, compress=False):
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.ciphers = tuple(ciphers or ())
+        self.compress = compress
+    
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            window_size=int(config.get("ssh_window_size_mb", 16) * 1024 * 1024),
+            max_packet_size=config.get("ssh_max_packet_size", 32768),
+            ciphers=config.get("ssh_ciphers", cls.DEFAULT_CIPHERS),
+            compress=config.get("ssh_compression", False)
+        )
+    
+    @classmethod
+    def connect(cls, config, logger, max_retries=3, **credentials):
+        """Connexion au serveur de backup avec retry (backoff exponentiel); un refus d'authentification n'est pas retenté"""
+        import paramiko
+        
+        for attempt in range(max_retries):
+            try:
+                ssh = paramiko.SSHClient()
+                
+                # Configuration pour accepter les clés inconnues en dev
+                ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                
+                ssh.connect(
+                    hostname=config["backup_host"],
+                    username=config["backup_user"],
+                    timeout=30,
+                    auth_timeout=30,
+                    banner_timeout=30,
+                    **credentials,
+                    **cls.from_config(config).connect_kwargs()
+                )
+                
+                logger.info(f"Connexion SSH établie vers {config['backup_host']}")
+                return ssh
+            
+            except paramiko.AuthenticationException:
+                raise
+            
+            except Exception as e:
+                logger.warning(f"Tentative {attempt + 1}/{max_retries} échouée: {str(e)}")
+                if attempt < max_retries - 1:
+                    time.sleep(2 ** attempt)  # Backoff exponentiel
+                else:
+                    raise e
+    
+    def connect_kwargs(self):
+        """Arguments supplémentaires pour SSHClient.connect"""
+        return {"transport_factory": self.transport_factory, "compress": self.compress}
+    
+    def transport_factory(self, sock, **kwargs):
+        import paramiko
+        transport = paramiko.Transport(sock, default_window_size=self.window_size,
+                                       default_max_packet_size=self.max_packet_size, **kwargs)
+        # Placer les chiffrements préférés en tête, sans retirer les autres (compatibilité serveur)
+        options = transport.get_security_options()
+        preferred = [cipher for cipher in self.ciphers if cipher in options.ciphers]
+        if preferred:
+            options.ciphers = tuple(preferred) + tuple(c for c in options.ciphers if c not in preferred)
+        return transport
+
+class TransferManifest:
+    """Manifeste de reprise d'un transfert partiel: plages vérifiées (offset -> SHA256)"""
+    
+    def __init__(self, size, chunk_size, chunks=None):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunks = dict(chunks or {})
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def loads(cls, data):
+        """Relire un manifeste JSON; retourne None s'il est illisible"""
+        try:
+            state = json.loads(data)
+            return cls(state["size"], state["chunk_size"], {int(offset): digest for offset, digest in state["chunks"].items()})
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+    
+    def dumps(self):
+        with self._lock:
+            chunks = {str(offset): digest for offset, digest in sorted(self.chunks.items())}
+        return json.dumps({"size": self.size, "chunk_size": self.chunk_size, "chunks": chunks})
+    
+    def add(self, offset, digest):
+        with self._lock:
+            self.chunks[offset] = digest
+    
+    def discard(self, offset):
+        with self._lock:
+            self.chunks.pop(offset, None)
+    
+    def ranges(self):
+        """Toutes les plages (offset, longueur) du fichier"""
+        return [(offset, min(self.chunk_size, self.size - offset)) for offset in range(0, self.size, self.chunk_size)]
+    
+    def pending_ranges(self):
+        """Plages restant à transférer"""
+        with self._lock:
+            return [(offset, length) for offset, length in self.ranges() if offset not in self.chunks]
+    
+    def verified_bytes(self):
+        with self._lock:
+            return sum(min(self.chunk_size, self.size - offset) for offset in self.chunks)
+    
+    def keep_matching(self, local_path):
+        """Ne conserver que les plages dont le contenu local correspond encore au manifeste"""
+        with open(local_path, "rb") as f:
+            for offset, length in self.ranges():
+                digest = self.chunks.get(offset)
+                if digest is not None and self.hash_range(f, offset, length) != digest:
+                    self.discard(offset)
+    
+    @staticmethod
+    def hash_range(fileobj, offset, length, buffer_size=1024 * 1024):
+        sha256_hash = hashlib.sha256()
+        fileobj.seek(offset)
+        while length > 0:
+            data = fileobj.read(min(length, buffer_size))
+            if not data:
+                break
+            sha256_hash.update(data)
+            length -= len(data)
+        return sha256_hash.hexdigest()
+
+class BandwidthLimiter:
+    """Seau à jetons partagé par tous les envois d'une tâche; débit par plage horaire, relu à chaud dans la configuration"""
+    
+    IDLE_GAP = 1.0
+    METER_INTERVAL = 2.0
+    
+    def __init__(self, logger, limit_mbps=None, schedule=(), config_file=None, reload_interval=10, burst_seconds=0.25):
+        self.logger = logger
+        self.config_file = config_file
+        self.reload_interval = reload_interval
+        self.burst_seconds = burst_seconds
+        self._lock = threading.Lock()
+        self._default = None
+        self._windows = []
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self._rate = None
+        self._checked = time.monotonic()
+        self._mtime = self._config_mtime()
+        # Débit réellement obtenu, mesuré sur les périodes d'envoi actives
+        self._observed = None
+        self._meter_bytes = 0
+        self._meter_seconds = 0.0
+        self._meter_last = None
+        self.configure(limit_mbps, schedule)
+    
+    @classmethod
+    def from_config(cls, logger, config, config_file=None):
+        return cls(logger, config.get("bandwidth_limit_mbps"), config.get("bandwidth_schedule", []), config_file,
+                   config.get("bandwidth_reload_interval", 10))
+    
+    def configure(self, limit_mbps, schedule):
+        """Remplacer la limite par défaut et les plages horaires (effet immédiat sur les envois en cours)"""
+        windows = [self._parse_window(window) for window in schedule or []]
+        with self._lock:
+            self._default = self._bytes_per_second(limit_mbps)
+            self._windows = windows
+    
+    @staticmethod
+    def _bytes_per_second(limit_mbps):
+        # 0 ou absent: pas de limite
+        return float(limit_mbps) * 1000 * 1000 / 8 if limit_mbps else None
+    
+    @classmethod
+    def _parse_window(cls, window):
+        """{"start": "01:00", "end": "05:00", "limit_mbps": 0} -> (minute de début, minute de fin, octets/s)"""
+        try:
+            minutes = []
+            for key in ("start", "end"):
+                hours, mins = (int(part) for part in window[key].split(":"))
+                if not (0 <= hours <= 24 and 0 <= mins < 60 and hours * 60 + mins <= 24 * 60):
+                    raise ValueError(window[key])
+                minutes.append(hours * 60 + mins)
+            return minutes[0], minutes[1], cls._bytes_per_second(window.get("limit_mbps"))
+        except (KeyError, ValueError, TypeError, AttributeError):
+            raise Exception(f"Plage de bande passante invalide: {window} (attendu: start/end au format HH:MM, limit_mbps)")
+    
+    def current_rate(self, now=None):
+        """Débit autorisé en octets/s à l'heure donnée (None: illimité); la première plage qui correspond l'emporte"""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self._windows:
+            # Une plage dont la fin précède le début passe minuit
+            if (start <= minute < end) if start <= end else (minute >= start or minute < end):
+                return rate
+        return self._default
+    
+    def consume(self, size):
+        """Réserver size octets; bloque juste le temps nécessaire pour respecter le débit courant"""
+        with self._lock:
+            self._reload_if_changed()
+            rate = self.current_rate()
+            now = time.monotonic()
+            self._measure(size, now)
+            if rate != self._rate:
+                self._rate_changed(rate)
+            if rate is None:
+                self._last = now
+                return
+            # Jetons accumulés depuis le dernier envoi, plafonnés à une courte rafale
+            self._tokens = min(rate * self.burst_seconds, self._tokens + (now - self._last) * rate)
+            self._last = now
+            self._tokens -= size
+            # La dette est remboursée par l'attente de cet envoi; les flux parallèles se partagent le débit
+            delay = -self._tokens / rate if self._tokens < 0 else 0
+        if delay > 0:
+            time.sleep(delay)
+    
+    def seed(self, rate):
+        """Débit attendu avant la première mesure (historique des tâches précédentes)"""
+        with self._lock:
+            if self._observed is None and rate:
+                self._observed = float(rate)
+    
+    def observed_rate(self):
+        """Débit d'envoi mesuré en octets/s (None tant qu'aucune mesure n'est disponible)"""
+        with self._lock:
+            return self._observed
+    
+    def _measure(self, size, now):
+        # Les pauses de plus d'une seconde (compression, VM suivante) ne comptent pas dans la durée
+        if self._meter_last is not None and now - self._meter_last < self.IDLE_GAP:
+            self._meter_seconds += now - self._meter_last
+        self._meter_last = now
+        self._meter_bytes += size
+        if self._meter_seconds >= self.METER_INTERVAL:
+            sample = self._meter_bytes / self._meter_seconds
+            self._observed = sample if self._observed is None else 0.7 * self._observed + 0.3 * sample
+            self._meter_bytes, self._meter_seconds = 0, 0.0
+    
+    def _rate_changed(self, rate):
+        self._rate = rate
+        self._tokens = 0.0
+        self.logger.info("Bande passante des envois: " + ("illimitée" if rate is None else f"{rate * 8 / 1000 / 1000:.0f} Mbit/s"))
+    
+    def _config_mtime(self):
+        try:
+            return os.path.getmtime(self.config_file) if self.config_file else None
+        except OSError:
+            return None
+    
+    def _reload_if_changed(self):
+        # Appelé sous le verrou: la configuration n'est relue que si le fichier a changé
+        now = time.monotonic()
+        if not self.config_file or now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        mtime = self._config_mtime()
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.config_file) as f:
+                config = json.load(f)
+            windows = [self._parse_window(window) for window in config.get("bandwidth_schedule", []) or []]
+        except Exception as e:
+            self.logger.warning(f"Limites de bande passante non rechargées: {str(e)}")
+            return
+        self._default = self._bytes_per_second(config.get("bandwidth_limit_mbps"))
+        self._windows = windows
+        self.logger.info("Limites de bande passante rechargées depuis la configuration")
+
+class RangeStreamWriter(BoundedBufferWriter):
+    """Flux séquentiel dont les blocs sont écrits à leur offset par plusieurs canaux SFTP en parallèle"""
+    
+    def __init__(self, pool, remote_path, streams=4, chunk_size=4 * 1024 * 1024, request_size=32768, limiter=None):
+        self.pool = pool
+        self.remote_path = remote_path
+        self.request_size = request_size
+        self.limiter = limiter
+        
+        # Le fichier distant doit exister avant l'ouverture en écriture positionnée
+        with pool.sftp() as sftp:
+            with sftp.open(remote_path, "wb"):
+                pass
+        super().__init__(None, chunk_size, max_chunks=streams * 2, workers=streams)
+    
+    def _drain(self):
+        try:
+            with self.pool.sftp() as sftp, sftp.open(self.remote_path, "r+b") as remote_file:
+                remote_file.set_pipelined(True)
+                remote_file.MAX_REQUEST_SIZE = self.request_size
+                
+                def write(offset, chunk):
+                    if self.limiter is not None:
+                        self.limiter.consume(len(chunk))
+                    remote_file.seek(offset)
+                    remote_file.write(chunk)
+                
+                self._consume(write)
+        except Exception as e:
+            if self._error is None:
+                self._error = e
+            self._consume(lambda offset, chunk: None)  # Vider la file pour débloquer le producteur
+
+class ParallelUploader:
+    """Envoi de gros fichiers par plages d'octets écrites en parallèle, en mode pipeline"""
+    
+    PART_SUFFIX = ".part"
+    MANIFEST_SUFFIX = ".part.manifest"
+    RANGES_SUFFIX = ".ranges"  # SHA256 par plage d'une archive envoyée, relu par --scrub
+    
+    def __init__(self, pool, logger, streams=4, chunk_size=64 * 1024 * 1024, request_size=32768, max_retries=3, limiter=None,
+                 verifier=None):
+        self.pool = pool
+        self.logger = logger
+        self.streams = max(1, int(streams))
+        self.chunk_size = chunk_size
+        self.request_size = request_size
+        self.max_retries = max(1, int(max_retries))
+        self.limiter = limiter  # BandwidthLimiter partagé par la tâche (None: pas de limite)
+        self.verifier = verifier  # RemoteVerifier (None: pas de contrôle sur le serveur)
+        self.verification = None  # Dernier contrôle distant: {"seconds", "bytes", "repaired"}
+    
+    @classmethod
+    def from_config(cls, pool, logger, config, limiter=None):
+        return cls(
+            pool, logger,
+            streams=config.get("upload_streams", 4),
+            chunk_size=int(config.get("upload_chunk_size_mb", 64) * 1024 * 1024),
+            request_size=int(config.get("sftp_request_size_kb", 32) * 1024),
+            max_retries=config.get("transfer_retries", 3),
+            limiter=limiter,
+            verifier=RemoteVerifier.from_config(pool, logger, config)
+        )
+    
+    def open_stream(self, remote_path, chunk_size=4 * 1024 * 1024):
+        """Flux d'écriture distant réparti sur plusieurs canaux (mode flux)"""
+        return RangeStreamWriter(self.pool, remote_path, self.streams, chunk_size, self.request_size, self.limiter)
+    
+    @staticmethod
+    def commit(sftp, part_path, final_path):
+        """Renommer le fichier complet vers son nom définitif"""
+        try:
+            sftp.posix_rename(part_path, final_path)
+        except IOError:
+            # Serveur sans l'extension posix-rename: renommage classique
+            try:
+                sftp.remove(final_path)
+            except IOError:
+                pass
+            sftp.rename(part_path, final_path)
+    
+    def upload(self, local_path, remote_path, progress=None, checksum=None):
+        """Envoyer un fichier local avec reprise sur coupure; retourne le débit obtenu en Mo/s (progress: octets acquittés)
+        
+        Avec checksum, le fichier partiel est contrôlé sur le serveur avant d'être renommé: seules les plages corrompues
+        sont renvoyées, et un fichier qui reste corrompu n'apparaît jamais sous son nom définitif.
+        """
+        file_name = os.path.basename(local_path)
+        size = os.path.getsize(local_path)
+        part_path = remote_path + self.PART_SUFFIX
+        manifest_path = remote_path + self.MANIFEST_SUFFIX
+        start = time.monotonic()
+        
+        for attempt in range(self.max_retries):
+            try:
+                manifest = self._resume_manifest(local_path, part_path, manifest_path, size)
+                if manifest.chunks:
+                    self.logger.info(f"Reprise du transfert de {file_name}: "
+                                     f"{manifest.verified_bytes() / (1024 * 1024):.1f} Mo déjà vérifiés sur le serveur")
+                streams = self._send_ranges(local_path, part_path, manifest_path, manifest, progress)
+                break
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                self.logger.warning(f"Transfert de {file_name} interrompu ({str(e)}), "
+                                    f"reprise dans {2 ** attempt}s")
+                time.sleep(2 ** attempt)
+        
+        elapsed = max(time.monotonic() - start, 1e-6)
+        rate = size / (1024 * 1024) / elapsed
+        self.logger.info(f"Transfert de {file_name}: {size / (1024 * 1024):.1f} Mo "
+                         f"en {elapsed:.1f}s ({rate:.1f} Mo/s, {streams} flux)")
+        
+        # Contrôle et réparation sur le fichier partiel: le manifeste reste disponible jusqu'à ce que les SHA256 concordent
+        if checksum is not None and self.verifier is not None:
+            self.verify(local_path, part_path, manifest_path, manifest, checksum)
+        
+        # Le fichier n'apparaît sous son nom définitif qu'une fois complet et vérifié
+        with self.pool.sftp() as sftp:
+            self.commit(sftp, part_path, remote_path)
+            if checksum is not None:
+                # Liste des SHA256 par plage conservée: --scrub contrôle l'archive par tranches, avec reprise
+                self._write_manifest(sftp, remote_path + self.RANGES_SUFFIX, manifest)
+            try:
+                sftp.remove(manifest_path)
+            except IOError:
+                pass
+        return rate
+    
+    def verify(self, local_path, part_path, manifest_path, manifest, checksum):
+        """Contrôler le fichier partiel sur le serveur; en cas d'écart, renvoyer uniquement les plages dont le SHA256 diffère"""
+        file_name = os.path.basename(part_path)[:-len(self.PART_SUFFIX)]
+        start = time.monotonic()
+        checked = repaired = 0
+        for attempt in range(self.max_retries + 1):
+            matches = self.verifier.verify(part_path, manifest.size, checksum)
+            if matches is None:
+                return
+            checked += manifest.size
+            if matches:
+                self.verification = {"seconds": time.monotonic() - start, "bytes": checked, "repaired": repaired}
+                return
+            if attempt == self.max_retries:
+                break
+            
+            # La liste des SHA256 par plage de l'envoi localise la corruption
+            ranges = self.verifier.corrupted_ranges(part_path, manifest)
+            checked += manifest.size
+            self.logger.warning(f"{file_name} corrompu sur le serveur: renvoi de {len(ranges)} plage(s) "
+                                f"({', '.join(f'{offset}+{length}' for offset, length in ranges[:8])}"
+                                f"{', ...' if len(ranges) > 8 else ''})")
+            self._repair(local_path, part_path, manifest_path, manifest, ranges)
+            repaired += sum(length for _, length in ranges)
+        raise Exception(f"Vérification sur le serveur de {file_name} échouée après {self.max_retries} renvoi(s)")
+    
+    def _repair(self, local_path, part_path, manifest_path, manifest, ranges):
+        """Réécrire des plages du fichier partiel depuis le fichier local et rétablir sa taille"""
+        with self.pool.sftp() as sftp:
+            # Plages retirées du manifeste pendant leur renvoi: une reprise ultérieure les renverrait
+            for offset, _ in ranges:
+                manifest.discard(offset)
+            self._write_manifest(sftp, manifest_path, manifest)
+            with sftp.open(part_path, "r+b") as remote_file, open(local_path, "rb") as local_file:
+                remote_file.MAX_REQUEST_SIZE = self.request_size
+                for offset, length in ranges:
+                    manifest.add(offset, self._send_range(local_file, remote_file, offset, length))
+            if sftp.stat(part_path).st_size != manifest.size:
+                sftp.truncate(part_path, manifest.size)
+            self._write_manifest(sftp, manifest_path, manifest)
+    
+    def _resume_manifest(self, local_path, part_path, manifest_path, size):
+        """Relire le manifeste distant et ne garder que les plages encore valides"""
+        with self.pool.sftp() as sftp:
+            try:
+                with sftp.open(manifest_path, "r") as manifest_file:
+                    manifest = TransferManifest.loads(manifest_file.read())
+                part_size = sftp.stat(part_path).st_size
+            except IOError:
+                manifest = None
+            
+            if manifest is None or (manifest.size, manifest.chunk_size) != (size, self.chunk_size):
+                # Nouveau transfert: fichier partiel vide
+                with sftp.open(part_path, "wb"):
+                    pass
+                manifest = TransferManifest(size, self.chunk_size)
+                self._write_manifest(sftp, manifest_path, manifest)
+                return manifest
+        
+        for offset, length in manifest.ranges():
+            if offset + length > part_size:
+                manifest.discard(offset)
+        # Le fichier local a pu changer depuis la tentative précédente
+        manifest.keep_matching(local_path)
+        return manifest
+    
+    def _write_manifest(self, sftp, manifest_path, manifest):
+        temp_path = manifest_path + ".tmp"
+        with sftp.open(temp_path, "w") as manifest_file:
+            manifest_file.write(manifest.dumps())
+        self.commit(sftp, temp_path, manifest_path)
+    
+    def _send_ranges(self, local_path, part_path, manifest_path, manifest, progress=None):
+        """Envoyer les plages manquantes; chaque plage acquittée est inscrite au manifeste"""
+        ranges = queue.Queue()
+        for pending in manifest.pending_ranges():
+            ranges.put(pending)
+        streams = max(1, min(self.streams, ranges.qsize()))
+        errors = []
+        manifest_lock = threading.Lock()
+        
+        def send_ranges():
+            try:
+                with self.pool.sftp() as sftp, sftp.open(part_path, "r+b") as remote_file, \
+                        open(local_path, "rb") as local_file:
+                    remote_file.MAX_REQUEST_SIZE = self.request_size
+                    while not errors:
+                        try:
+                            offset, length = ranges.get_nowait()
+                        except queue.Empty:
+                            return
+                        manifest.add(offset, self._send_range(local_file, remote_file, offset, length))
+                        with manifest_lock:
+                            self._write_manifest(sftp, manifest_path, manifest)
+                        if progress is not None:
+                            progress(manifest.verified_bytes())
+            except Exception as e:
+                errors.append(e)
+        
+        workers = [threading.Thread(target=send_ranges, daemon=True) for _ in range(streams)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            raise errors[0]
+        return streams
+    
+    def _send_range(self, local_file, remote_file, offset, length):
+        """Envoyer une plage en pipeline puis attendre l'acquittement du serveur; retourne son SHA256"""
+        sha256_hash = hashlib.sha256()
+        local_file.seek(offset)
+        remote_file.seek(offset)
+        remote_file.set_pipelined(True)
+        while length > 0:
+            data = local_file.read(min(length, 1024 * 1024))
+            if not data:
+                raise IOError(f"Fin de fichier inattendue dans {local_file.name}")
+            sha256_hash.update(data)
+            length -= len(data)
+            if self.limiter is not None:
+                self.limiter.consume(len(data))
+            if length == 0:
+                # Dernière requête synchrone: paramiko attend alors toutes les réponses en suspens
+                split = max(0, len(data) - self.request_size)
+                remote_file.write(data[:split])
+                remote_file.set_pipelined(False)
+                remote_file.write(data[split:])
+                remote_file.flush()
+            else:
+                remote_file.write(data)
+        return sha256_hash.hexdigest()
+
+class RemoteVerifier:
+    """Contrôle d'intégrité sur le serveur de backup: SHA256 calculé à distance (exec_command), sans rapatrier l'archive"""
+    
+    def __init__(self, pool, logger, command_timeout=3600, idle=False):
+        self.pool = pool
+        self.logger = logger
+        self.command_timeout = command_timeout
+        self.idle = idle  # Lecture en classe d'E/S « idle » (ionice) et priorité CPU minimale
+        self.available = True  # Faux dès que le serveur refuse l'exécution de commandes (compte SFTP seul)
+    
+    @classmethod
+    def from_config(cls, pool, logger, config):
+        if not config.get("verify_remote", True):
+            return None
+        return cls(pool, logger, command_timeout=config.get("verify_remote_timeout", 3600))
+    
+    def verify(self, remote_path, size, checksum):
+        """Comparer le SHA256 du fichier distant au condensat de l'envoi; None si le serveur ne permet pas le contrôle"""
+        start = time.monotonic()
+        output = self._run(self._idle(f"sha256sum {shlex.quote(remote_path)}"))
+        if output is None:
+            return None
+        elapsed = max(time.monotonic() - start, 1e-6)
+        matches = output.split()[0] == checksum
+        self.logger.info(f"Vérification sur le serveur de {os.path.basename(remote_path)}: "
+                         f"{size / (1024 * 1024):.1f} Mo en {elapsed:.1f}s ({size / (1024 * 1024) / elapsed:.1f} Mo/s) - "
+                         f"{'conforme' if matches else 'SHA256 différent'}")
+        return matches
+    
+    def corrupted_ranges(self, remote_path, manifest):
+        """Plages (offset, longueur) dont le SHA256 distant diffère de la liste par plage de l'envoi"""
+        ranges = manifest.ranges()
+        # Une seule commande pour toutes les plages: dd lit chaque plage à son offset, sha256sum la condense
+        script = (f"i=0; while [ $i -lt {len(ranges)} ]; do "
+                  f"dd if={shlex.quote(remote_path)} iflag=skip_bytes,count_bytes bs=1M "
+                  f"skip=$((i * {manifest.chunk_size})) count={manifest.chunk_size} 2>/dev/null | sha256sum; "
+                  f"i=$((i + 1)); done")
+        output = self._run(script)
+        if output is None:
+            return ranges
+        digests = [line.split()[0] for line in output.splitlines() if line.strip()]
+        return [(offset, length) for index, (offset, length) in enumerate(ranges)
+                if index >= len(digests) or digests[index] != manifest.chunks.get(offset)]
+    
+    def range_digest(self, remote_path, offset, length):
+        """SHA256 d'une plage lue sur le serveur (sans cache de pages si possible); None sans exécution de commandes"""
+        output = self._run(self._idle(f"sh -c {shlex.quote(self._direct_read(remote_path, offset, length) + ' | sha256sum')}"))
+        return output.split()[0] if output else None
+    
+    def file_digest(self, remote_path, size, rate=None, seconds=None, segment=64 * 1024 * 1024):
+        """SHA256 du fichier entier, lu par segments avec une pause après chacun pour ne pas dépasser `rate` octets/s
+        
+        Retourne None sans exécution de commandes, "" si la lecture a été interrompue au bout de `seconds` secondes.
+        """
+        count = max(1, -(-size // segment))
+        pause = ""
+        if rate:
+            # Le dernier segment, plus court, n'attend que pour ses propres octets
+            last = size - (count - 1) * segment
+            pause = f"if [ $i -lt {count - 1} ]; then sleep {segment / rate:.3f}; else sleep {last / rate:.3f}; fi; "
+        script = (f"i=0; while [ $i -lt {count} ]; do "
+                  f"{self._direct_read(remote_path, f'$((i * {segment}))', segment)}; {pause}i=$((i + 1)); done | sha256sum")
+        command = f"sh -c {shlex.quote(script)}"
+        if seconds:
+            command = f"timeout {max(1, int(seconds))} {command}"
+        limit = seconds + 60 if seconds else max(self.command_timeout, size / rate * 2 if rate else 0)
+        output = self._run(self._idle(command), limit, cut_status=124 if seconds else None)
+        return output.split()[0] if output else output
+    
+    @staticmethod
+    def _direct_read(remote_path, offset, length):
+        """Commande dd lisant une plage en E/S directes (O_DIRECT), ou par le cache si le système de fichiers les refuse"""
+        path = shlex.quote(remote_path)
+        return (f"f=skip_bytes,count_bytes; dd if={path} iflag=direct count=0 2>/dev/null && f=direct,$f; "
+                f"dd if={path} iflag=$f bs=1M skip={offset} count={length} 2>/dev/null")
+    
+    def _idle(self, command):
+        if not self.idle:
+            return command
+        return (f"if command -v ionice >/dev/null 2>&1; then ionice -c3 nice -n 19 {command}; "
+                f"else nice -n 19 {command}; fi")
+    
+    def _run(self, command, timeout=None, cut_status=None):
+        if not self.available:
+            return None
+        try:
+            status, stdout, stderr = self.pool.run(command, timeout or self.command_timeout)
+        except Exception as e:
+            # Canal de commande refusé par le serveur: l'envoi reste valide, seul le contrôle distant manque
+            self.available = False
+            self.logger.warning(f"Vérification sur le serveur impossible (exécution de commandes refusée): {str(e)}")
+            return None
+        if status == 127:
+            self.available = False
+            self.logger.warning(f"Vérification sur le serveur impossible: {stderr.strip() or 'sha256sum introuvable'}")
+            return None
+        if cut_status is not None and status == cut_status:
+            return ""
+        if status != 0:
+            raise Exception(f"Commande de vérification en échec (code {status}): {stderr.strip()}")
+        return stdout
+
+class ResumableDownloader:
+    """Téléchargement par blocs avec reprise: fichier local .part et manifeste des blocs vérifiés"""
+    
+    def __init__(self, pool, logger, chunk_size=64 * 1024 * 1024, max_retries=3):
+        self.pool = pool
+        self.logger = logger
+        self.chunk_size = chunk_size
+        self.max_retries = max(1, int(max_retries))
+    
+    @classmethod
+    def from_config(cls, pool, logger, config):
+        return cls(
+            pool, logger,
+            chunk_size=int(config.get("upload_chunk_size_mb", 64) * 1024 * 1024),
+            max_retries=config.get("transfer_retries", 3)
+        )
+    
+    def download(self, remote_path, local_path):
+        """Télécharger un fichier distant; une tentative interrompue reprend au dernier bloc vérifié"""
+        file_name = os.path.basename(remote_path)
+        part_path = local_path + ParallelUploader.PART_SUFFIX
+        manifest_path = local_path + ParallelUploader.MANIFEST_SUFFIX
+        start = time.monotonic()
+        
+        for attempt in range(self.max_retries):
+            try:
+                with self.pool.sftp() as sftp:
+                    size = sftp.stat(remote_path).st_size
+                manifest = self._resume_manifest(part_path, manifest_path, size)
+                if manifest.chunks:
+                    self.logger.info(f"Reprise du téléchargement de {file_name}: "
+                                     f"{manifest.verified_bytes() / (1024 * 1024):.1f} Mo déjà reçus")
+                self._fetch_ranges(remote_path, part_path, manifest_path, manifest)
+                break
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise
+                self.logger.warning(f"Téléchargement de {file_name} interrompu ({str(e)}), "
+                                    f"reprise dans {2 ** attempt}s")
+                time.sleep(2 ** attempt)
+        
+        os.replace(part_path, local_path)
+        os.remove(manifest_path)
+        
+        elapsed = max(time.monotonic() - start, 1e-6)
+        rate = size / (1024 * 1024) / elapsed
+        self.logger.info(f"Téléchargement de {file_name}: {size / (1024 * 1024):.1f} Mo "
+                         f"en {elapsed:.1f}s ({rate:.1f} Mo/s)")
+        return rate
+    
+    def _resume_manifest(self, part_path, manifest_path, size):
+        manifest = None
+        if os.path.exists(part_path):
+            try:
+                with open(manifest_path, "r") as manifest_file:
+                    manifest = TransferManifest.loads(manifest_file.read())
+            except IOError:
+                pass
+        
+        if manifest is None or (manifest.size, manifest.chunk_size) != (size, self.chunk_size):
+            open(part_path, "wb").close()
+            manifest = TransferManifest(size, self.chunk_size)
+            self._write_manifest(manifest_path, manifest)
+            return manifest
+        
+        part_size = os.path.getsize(part_path)
+        for offset, length in manifest.ranges():
+            if offset + length > part_size:
+                manifest.discard(offset)
+        # Relire les blocs déjà reçus: une écriture interrompue ne doit pas être conservée
+        manifest.keep_matching(part_path)
+        return manifest
+    
+    @staticmethod
+    def _write_manifest(manifest_path, manifest):
+        temp_path = manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            manifest_file.write(manifest.dumps())
+        os.replace(temp_path, manifest_path)
+    
+    def _fetch_ranges(self, remote_path, part_path, manifest_path, manifest):
+        with self.pool.sftp() as sftp, sftp.open(remote_path, "rb") as remote_file, \
+                open(part_path, "r+b") as local_file:
+            for offset, length in manifest.pending_ranges():
+                # Lecture en pipeline d'une plage complète
+                data = b"".join(remote_file.readv([(offset, length)]))
+                if len(data) != length:
+                    raise IOError(f"Lecture incomplète de {remote_path} à l'offset {offset}")
+                local_file.seek(offset)
+                local_file.write(data)
+                local_file.flush()
+                os.fsync(local_file.fileno())
+                manifest.add(offset, hashlib.sha256(data).hexdigest())
+                self._write_manifest(manifest_path, manifest)
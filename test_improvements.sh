@@ -62,7 +62,7 @@ print(f'\\nRésultat validation: {\"SUCCÈS\" if all_passed else \"ÉCHEC\"}')
 
 echo
 echo "3. Test de la compilation du script principal..."
-python3 -m py_compile auth_kvm_backup.py
+python3 -m py_compile auth_kvm_backup.py kvm_backup_*.py
 if [ $? -eq 0 ]; then
     echo "✓ Script compilé avec succès"
 else
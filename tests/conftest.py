@@ -0,0 +1,107 @@
+"""Outils communs aux tests: serveur SFTP simulé sur un répertoire local, sans paramiko ni réseau"""
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeSFTPFile:
+    """Fichier distant simulé: fichier local plus les méthodes de paramiko.SFTPFile utilisées par l'outil"""
+
+    MAX_REQUEST_SIZE = 32768
+
+    def __init__(self, path, mode, sftp):
+        self._file = open(path, mode if "b" in mode else mode + "b")
+        self._sftp = sftp
+        self.name = path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readv(self, chunks):
+        for offset, length in chunks:
+            self._file.seek(offset)
+            yield self._file.read(length)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self._sftp.fail_after is not None:
+            if self._sftp.fail_after <= 0:
+                raise IOError("Connexion perdue")
+            self._sftp.fail_after -= 1
+        self._sftp.written[self.name] = self._sftp.written.get(self.name, 0) + len(data)
+        self._file.write(data)
+
+    def seek(self, offset, whence=0):
+        self._file.seek(offset, whence)
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class FakeSFTP:
+    """Client SFTP simulé: les chemins distants sont des chemins locaux"""
+
+    def __init__(self):
+        self.written = {}  # Octets écrits par chemin
+        self.fail_after = None  # Nombre d'écritures acceptées avant une coupure simulée
+
+    def open(self, path, mode="r"):
+        return FakeSFTPFile(path, mode, self)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def remove(self, path):
+        os.remove(path)
+
+    def rename(self, source, target):
+        if os.path.exists(target):
+            raise IOError(f"{target} existe déjà")
+        os.rename(source, target)
+
+    def posix_rename(self, source, target):
+        os.replace(source, target)
+
+    def truncate(self, path, size):
+        os.truncate(path, size)
+
+
+class FakePool:
+    """Pool simulé: chaque emprunt rend le même FakeSFTP; aucune commande ne peut être exécutée"""
+
+    def __init__(self):
+        self.client = FakeSFTP()
+        self.borrowed = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def sftp(self):
+        with self._lock:
+            self.borrowed += 1
+        yield self.client
+
+    def run(self, command, timeout=None):
+        return 127, "", "exécution de commandes indisponible"
+
+
+@pytest.fixture
+def pool():
+    return FakePool()
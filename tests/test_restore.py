@@ -0,0 +1,114 @@
+"""Restauration en flux: lecture par fenêtres, écriture des disques et mise en place"""
+import logging
+import os
+
+import pytest
+
+from kvm_backup_archive import CompressionEngine, StreamingArchiver
+from kvm_backup_restore import DiskImageWriter, RemoteReadahead, StreamingRestorer
+
+
+def disk_xml(*paths):
+    disks = "".join(f"<disk type='file' device='disk'><driver name='qemu' type='raw'/><source file='{path}'/>"
+                    f"<target dev='vd{chr(97 + i)}'/></disk>" for i, path in enumerate(paths))
+    return (f"<domain><name>vm1</name><devices>{disks}<disk type='file' device='cdrom'>"
+            f"<source file='/iso/install.iso'/><target dev='hdc'/></disk></devices></domain>")
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Archive de vm1 avec deux disques (un creux), écrite par le pipeline de production"""
+    first, second = tmp_path / "system.img", tmp_path / "data.qcow2"
+    with open(first, "wb") as f:
+        f.write(os.urandom(1 << 20))
+        f.seek(5 << 20)
+        f.write(os.urandom(4096))
+    second.write_bytes(b"QFI\xfb" + os.urandom(700 * 1024))
+    xml_config = disk_xml(first, second)
+    path = tmp_path / "vm1_20250301-010000.full.tar.gz"
+    engine = CompressionEngine("gzip", threads=2)
+    try:
+        with open(path, "wb") as f:
+            StreamingArchiver(logging.getLogger("test"), engine).write_archive(
+                f, "vm1", xml_config, [("vm1_system.img", str(first)), ("vm1_data.qcow2", str(second))])
+    finally:
+        engine.close()
+    return path, xml_config, {"vm1_system.img": first, "vm1_data.qcow2": second}
+
+
+def restorer(pool, images_dir):
+    return StreamingRestorer(pool, logging.getLogger("test"), str(images_dir), window_size=64 * 1024, windows=4, streams=2)
+
+
+def test_readahead_returns_file_in_order(pool, tmp_path):
+    data = os.urandom(1 << 20) + b"fin"
+    path = tmp_path / "remote"
+    path.write_bytes(data)
+    reader = RemoteReadahead(pool, str(path), len(data), window_size=50000, windows=3, streams=3)
+    try:
+        chunks = []
+        while True:
+            chunk = reader.read(70000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        reader.close()
+    assert b"".join(chunks) == data
+
+
+def test_restore_archive(pool, tmp_path, archive):
+    path, xml_config, sources = archive
+    images = tmp_path / "images"
+    images.mkdir()
+    teardown = []
+    restored_xml, restored = restorer(pool, images).restore_archive(str(path), path.name, "vm1", teardown.append)
+    assert teardown == [xml_config] and restored_xml == xml_config
+    assert sorted(restored) == ["vm1_data.qcow2", "vm1_system.img"]
+    for name, source in sources.items():
+        assert open(restored[name], "rb").read() == source.read_bytes()
+    assert sorted(os.listdir(images)) == ["vm1_data.qcow2", "vm1_system.img"]
+
+    relocated = StreamingRestorer.relocate_disks(xml_config, "vm1", restored)
+    assert f"file=\"{restored['vm1_system.img']}\"" in relocated
+    # Type du pilote recalé sur le contenu écrit; le lecteur CD-ROM n'est pas touché
+    assert relocated.count('type="qcow2"') == 1 and "/iso/install.iso" in relocated
+
+
+def test_failure_before_replace_keeps_existing_vm(pool, tmp_path, archive):
+    path, _, _ = archive
+    images = tmp_path / "images"
+    images.mkdir()
+    (images / "vm1_system.img").write_bytes(b"disque existant")
+
+    def teardown(xml_config):
+        raise RuntimeError("hyperviseur indisponible")
+
+    with pytest.raises(RuntimeError):
+        restorer(pool, images).restore_archive(str(path), path.name, "vm1", teardown)
+    assert os.listdir(images) == ["vm1_system.img"]
+    assert (images / "vm1_system.img").read_bytes() == b"disque existant"
+
+
+def test_truncated_archive_does_not_call_teardown(pool, tmp_path, archive):
+    path, _, _ = archive
+    truncated = tmp_path / path.name.replace("vm1_", "vm1_cut")
+    truncated.write_bytes(path.read_bytes()[:os.path.getsize(path) // 2])
+    images = tmp_path / "images"
+    images.mkdir()
+    teardown = []
+    with pytest.raises(Exception):
+        restorer(pool, images).restore_archive(str(truncated), truncated.name, "vm1", teardown.append)
+    assert teardown == [] and os.listdir(images) == []
+
+
+def test_disk_writer_abort_after_close(tmp_path):
+    writer = DiskImageWriter(str(tmp_path / "disk.part"), 8192)
+    writer.write(4096, b"x" * 4096)
+    writer.write(0, b"\0" * 4096)
+    writer.close()
+    assert os.path.getsize(tmp_path / "disk.part") == 8192
+    # Abandon après fermeture: pas de double fermeture du descripteur, fichier partiel supprimé
+    writer.abort()
+    writer.abort()
+    assert not (tmp_path / "disk.part").exists()
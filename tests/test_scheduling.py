@@ -0,0 +1,127 @@
+"""Planification, rétention et limites de concurrence"""
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+from kvm_backup_core import ResourceSlots
+from kvm_backup_daemon import CronSchedule
+from kvm_backup_retention import RetentionPolicy
+
+
+def entry(archive, date, backup_type="full", parent=None):
+    return {"vm": "vm1", "archive": archive, "date": date, "type": backup_type, "parent": parent}
+
+
+class TestCronSchedule:
+    def test_next_run_steps(self):
+        schedule = CronSchedule("*/15 2 * * *")
+        assert schedule.next_run(datetime(2025, 3, 1, 2, 7, 30)) == datetime(2025, 3, 1, 2, 15)
+        assert schedule.next_run(datetime(2025, 3, 1, 2, 45)) == datetime(2025, 3, 2, 2, 0)
+
+    def test_next_run_is_strictly_after(self):
+        assert CronSchedule("30 1 * * *").next_run(datetime(2025, 3, 1, 1, 30)) == datetime(2025, 3, 2, 1, 30)
+
+    def test_weekday_zero_is_sunday(self):
+        # 1er mars 2025: samedi
+        assert CronSchedule("0 3 * * 0").next_run(datetime(2025, 3, 1, 12, 0)) == datetime(2025, 3, 2, 3, 0)
+
+    def test_day_of_month_or_weekday(self):
+        # Jour du mois et jour de la semaine restreints: l'un ou l'autre suffit, comme cron
+        schedule = CronSchedule("0 0 15 * 1")
+        assert schedule.matches(datetime(2025, 3, 15, 0, 0))  # samedi 15
+        assert schedule.matches(datetime(2025, 3, 3, 0, 0))  # lundi 3
+        assert not schedule.matches(datetime(2025, 3, 4, 0, 0))
+
+    def test_impossible_date(self):
+        with pytest.raises(Exception, match="aucune date"):
+            CronSchedule("0 0 31 2 *").next_run(datetime(2025, 1, 1))
+
+    def test_invalid_expression(self):
+        with pytest.raises(Exception, match="invalide"):
+            CronSchedule("0 0 * *")
+
+
+class TestRetentionPolicy:
+    def test_daily_keeps_latest_of_each_day(self):
+        entries = [entry(f"a{day}{hour}", f"2025-03-{day:02d} {hour:02d}:00:00") for day in (1, 2, 3) for hour in (1, 13)]
+        kept, expired = RetentionPolicy(keep_last=1, daily=2, weekly=0, monthly=0).select(entries)
+        assert [e["archive"] for e in kept] == ["a313", "a213"]
+        assert len(expired) == 4
+
+    def test_keep_last(self):
+        entries = [entry(f"a{hour}", f"2025-03-01 {hour:02d}:00:00") for hour in range(5)]
+        kept, _ = RetentionPolicy(keep_last=3, daily=0, weekly=0, monthly=0).select(entries)
+        assert [e["archive"] for e in kept] == ["a4", "a3", "a2"]
+
+    def test_incremental_keeps_its_chain(self):
+        entries = [
+            entry("full", "2025-03-01 01:00:00"),
+            entry("incr1", "2025-03-02 01:00:00", "incr", "full"),
+            entry("incr2", "2025-03-03 01:00:00", "incr", "incr1"),
+            entry("old", "2025-02-01 01:00:00"),
+        ]
+        kept, expired = RetentionPolicy(keep_last=1, daily=0, weekly=0, monthly=0).select(entries)
+        assert {e["archive"] for e in kept} == {"incr2", "incr1", "full"}
+        assert [e["archive"] for e in expired] == ["old"]
+
+    def test_unknown_parent_keeps_up_to_previous_full(self):
+        entries = [
+            entry("older", "2025-02-27 01:00:00"),
+            entry("full", "2025-03-01 01:00:00"),
+            entry("incr1", "2025-03-02 01:00:00", "incr", None),
+            entry("incr2", "2025-03-03 01:00:00", "incr", "missing"),
+        ]
+        kept, _ = RetentionPolicy(keep_last=1, daily=0, weekly=0, monthly=0).select(entries)
+        assert {e["archive"] for e in kept} == {"incr2", "incr1", "full"}
+
+
+class TestResourceSlots:
+    def test_limit_is_enforced(self):
+        slots = ResourceSlots(disk_read=1, compression=2, upload=1)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def work():
+            with slots.acquire("compression"):
+                with lock:
+                    active[0] += 1
+                    peak[0] = max(peak[0], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=work) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert peak[0] == 2
+
+    def test_tracking_measures_wait_and_hold(self):
+        slots = ResourceSlots(upload=1)
+        released = threading.Event()
+
+        def holder():
+            with slots.acquire("upload"):
+                released.wait(1)
+
+        thread = threading.Thread(target=holder)
+        thread.start()
+        time.sleep(0.01)
+        slots.start_tracking()
+        timer = threading.Timer(0.05, released.set)
+        timer.start()
+        with slots.acquire("upload"):
+            time.sleep(0.01)
+        stages = slots.stop_tracking()
+        thread.join()
+        wait, held = stages["upload"]
+        assert wait >= 0.03 and held >= 0.01
+        assert slots.stop_tracking() == {}
+
+    def test_from_config_is_bounded_by_jobs(self):
+        slots = ResourceSlots.from_config({"upload_slots": 3}, jobs=1)
+        assert slots.limits["disk_read"] == 1 and slots.limits["upload"] == 3
+        assert str(slots).startswith("disk_read=1")
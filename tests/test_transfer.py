@@ -0,0 +1,106 @@
+"""Envoi par plages parallèles et reprise d'un transfert interrompu"""
+import hashlib
+import json
+import logging
+import os
+
+import pytest
+
+from kvm_backup_transfer import ParallelUploader, TransferManifest
+
+CHUNK = 256 * 1024
+
+
+def make_file(path, size):
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+
+def uploader(pool, **kwargs):
+    return ParallelUploader(pool, logging.getLogger("test"), streams=kwargs.pop("streams", 3), chunk_size=CHUNK,
+                            max_retries=1, **kwargs)
+
+
+class TestTransferManifest:
+    def test_ranges(self):
+        manifest = TransferManifest(CHUNK * 2 + 10, CHUNK)
+        assert manifest.ranges() == [(0, CHUNK), (CHUNK, CHUNK), (2 * CHUNK, 10)]
+        manifest.add(CHUNK, "x")
+        assert manifest.pending_ranges() == [(0, CHUNK), (2 * CHUNK, 10)]
+        assert manifest.verified_bytes() == CHUNK
+
+    def test_dumps_loads(self):
+        manifest = TransferManifest(1000, 100, {0: "a", 200: "b"})
+        loaded = TransferManifest.loads(manifest.dumps())
+        assert (loaded.size, loaded.chunk_size, loaded.chunks) == (1000, 100, {0: "a", 200: "b"})
+        assert TransferManifest.loads("{pas du json") is None
+        assert TransferManifest.loads(json.dumps({"size": 1})) is None
+
+    def test_keep_matching_drops_changed_ranges(self, tmp_path):
+        path = make_file(tmp_path / "a", 3 * CHUNK)
+        manifest = TransferManifest(3 * CHUNK, CHUNK)
+        with open(path, "rb") as f:
+            for offset, length in manifest.ranges():
+                manifest.add(offset, TransferManifest.hash_range(f, offset, length))
+        with open(path, "r+b") as f:
+            f.seek(CHUNK + 5)
+            f.write(b"!")
+        manifest.keep_matching(path)
+        assert manifest.pending_ranges() == [(CHUNK, CHUNK)]
+
+
+class TestParallelUploader:
+    def test_upload_commits_complete_file(self, pool, tmp_path):
+        source = make_file(tmp_path / "archive.tar.gz", 5 * CHUNK + 123)
+        remote = str(tmp_path / "remote.tar.gz")
+        checksum = hashlib.sha256(open(source, "rb").read()).hexdigest()
+        uploader(pool).upload(source, remote, checksum=checksum)
+        assert open(remote, "rb").read() == open(source, "rb").read()
+        assert not os.path.exists(remote + ParallelUploader.PART_SUFFIX)
+        assert not os.path.exists(remote + ParallelUploader.MANIFEST_SUFFIX)
+        # Liste des SHA256 par plage gardée pour --scrub
+        ranges = TransferManifest.loads(open(remote + ParallelUploader.RANGES_SUFFIX).read())
+        assert len(ranges.chunks) == 6
+
+    def test_resume_sends_only_missing_ranges(self, pool, tmp_path):
+        source = make_file(tmp_path / "archive.tar.gz", 8 * CHUNK)
+        remote = str(tmp_path / "remote.tar.gz")
+        # Coupure après quelques écritures: le fichier partiel et son manifeste restent sur le serveur
+        pool.client.fail_after = 6
+        with pytest.raises(IOError):
+            uploader(pool, streams=1).upload(source, remote)
+        manifest = TransferManifest.loads(open(remote + ParallelUploader.MANIFEST_SUFFIX).read())
+        assert 0 < len(manifest.chunks) < 8
+        assert not os.path.exists(remote)
+
+        pool.client.fail_after = None
+        pool.client.written = {}
+        uploader(pool).upload(source, remote)
+        assert open(remote, "rb").read() == open(source, "rb").read()
+        # Seules les plages absentes du manifeste sont renvoyées
+        assert pool.client.written[remote + ParallelUploader.PART_SUFFIX] == (8 - len(manifest.chunks)) * CHUNK
+
+    def test_resume_resends_ranges_changed_locally(self, pool, tmp_path):
+        source = make_file(tmp_path / "archive.tar.gz", 4 * CHUNK)
+        remote = str(tmp_path / "remote.tar.gz")
+        pool.client.fail_after = 4
+        with pytest.raises(IOError):
+            uploader(pool, streams=1).upload(source, remote)
+        with open(source, "r+b") as f:
+            f.write(b"change")
+        pool.client.fail_after = None
+        uploader(pool).upload(source, remote)
+        assert open(remote, "rb").read() == open(source, "rb").read()
+
+    def test_commit_without_posix_rename(self, pool, tmp_path):
+        part, final = tmp_path / "f.part", tmp_path / "f"
+        part.write_bytes(b"new")
+        final.write_bytes(b"old")
+
+        def refuse(source, target):
+            raise IOError("extension posix-rename absente")
+
+        pool.client.posix_rename = refuse
+        ParallelUploader.commit(pool.client, str(part), str(final))
+        assert final.read_bytes() == b"new" and not part.exists()